@@ -7,25 +7,94 @@ SETUP:
   pip install flask flask-cors anthropic
   python server.py
 
+PROGRESS:
+  Progress from the old ~/.codemaster_pro_v3.json is imported once and kept for
+  its owner: set CODEMASTER_SINGLE_USER=1 for a personal install (the first new
+  visitor gets it), open the app from localhost, or run
+  `python app.py claim-legacy <cm_uid cookie value>`.
+
+CONTENT:
+  Edit content/*.json, then run `python app.py build-content`.
+  Running workers pick up the new pack automatically (no restart).
+
+LIBS:
+  `python app.py vendor-libs` vendors the front-end libs into static/ (see --help);
+  a lib pinned in libs.lock.json must match its sha384 pin, an unpinned one is
+  installed with a warning. `vendor-libs --update-lock` pins what was vendored:
+  check the printed hashes against the publisher's SRI before committing the lock,
+  then set CODEMASTER_LIBS_REQUIRE_PIN=1 to refuse anything unpinned.
+  Set CODEMASTER_LIBS_BUNDLE to a tarball from `--make-bundle` for offline hosts.
+
+BENCHMARKS:
+  `python bench.py --items 1000,10000 --out bench.json`, then `--baseline bench.json`
+  on later runs to fail on latency regressions (see --help).
+  `python loadtest.py --workers 4 --clients 64` runs gunicorn under concurrent
+  load and counts lost progress updates.
+
+SANDBOX:
+  Exercise grading runs submissions in sandbox.py. Start the server as root (the
+  sandbox switches to CODEMASTER_SANDBOX_USER, `nobody` by default) or set
+  CODEMASTER_SANDBOX_WRAPPER to a bwrap/nsjail command; otherwise grading is off.
+
 GitHub / Railway / Render: set ANTHROPIC_API_KEY as env var.
 """
 
 import os
+import sys
+import atexit
+import base64
+import bisect
 import json
 import time
+import queue
 import random
+import re
+import secrets
+import shlex
+import socket
+import sqlite3
+import struct
 import hashlib
+import heapq
+import math
+import mimetypes
+import mmap
 import threading
+import unicodedata
+import urllib.parse
 import urllib.request
-from functools import wraps
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, request, send_from_directory, Response, redirect, abort
+from flask import Flask, jsonify, request, send_file, Response, redirect, abort, g
 from flask_cors import CORS
+try:
+    import fcntl
+except ImportError:  # Windows: only the local/redis state backends are available
+    fcntl = None
+try:
+    import brotli
+except ImportError:  # optional: `pip install brotli` adds br next to gzip
+    brotli = None
 
 # ─── Constants ────────────────────────────────────────────────────────────────
 BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR  = os.path.join(BASE_DIR, "static")
-PROGRESS_F  = os.path.join(os.path.expanduser("~"), ".codemaster_pro_v3.json")
+PROGRESS_F  = os.path.join(os.path.expanduser("~"), ".codemaster_pro_v3.json")  # legacy, migrated
+PROGRESS_DB = os.environ.get("CODEMASTER_PROGRESS_DB",
+                             os.path.join(os.path.expanduser("~"), ".codemaster_pro_v3.db"))
+# Durability: "full" fsyncs every commit, "batch" on WAL checkpoints, "off" never.
+PROGRESS_DURABILITY     = os.environ.get("CODEMASTER_PROGRESS_DURABILITY", "batch")
+PROGRESS_WRITE_BEHIND   = os.environ.get("CODEMASTER_PROGRESS_WRITE_BEHIND", "0") == "1"
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("CODEMASTER_PROGRESS_FLUSH_INTERVAL", "0.5"))
+PROGRESS_FLUSH_MAX      = int(os.environ.get("CODEMASTER_PROGRESS_FLUSH_MAX", "256"))
+# Local single-user install: the first new visitor takes over the migrated JSON
+# progress. Elsewhere only a direct localhost visit does, or `claim-legacy`.
+SINGLE_USER = os.environ.get("CODEMASTER_SINGLE_USER", "0") == "1"
 
 # FIX #1: API key via environment variable — never hardcode!
 API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
@@ -35,29 +104,793 @@ os.makedirs(STATIC_DIR, exist_ok=True)
 app = Flask(__name__, static_folder=STATIC_DIR, static_url_path="/static")
 CORS(app, resources={r"/api/*": {"origins": "*"}})  # Restrict in production
 
-# ─── Simple in-memory rate limiter (FIX #2) ───────────────────────────────────
-_rate_store: dict = {}
-_rate_lock = threading.Lock()
+# ══════════════════════════════════════════════════════════════════════════════
+#  METRICS
+#  Prometheus text format on /metrics. Every metric keeps one pre-allocated
+#  series per label combination (fixed bucket counts + sum), so recording is a
+#  bisect and two in-place adds under the series' lock. With
+#  CODEMASTER_METRICS_DIR set, each worker also dumps its series to
+#  <dir>/<pid>.json every few seconds and /metrics sums all the files, so the
+#  numbers cover every gunicorn worker (dead workers' counts are kept).
+# ══════════════════════════════════════════════════════════════════════════════
+METRICS_DIR            = os.environ.get("CODEMASTER_METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("CODEMASTER_METRICS_FLUSH_INTERVAL", "5"))
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOCK_BUCKETS    = (1e-6, 5e-6, 2.5e-5, 1e-4, 5e-4, 0.001, 0.0025, 0.01, 0.05, 0.25, 1)
+
+class _Series:
+    """Counts per bucket (the last one is +Inf) and their sum; a counter is a
+    series without buckets whose value is `sum`."""
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum    = 0.0
+        self.lock   = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.sum += amount
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+class Metric:
+    """Counter (no buckets) or histogram; labels(...) returns the series to record on."""
+    registry: list = []
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = None):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = buckets
+        self.kind    = "histogram" if buckets else "counter"
+        self._series: dict = {}
+        self._lock   = threading.Lock()
+        Metric.registry.append(self)
+
+    def labels(self, *values) -> _Series:
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, _Series(self.buckets or ()))
+        return series
+
+    def snapshot(self) -> list:
+        return [[list(values), list(s.counts), s.sum] for values, s in list(self._series.items())]
+
+    def load(self, entries: list):
+        for values, counts, total in entries:
+            series = self.labels(*values)
+            with series.lock:
+                series.counts = [a + b for a, b in zip(series.counts, counts)]
+                series.sum   += total
+
+def _metrics_snapshot() -> dict:
+    return {m.name: m.snapshot() for m in Metric.registry}
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names: tuple, values, le: str = None) -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render_metrics(snapshots: list) -> str:
+    """Prometheus text exposition of the summed snapshots."""
+    lines = []
+    for m in Metric.registry:
+        merged: dict = {}
+        for snap in snapshots:
+            for values, counts, total in snap.get(m.name, ()):
+                key = tuple(values)
+                if key in merged:
+                    prev_counts, prev_total = merged[key]
+                    merged[key] = ([a + b for a, b in zip(prev_counts, counts)], prev_total + total)
+                else:
+                    merged[key] = (counts, total)
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for values, (counts, total) in sorted(merged.items()):
+            if m.kind == "counter":
+                lines.append(f"{m.name}{_label_text(m.labelnames, values)} {total:g}")
+                continue
+            cumulative = 0
+            for bound, count in zip(m.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{m.name}_bucket{_label_text(m.labelnames, values, le)} {cumulative}")
+            lines.append(f"{m.name}_sum{_label_text(m.labelnames, values)} {total:.9g}")
+            lines.append(f"{m.name}_count{_label_text(m.labelnames, values)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def _metrics_path(pid: int = None) -> str:
+    return os.path.join(METRICS_DIR, f"{pid or os.getpid()}.json")
+
+def write_metrics_snapshot():
+    tmp = f"{_metrics_path()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_metrics_snapshot(), f, separators=(",", ":"))
+    os.replace(tmp, _metrics_path())
+
+def collect_metrics() -> list:
+    """Snapshots of this worker, or of every worker in multiprocess mode."""
+    if not METRICS_DIR:
+        return [_metrics_snapshot()]
+    write_metrics_snapshot()
+    snapshots = []
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):  # a worker replacing its file right now
+                continue
+    return snapshots
+
+_metrics_pid = None
+
+def _start_metrics_worker():
+    """Per worker (after fork): continue a reused pid's counts and start dumping."""
+    global _metrics_pid
+    _metrics_pid = os.getpid()
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    try:
+        with open(_metrics_path(), encoding="utf-8") as f:
+            stale = json.load(f)
+        for m in Metric.registry:
+            m.load(stale.get(m.name, ()))
+    except (OSError, ValueError):
+        pass
+
+    def dump():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                write_metrics_snapshot()
+            except OSError as e:
+                app.logger.warning(f"metrics snapshot failed: {e}")
+    threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+
+def _reset_metrics_after_fork():
+    # The parent's counts belong to the parent. Zeroed in place: hot paths keep
+    # pre-resolved series; locks are replaced in case one was held at fork time.
+    for m in Metric.registry:
+        m._lock = threading.Lock()
+        for series in m._series.values():
+            series.counts = [0] * len(series.counts)
+            series.sum    = 0.0
+            series.lock   = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_metrics_after_fork)
+
+m_requests     = Metric("codemaster_http_requests_total", "HTTP requests.", ("route", "method", "status"))
+m_latency      = Metric("codemaster_http_request_duration_seconds", "Time to build the response.",
+                        ("route",), LATENCY_BUCKETS)
+m_rate_limited = Metric("codemaster_rate_limited_total", "Requests rejected with 429.", ("route",))
+m_lock_wait    = Metric("codemaster_lock_wait_seconds", "Time spent waiting for a lock.", ("lock",), LOCK_BUCKETS)
+m_lock_hold    = Metric("codemaster_lock_hold_seconds", "Time a lock was held.", ("lock",), LOCK_BUCKETS)
+m_progress_write = Metric("codemaster_progress_write_seconds",
+                          "Progress transaction duration (one commit per batch).", (), LATENCY_BUCKETS)
+m_ai_latency   = Metric("codemaster_ai_upstream_seconds", "Upstream AI call duration.", ("kind",), LATENCY_BUCKETS)
+m_ai_errors    = Metric("codemaster_ai_upstream_errors_total", "Failed upstream AI calls.", ("kind",))
+_progress_write_series = m_progress_write.labels()
+
+@app.before_request
+def _metrics_start():
+    if _metrics_pid != os.getpid():
+        _start_metrics_worker()
+    g.metrics_t0 = time.perf_counter()
+
+# route -> method -> (latency series, request series by status - 100), bound on
+# first use so recording a request is two dict hits and a list index
+_route_series: dict = {}
+
+def _bind_route_series(route: str, method: str) -> tuple:
+    bound = (m_latency.labels(route), [None] * 500)
+    return _route_series.setdefault(route, {}).setdefault(method, bound)
+
+@app.after_request
+def _metrics_record(resp):
+    t0 = g.get("metrics_t0")
+    if t0 is not None:
+        route   = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        methods = _route_series.get(route)
+        bound   = methods.get(request.method) if methods is not None else None
+        if bound is None:
+            bound = _bind_route_series(route, request.method)
+        bound[0].observe(time.perf_counter() - t0)
+        slot   = resp.status_code - 100
+        series = bound[1][slot] if 0 <= slot < 500 else None
+        if series is None:
+            series = m_requests.labels(route, request.method, resp.status_code)
+            if 0 <= slot < 500:
+                bound[1][slot] = series
+        series.inc()
+    return resp
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  PROFILING (opt-in)
+#  With CODEMASTER_PROFILE=1 a request is run under cProfile when it carries
+#  `X-CodeMaster-Profile: <CODEMASTER_PROFILE_TOKEN>` or wins the sampling
+#  draw (CODEMASTER_PROFILE_SAMPLE, only for PROFILE_ENDPOINTS). Each profiled
+#  request leaves <id>.prof (load with pstats/snakeviz) and <id>.txt (top
+#  functions, plus top allocations when tracemalloc is on) in PROFILE_DIR,
+#  which keeps the newest PROFILE_KEEP requests. When off, no hooks are
+#  registered at all. Streaming replies are profiled up to the first byte.
+# ══════════════════════════════════════════════════════════════════════════════
+PROFILE_ENABLED   = os.environ.get("CODEMASTER_PROFILE", "0") == "1"
+PROFILE_TOKEN     = os.environ.get("CODEMASTER_PROFILE_TOKEN", "")
+PROFILE_SAMPLE    = float(os.environ.get("CODEMASTER_PROFILE_SAMPLE", "0"))
+PROFILE_ENDPOINTS = set(filter(None, os.environ.get(
+    "CODEMASTER_PROFILE_ENDPOINTS", "check_quiz,progress,ai_chat,ai_chat_stream").split(",")))
+PROFILE_MEMORY    = os.environ.get("CODEMASTER_PROFILE_MEMORY", "0") == "1"
+PROFILE_DIR       = os.environ.get("CODEMASTER_PROFILE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".codemaster_profiles"))
+PROFILE_KEEP      = int(os.environ.get("CODEMASTER_PROFILE_KEEP", "200"))
+PROFILE_TOP       = 40
+PROFILE_HEADER    = "X-CodeMaster-Profile"
+
+# One profiled request per process at a time: cProfile and tracemalloc are
+# process-wide hooks, and a second one would only measure the first.
+_profile_lock = threading.Lock()
+
+def _profile_wanted() -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if token is not None:
+        return bool(PROFILE_TOKEN) and secrets.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+    return (PROFILE_SAMPLE > 0 and request.endpoint in PROFILE_ENDPOINTS
+            and random.random() < PROFILE_SAMPLE)
+
+def _rotate_profiles(keep: int = PROFILE_KEEP):
+    runs = {}
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith((".prof", ".txt")):
+            runs.setdefault(entry.name.rsplit(".", 1)[0], []).append(entry)
+    oldest = sorted(runs, key=lambda run: min(e.stat().st_mtime for e in runs[run]))
+    for run in oldest[:max(0, len(runs) - keep)]:
+        for entry in runs[run]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def write_profile(run_id: str, profiler, elapsed: float, snapshots: tuple = None) -> str:
+    """Dump one profiled request to PROFILE_DIR; returns the .prof path."""
+    import io
+    import pstats
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, run_id)
+    profiler.dump_stats(path + ".prof")
+
+    report = io.StringIO()
+    report.write(f"{request.method} {request.full_path.rstrip('?')} -> {request.endpoint}\n")
+    report.write(f"pid {os.getpid()}  wall {elapsed * 1000:.2f} ms\n\n")
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    if snapshots:
+        import tracemalloc
+        before, after = snapshots
+        report.write("\nTop allocations during the request (tracemalloc, by line):\n")
+        for stat in after.compare_to(before, "lineno")[:PROFILE_TOP]:
+            report.write(f"{stat}\n")
+        current, peak = tracemalloc.get_traced_memory()
+        report.write(f"\ntraced now {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+    with open(path + ".txt", "w", encoding="utf-8") as f:
+        f.write(report.getvalue())
+    _rotate_profiles()
+    return path + ".prof"
+
+def _profile_start():
+    if not _profile_wanted() or not _profile_lock.acquire(blocking=False):
+        return
+    import cProfile
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{os.getpid()}-{secrets.token_hex(3)}"
+    snapshot = None
+    if PROFILE_MEMORY:
+        import tracemalloc
+        tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        snapshot = tracemalloc.take_snapshot()
+    g.profile = (run_id, cProfile.Profile(), snapshot, time.perf_counter())
+    g.profile[1].enable()
+
+def _profile_header(resp):
+    if "profile" in g:
+        resp.headers["X-CodeMaster-Profile-Id"] = g.profile[0]
+    return resp
+
+def _profile_stop(exc):
+    state = g.pop("profile", None)
+    if state is None:
+        return
+    run_id, profiler, before, t0 = state
+    profiler.disable()
+    elapsed = time.perf_counter() - t0
+    try:
+        snapshots = None
+        if before is not None:
+            import tracemalloc
+            snapshots = (before, tracemalloc.take_snapshot())
+        write_profile(run_id, profiler, elapsed, snapshots)
+    except OSError as e:
+        app.logger.warning(f"profile dump failed: {e}")
+    finally:
+        if before is not None:
+            import tracemalloc
+            tracemalloc.stop()
+        _profile_lock.release()
+
+if PROFILE_ENABLED:
+    app.before_request(_profile_start)
+    app.after_request(_profile_header)
+    app.teardown_request(_profile_stop)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  SHARED STATE
+#  Rate limits, cross-request locks and shared caches go through one small
+#  backend interface so they keep meaning something with N workers / hosts:
+#    STATE_BACKEND=local            in-process (single worker, default)
+#    STATE_BACKEND=file[:<dir>]     mmap'd slot table + file locks (one host)
+#    STATE_BACKEND=redis://h:p/db   any Redis-protocol server (many hosts)
+# ══════════════════════════════════════════════════════════════════════════════
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "local")
+STATE_DIR     = os.path.join(os.path.expanduser("~"), ".codemaster_state")
+RATE_STRIPES        = 16
+RATE_EVICT_INTERVAL = 60
+STATE_LOCAL_MAX_BYTES = int(os.environ.get("CODEMASTER_STATE_LOCAL_MAX_BYTES", str(64 << 20)))
+
+class StateBackendError(Exception):
+    pass
+
+def _window_check(now: float, window_seconds: int, start: float, prev: int, curr: int, max_calls: int):
+    """Sliding-window counter step shared by all backends.
+
+    `start/prev/curr` describe the stored slot. Returns (start, prev, curr,
+    allowed) for the window containing `now`, with the call counted if allowed.
+    The previous window's count is weighted by how much of it still overlaps.
+    """
+    win_start = now - now % window_seconds
+    if start != win_start:
+        prev = curr if win_start - start == window_seconds else 0
+        start, curr = win_start, 0
+    allowed = prev * (1 - (now - start) / window_seconds) + curr < max_calls
+    return start, prev, curr + allowed, allowed
+
+class StateBackend:
+    """Interface for state that must be shared by every worker serving the app."""
+
+    def hit(self, key: str, max_calls: int, window_seconds: int) -> bool:
+        """Counts one call for `key`; returns False if it would exceed the limit."""
+        raise NotImplementedError
+
+    def lock(self, name: str, timeout: float = 10.0):
+        """Context manager holding a named exclusive lock; raises TimeoutError."""
+        raise NotImplementedError
+
+    def get(self, key: str):
+        """Cached bytes for `key`, or None if missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+_RATE_LOCK_WAIT      = m_lock_wait.labels("rate_stripe")
+_RATE_LOCK_HOLD      = m_lock_hold.labels("rate_stripe")
+_RATE_FILE_LOCK_WAIT = m_lock_wait.labels("rate_file_bucket")
+_RATE_FILE_LOCK_HOLD = m_lock_hold.labels("rate_file_bucket")
+
+class _RateStripe:
+    __slots__ = ("lock", "slots")
+
+    def __init__(self):
+        self.lock  = threading.Lock()
+        self.slots = {}
+
+class LocalState(StateBackend):
+    """In-process backend: striped rate-limit slots and a TTL dict.
+
+    Each rate key holds a fixed [window_start, previous, current, window] slot;
+    a janitor thread drops keys idle for two windows and expired cache entries.
+    Cached values are also capped at `max_bytes` in total: the least recently
+    written entries go first, so a burst of sessions cannot outgrow the worker.
+    """
+
+    def __init__(self, max_bytes: int = STATE_LOCAL_MAX_BYTES):
+        self._stripes = tuple(_RateStripe() for _ in range(RATE_STRIPES))
+        self._locks: dict = {}
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._max_bytes   = max_bytes
+        self._meta_lock   = threading.Lock()
+        self._janitor_pid = None
+
+    def _ensure_janitor(self):
+        if self._janitor_pid != os.getpid():  # threads do not survive fork
+            self._janitor_pid = os.getpid()
+            threading.Thread(target=self._evict_idle, name="state-janitor", daemon=True).start()
+
+    def _evict_idle(self):
+        while True:
+            time.sleep(RATE_EVICT_INTERVAL)
+            now = time.time()
+            for stripe in self._stripes:
+                with stripe.lock:
+                    idle = [k for k, s in stripe.slots.items() if now - s[0] >= 2 * s[3]]
+                    for k in idle:
+                        del stripe.slots[k]
+            with self._meta_lock:
+                expired = [k for k, (exp, _) in self._cache.items() if exp < now]
+                for k in expired:
+                    self._cache_bytes -= len(self._cache.pop(k)[1])
+
+    def hit(self, key, max_calls, window_seconds):
+        self._ensure_janitor()
+        now    = time.time()
+        stripe = self._stripes[hash(key) % RATE_STRIPES]
+        t0 = time.perf_counter()
+        with stripe.lock:
+            t1 = time.perf_counter()
+            slot = stripe.slots.get(key)
+            if slot is None:
+                slot = stripe.slots[key] = [0.0, 0, 0, window_seconds]
+            slot[0], slot[1], slot[2], allowed = _window_check(
+                now, window_seconds, slot[0], slot[1], slot[2], max_calls)
+            t2 = time.perf_counter()
+        _RATE_LOCK_WAIT.observe(t1 - t0)
+        _RATE_LOCK_HOLD.observe(t2 - t1)
+        return allowed
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        # Refcounted so per-request lock names don't pile up in the dict
+        with self._meta_lock:
+            entry = self._locks.get(name)
+            if entry is None:
+                entry = self._locks[name] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=timeout):
+                raise TimeoutError(f"lock {name!r}")
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self._meta_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[name]
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        self._ensure_janitor()
+        with self._meta_lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old[1])
+            self._cache[key] = (time.time() + ttl, value)
+            self._cache_bytes += len(value)
+            while self._cache_bytes > self._max_bytes and len(self._cache) > 1:
+                _, (_, dropped) = self._cache.popitem(last=False)
+                self._cache_bytes -= len(dropped)
+
+    def delete(self, key):
+        with self._meta_lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old[1])
+
+class FileState(StateBackend):
+    """Single-host backend shared by every process through files in `directory`.
+
+    Rate limits live in a fixed-size, mmap'd table of 8-way buckets guarded by
+    byte-range locks (plus a thread lock, since fcntl locks are per process).
+    A key that finds no slot takes its bucket's oldest one, so memory is
+    constant and idle keys are recycled. Locks are flock()ed files; cache
+    entries are files with an expiry header, replaced atomically.
+    """
+
+    SLOT = struct.Struct("<QdIII4x")  # key hash, window start, previous, current, window
+    WAYS = 8
+
+    def __init__(self, directory: str, slots: int = 8192):
+        if fcntl is None:
+            raise StateBackendError("file backend needs fcntl (POSIX only)")
+        self.dir = directory
+        for sub in ("locks", "cache"):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        size = slots * self.SLOT.size
+        self._fd = os.open(os.path.join(directory, "rate.slots"), os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm      = mmap.mmap(self._fd, size)
+        self._buckets = slots // self.WAYS
+        self._tlocks  = tuple(threading.Lock() for _ in range(RATE_STRIPES))
+        self._sets    = 0
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Python's hash() differs per process; this one must agree across workers
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def hit(self, key, max_calls, window_seconds):
+        h      = self._hash(key)
+        bucket = h % self._buckets
+        span   = self.WAYS * self.SLOT.size
+        base   = bucket * span
+        t0     = time.perf_counter()
+        with self._tlocks[bucket % RATE_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, span, base)
+            t1 = time.perf_counter()
+            try:
+                off, slot = None, None
+                for i in range(self.WAYS):
+                    pos = base + i * self.SLOT.size
+                    cur = self.SLOT.unpack_from(self._mm, pos)
+                    if cur[0] == h:
+                        off, slot = pos, cur
+                        break
+                    if slot is None or cur[1] < slot[1]:  # empty (0.0) or oldest window
+                        off, slot = pos, cur
+                if slot[0] != h:
+                    slot = (h, 0.0, 0, 0, window_seconds)
+                start, prev, curr, allowed = _window_check(
+                    time.time(), window_seconds, slot[1], slot[2], slot[3], max_calls)
+                self.SLOT.pack_into(self._mm, off, h, start, prev, curr, window_seconds)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, span, base)
+        t2 = time.perf_counter()
+        _RATE_FILE_LOCK_WAIT.observe(t1 - t0)
+        _RATE_FILE_LOCK_HOLD.observe(t2 - t1)
+        return allowed
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        path = os.path.join(self.dir, "locks", re.sub(r"[^\w.-]", "_", name) + ".lock")
+        fd   = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"lock {name!r}")
+                    time.sleep(0.005)
+            yield
+        finally:
+            os.close(fd)  # closing the descriptor releases the flock
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, "cache", hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < 8 or struct.unpack_from("<d", data)[0] < time.time():
+            return None
+        return data[8:]
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        tmp  = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<d", time.time() + ttl))
+            f.write(value)
+        os.replace(tmp, path)
+        self._sets += 1
+        if self._sets % 1024 == 0:
+            self._prune()
+
+    def _prune(self):
+        now  = time.time()
+        root = os.path.join(self.dir, "cache")
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                with open(path, "rb") as f:
+                    expired = struct.unpack("<d", f.read(8))[0] < now
+                if expired:
+                    os.remove(path)
+            except (OSError, struct.error):
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+_REDIS_UNLOCK = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+class RedisState(StateBackend):
+    """Backend speaking the Redis protocol (RESP2) over a plain socket.
+
+    Only INCR/DECR/GET/SET/DEL/PEXPIRE/EVAL/AUTH/SELECT are used, so any
+    compatible server (or a local stand-in) works. Connections are per thread,
+    re-opened after fork, and time out after `timeout` seconds. Rate limiting
+    and caching fail open if the server is down.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        u = urllib.parse.urlparse(url)
+        self.host, self.port = u.hostname or "127.0.0.1", u.port or 6379
+        self.db       = int(u.path.lstrip("/") or 0)
+        self.password = u.password
+        self.timeout  = timeout
+        self._local   = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            except OSError as e:
+                raise ConnectionError(f"state backend {self.host}:{self.port} unreachable: {e}") from e
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            self._local.pid = os.getpid()
+            setup = ([("AUTH", self.password)] if self.password else []) + \
+                    ([("SELECT", self.db)] if self.db else [])
+            if setup:
+                self._send(conn, setup)
+        return conn
+
+    def _read(self, f):
+        line = f.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise StateBackendError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            return None if n < 0 else f.read(n + 2)[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read(f) for _ in range(n)]
+        raise StateBackendError(f"unexpected reply {line!r}")
+
+    def _send(self, conn, commands: list) -> list:
+        out = []
+        for cmd in commands:
+            out.append(b"*%d\r\n" % len(cmd))
+            for arg in cmd:
+                arg = arg if isinstance(arg, bytes) else str(arg).encode()
+                out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        conn[0].sendall(b"".join(out))
+        replies, error = [], None
+        for _ in commands:  # drain every reply so the connection stays in sync
+            try:
+                replies.append(self._read(conn[1]))
+            except StateBackendError as e:
+                error = error or e
+        if error:
+            raise error
+        return replies
+
+    def execute(self, *commands) -> list:
+        """Sends the commands in one pipeline and returns their replies."""
+        try:
+            return self._send(self._connect(), commands)
+        except OSError:
+            self._local.conn = None  # reconnect on next use
+            raise
+
+    def hit(self, key, max_calls, window_seconds):
+        now   = time.time()
+        start = int(now - now % window_seconds)
+        cur, prev = f"rl:{key}:{start}", f"rl:{key}:{start - window_seconds}"
+        try:
+            count, _, before = self.execute(
+                ("INCR", cur), ("PEXPIRE", cur, window_seconds * 2000), ("GET", prev))
+            if int(before or 0) * (1 - (now - start) / window_seconds) + count - 1 < max_calls:
+                return True
+            self.execute(("DECR", cur))  # rejected calls don't count
+            return False
+        except (OSError, StateBackendError) as e:
+            app.logger.error(f"rate limit backend unavailable: {e}")
+            return True
+
+    @contextmanager
+    def lock(self, name, timeout=10.0):
+        key, token = f"lock:{name}", secrets.token_hex(8)
+        deadline   = time.monotonic() + timeout
+        while self.execute(("SET", key, token, "NX", "PX", int(timeout * 1000)))[0] != "OK":
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"lock {name!r}")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            # Compare-and-delete in one step: with GET then DEL, a lock that
+            # expired in between (and was taken by someone else) got deleted
+            try:
+                self.execute(("EVAL", _REDIS_UNLOCK, 1, key, token))
+            except (OSError, StateBackendError) as e:
+                app.logger.error(f"lock {name!r} not released, it expires on its own: {e}")
+
+    def get(self, key):
+        try:
+            return self.execute(("GET", f"cache:{key}"))[0]
+        except (OSError, StateBackendError) as e:
+            app.logger.error(f"state get failed: {e}")
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            self.execute(("SET", f"cache:{key}", value, "PX", max(1, int(ttl * 1000))))
+        except (OSError, StateBackendError) as e:
+            app.logger.error(f"state set failed: {e}")
+
+    def delete(self, key):
+        try:
+            self.execute(("DEL", f"cache:{key}"))
+        except (OSError, StateBackendError) as e:
+            app.logger.error(f"state delete failed: {e}")
+
+def make_state_backend(spec: str) -> StateBackend:
+    if spec == "local":
+        return LocalState()
+    if spec == "file" or spec.startswith("file:"):
+        return FileState(spec[5:] or STATE_DIR)
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisState(spec)
+    raise ValueError(f"STATE_BACKEND desconhecido: {spec!r}")
 
-def rate_limit(max_calls: int = 20, window_seconds: int = 60):
-    """Decorator: limits calls per IP within a rolling window."""
+_state = make_state_backend(STATE_BACKEND)
+
+# ─── Rate limiter (FIX #2) ────────────────────────────────────────────────────
+def rate_limit(max_calls: int = 20, window_seconds: int = 60, scope: str = None):
+    """Decorator: limits calls per IP within a rolling window (shared by all workers).
+
+    Views passing the same `scope` share one budget; it defaults to the view name.
+    """
     def decorator(fn):
+        name = scope or fn.__name__
+
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            ip  = request.remote_addr or "unknown"
-            key = f"{fn.__name__}:{ip}"
-            now = time.time()
-            with _rate_lock:
-                calls = [t for t in _rate_store.get(key, []) if now - t < window_seconds]
-                if len(calls) >= max_calls:
-                    return jsonify({"error": "Too many requests. Please wait."}), 429
-                calls.append(now)
-                _rate_store[key] = calls
+            ip = request.remote_addr or "unknown"
+            if not _state.hit(f"{name}:{ip}", max_calls, window_seconds):
+                m_rate_limited.labels(request.url_rule.rule).inc()
+                return jsonify({"error": "Too many requests. Please wait."}), 429
             return fn(*args, **kwargs)
         return wrapper
     return decorator
 
-# ─── Static lib downloader ────────────────────────────────────────────────────
+# ─── Static lib vendoring ─────────────────────────────────────────────────────
+# Third-party front-end libs are vendored into static/ so pages don't depend on
+# the CDNs. `python app.py vendor-libs` (or the first worker on a host, in the
+# background) fetches the missing ones concurrently, checks them against the
+# SRI hashes pinned in libs.lock.json and moves each into place atomically.
+# A lib without a pin for its exact URL is installed with a warning that
+# prints its hash, or refused with CODEMASTER_LIBS_REQUIRE_PIN=1 /
+# --require-pin once the lock pins every lib.
+# Air-gapped deployments point CODEMASTER_LIBS_BUNDLE at a tarball made with
+# `vendor-libs --make-bundle`, which is unpacked synchronously at start-up.
 LIBS = {
     "vue.min.js":         "https://unpkg.com/vue@3.4.21/dist/vue.global.prod.js",
     "hljs.min.js":        "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js",
@@ -65,1217 +898,972 @@ LIBS = {
     "hljs-js.min.js":     "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/languages/javascript.min.js",
     "hljs-java.min.js":   "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/languages/java.min.js",
     "atom-dark.min.css":  "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/atom-one-dark.min.css",
-    "tailwind.min.js":    "https://cdn.tailwindcss.com",
+    "tailwind.min.js":    "https://cdn.tailwindcss.com/3.4.1",
 }
 CDN_FALLBACK = dict(LIBS)
+LIBS_LOCK    = os.path.join(BASE_DIR, "libs.lock.json")  # fname -> {"url", "integrity": "sha384-…"}
+LIBS_BUNDLE  = os.environ.get("CODEMASTER_LIBS_BUNDLE", "")
+LIBS_MIRROR  = os.environ.get("CODEMASTER_LIBS_MIRROR", "")  # base URL, e.g. a local test server
+LIBS_AUTO    = os.environ.get("CODEMASTER_VENDOR_LIBS", "1") != "0"
+LIBS_TIMEOUT = float(os.environ.get("CODEMASTER_LIBS_TIMEOUT", "15"))
+LIBS_REQUIRE_PIN = os.environ.get("CODEMASTER_LIBS_REQUIRE_PIN", "0") == "1"
+
+class IntegrityError(ValueError):
+    pass
+
+def sri_hash(data: bytes, algorithm: str = "sha384") -> str:
+    """Subresource Integrity string for `data`, e.g. "sha384-oqVuAfXR…"."""
+    return f"{algorithm}-{base64.b64encode(hashlib.new(algorithm, data).digest()).decode()}"
+
+def _read_lib_lock(path: str = LIBS_LOCK) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_lib_pins(path: str = LIBS_LOCK) -> dict:
+    """{fname: "sha384-…"}. A pin only counts for the URL it was taken from, so
+    bumping a version in LIBS leaves that lib unpinned until the lock is updated."""
+    return {fname: entry["integrity"] for fname, entry in _read_lib_lock(path).items()
+            if fname in LIBS and entry.get("url") == LIBS[fname] and entry.get("integrity")}
+
+def _verify_lib(fname: str, data: bytes, pins: dict, allow_unpinned: bool = False):
+    expected = pins.get(fname)
+    if expected is None:
+        if not allow_unpinned:
+            raise IntegrityError(f"{fname}: not pinned in {os.path.basename(LIBS_LOCK)} "
+                                 f"(vendor-libs --update-lock without --require-pin, then review the hash)")
+        print(f"  [lib] WARNING: {fname} installed without an integrity pin ({sri_hash(data)})")
+    elif sri_hash(data, expected.split("-", 1)[0]) != expected:
+        raise IntegrityError(f"{fname}: integrity mismatch (pinned {expected})")
 
-def _download_libs():
+def _install_lib(fname: str, data: bytes, pins: dict, allow_unpinned: bool = False):
+    """Verifies and atomically moves a lib into static/ — readers never see a partial file."""
+    _verify_lib(fname, data, pins, allow_unpinned)
+    dest = os.path.join(STATIC_DIR, fname)
+    tmp  = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _lib_present(fname: str, pins: dict) -> bool:
+    path = os.path.join(STATIC_DIR, fname)
+    if not os.path.isfile(path):
+        return False
+    if fname not in pins:
+        return True
+    with open(path, "rb") as f:
+        try:
+            _verify_lib(fname, f.read(), pins)
+            return True
+        except IntegrityError:
+            return False
+
+def _fetch_lib(fname: str, url: str, pins: dict, allow_unpinned: bool):
+    with urllib.request.urlopen(url, timeout=LIBS_TIMEOUT) as resp:
+        data = resp.read()
+    _install_lib(fname, data, pins, allow_unpinned)
+
+def _unpack_lib_bundle(bundle: str, wanted: list, pins: dict, allow_unpinned: bool) -> dict:
+    """Installs `wanted` libs from a tarball (members are matched by base name only)."""
+    import tarfile
+    report = {}
+    with tarfile.open(bundle) as tar:
+        for member in tar.getmembers():
+            fname = os.path.basename(member.name)
+            if fname in wanted and member.isfile():
+                try:
+                    _install_lib(fname, tar.extractfile(member).read(), pins, allow_unpinned)
+                    report[fname] = "bundle"
+                except IntegrityError as e:
+                    report[fname] = f"error: {e}"
+    return report
+
+@contextmanager
+def _host_lock(path: str, wait: bool):
+    """Host-wide exclusive lock file; yields False if busy and `wait` is off."""
+    if fcntl is None:
+        yield True
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)  # closing the descriptor releases the flock
+
+def vendor_libs(bundle: str = LIBS_BUNDLE, mirror: str = LIBS_MIRROR, wait: bool = True,
+                allow_unpinned: bool = not LIBS_REQUIRE_PIN):
+    """Makes every LIBS file available in static/ and returns {fname: status}
+    ("present", "bundle", "downloaded" or "error: …"). Libs without a pin in
+    libs.lock.json are refused unless `allow_unpinned`.
+
+    Only one process per host does the work: with wait=False, returns None at
+    once if another one already holds the vendoring lock.
+    """
+    with _host_lock(os.path.join(STATIC_DIR, ".vendor.lock"), wait) as held:
+        if not held:
+            return None
+        pins    = load_lib_pins()
+        report  = {fname: "present" for fname in LIBS if _lib_present(fname, pins)}
+        missing = [fname for fname in LIBS if fname not in report]
+        if bundle and missing:
+            report.update(_unpack_lib_bundle(bundle, missing, pins, allow_unpinned))
+            missing = [fname for fname in missing if fname not in report]
+        if missing:
+            with ThreadPoolExecutor(min(8, len(missing)), thread_name_prefix="vendor") as pool:
+                futures = {fname: pool.submit(_fetch_lib, fname,
+                                              f"{mirror.rstrip('/')}/{fname}" if mirror else LIBS[fname],
+                                              pins, allow_unpinned)
+                           for fname in missing}
+            for fname, fut in futures.items():
+                report[fname] = "downloaded" if fut.exception() is None else f"error: {fut.exception()}"
+        return report
+
+def update_lib_lock(allow_new: bool = False) -> dict:
+    """Rewrites libs.lock.json for the current LIBS and returns the pins that
+    are new or changed. Existing pins for the same URL are kept as they are;
+    a vendored lib is only pinned anew with `allow_new`, because its hash is
+    whatever the CDN served — check it against the publisher's SRI first."""
+    pins, lock, added = load_lib_pins(), {}, {}
     for fname, url in LIBS.items():
-        dest = os.path.join(STATIC_DIR, fname)
-        if not os.path.exists(dest):
-            try:
-                urllib.request.urlretrieve(url, dest)
-                print(f"  [lib] Downloaded {fname}")
-            except Exception as e:
-                print(f"  [lib] Could not download {fname}: {e}")
+        integrity = pins.get(fname)
+        path = os.path.join(STATIC_DIR, fname)
+        if integrity is None and allow_new and os.path.isfile(path):
+            with open(path, "rb") as f:
+                integrity = added[fname] = sri_hash(f.read())
+        lock[fname] = {"url": url, "integrity": integrity}
+    tmp = f"{LIBS_LOCK}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(lock, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, LIBS_LOCK)
+    return added
+
+def make_lib_bundle(dest: str) -> list:
+    """Writes the vendored libs into a tarball for offline deployments."""
+    import tarfile
+    names = [fname for fname in LIBS if os.path.isfile(os.path.join(STATIC_DIR, fname))]
+    with tarfile.open(dest, "w:gz") as tar:
+        for fname in names:
+            tar.add(os.path.join(STATIC_DIR, fname), arcname=fname)
+    return names
+
+def _auto_vendor_libs():
+    for fname, status in (vendor_libs(wait=bool(LIBS_BUNDLE)) or {}).items():
+        if status != "present":
+            print(f"  [lib] {fname}: {status}")
+
+if LIBS_AUTO:
+    if LIBS_BUNDLE:  # local and quick: be fully ready before serving
+        _auto_vendor_libs()
+    else:
+        threading.Thread(target=_auto_vendor_libs, name="vendor-libs", daemon=True).start()
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  RESPONSE COMPRESSION
+#  br (if the brotli package is installed) or gzip, picked from Accept-Encoding.
+#  Immutable bodies — cached JSON, the rendered index, /lib files — are
+#  compressed once at the highest level and the result kept; everything else
+#  is compressed on the fly by an after_request hook (streams chunk by chunk).
+# ══════════════════════════════════════════════════════════════════════════════
+COMPRESS_MIN_SIZE = int(os.environ.get("CODEMASTER_COMPRESS_MIN", "1024"))
+COMPRESS_LEVELS   = {"br": (4, 11), "gzip": (6, 9)}  # (on the fly, precompressed)
+_ENCODINGS        = ["br", "gzip"] if brotli is not None else ["gzip"]
+_COMPRESSIBLE     = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+class _Compressor:
+    """Incremental br/gzip encoder; flush() emits everything written so far."""
+
+    def __init__(self, encoding: str, level: int):
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=level)
+            self.compress, self.flush, self.finish = self._c.process, self._c.flush, self._c.finish
+        else:
+            self._c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 → gzip container
+            self.compress = self._c.compress
+            self.flush    = lambda: self._c.flush(zlib.Z_SYNC_FLUSH)
+            self.finish   = self._c.flush
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    c = _Compressor(encoding, level)
+    return c.compress(data) + c.finish()
+
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+def gzip_splice(parts) -> bytes:
+    """One gzip body from `parts`: plain bytes are compressed here, (prefix,
+    CachedBody) pairs reuse the body's cached deflate segment. Every segment
+    ends in a full flush, so they concatenate into one valid stream and only
+    the CRC has to run over the cached bytes."""
+    c, out, crc, size = zlib.compressobj(COMPRESS_LEVELS["gzip"][0], zlib.DEFLATED, -15), [_GZIP_HEADER], 0, 0
+    for part in parts:
+        if isinstance(part, bytes):
+            out.append(c.compress(part))
+            crc, size = zlib.crc32(part, crc), size + len(part)
+        else:
+            prefix, entry = part
+            out += (c.flush(zlib.Z_FULL_FLUSH), entry.deflate_part(prefix))
+            crc  = zlib.crc32(entry.body, zlib.crc32(prefix, crc))
+            size += len(prefix) + len(entry.body)
+    out += (c.flush(), struct.pack("<II", crc, size & 0xFFFFFFFF))
+    return b"".join(out)
+
+def negotiate_encoding(size: int = None):
+    """Best encoding the client accepts, or None (also for bodies too small to bother)."""
+    if size is not None and size < COMPRESS_MIN_SIZE:
+        return None
+    return request.accept_encodings.best_match(_ENCODINGS)
+
+def _compress_stream(chunks, encoding: str, close):
+    """Compresses an iterable, flushing after every chunk so that streamed
+    responses (SSE) reach the client without extra latency."""
+    c = _Compressor(encoding, COMPRESS_LEVELS[encoding][0])
+    try:
+        for chunk in chunks:
+            yield c.compress(chunk) + c.flush()
+        yield c.finish()
+    finally:
+        if close is not None:
+            close()
+
+@app.after_request
+def _compress_response(resp):
+    """On-the-fly compression for dynamic responses. Anything carrying an ETag
+    (cached bodies, files) is left alone — those paths serve their own
+    precompressed variants so the ETag can match the bytes."""
+    if (resp.status_code != 200 or resp.direct_passthrough or request.method == "HEAD"
+            or "Content-Encoding" in resp.headers or "ETag" in resp.headers
+            or not (resp.mimetype or "").startswith(_COMPRESSIBLE)):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if resp.is_streamed:
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return resp
+        resp.response = _compress_stream(resp.iter_encoded(), encoding,
+                                         getattr(resp.response, "close", None))
+        resp.headers.pop("Content-Length", None)
+    else:
+        body     = resp.get_data()
+        encoding = negotiate_encoding(len(body))
+        if encoding is None:
+            return resp
+        resp.set_data(compress_bytes(body, encoding, COMPRESS_LEVELS[encoding][0]))
+    resp.headers["Content-Encoding"] = encoding
+    return resp
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  RESPONSE CACHE
+#  Read-only content is serialized once; requests only copy bytes or answer 304.
+# ══════════════════════════════════════════════════════════════════════════════
+def _serialize(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class CachedBody:
+    """Immutable pre-serialized JSON body with a strong content-hash ETag."""
+    __slots__ = ("body", "etag", "_encoded")
+
+    def __init__(self, body: bytes, etag: str):
+        self.body     = body
+        self.etag     = etag
+        self._encoded = {}
+
+    def encoded(self, encoding: str):
+        """(body, etag) compressed with `encoding` at the highest level, computed once."""
+        hit = self._encoded.get(encoding)
+        if hit is None:
+            body = compress_bytes(self.body, encoding, COMPRESS_LEVELS[encoding][1])
+            hit  = self._encoded[encoding] = (body, f"{self.etag}-{encoding}")
+        return hit
+
+    def deflate_part(self, prefix: bytes) -> bytes:
+        """prefix + body as a raw-deflate segment ending in a full flush (so it can
+        be spliced into a larger gzip stream, see gzip_splice), computed once."""
+        hit = self._encoded.get(prefix)
+        if hit is None:
+            c   = zlib.compressobj(COMPRESS_LEVELS["gzip"][1], zlib.DEFLATED, -15)
+            hit = self._encoded[prefix] = c.compress(prefix) + c.compress(self.body) + c.flush(zlib.Z_FULL_FLUSH)
+        return hit
+
+    @classmethod
+    def from_payload(cls, payload) -> "CachedBody":
+        body = _serialize(payload)
+        return cls(body, hashlib.sha256(body).hexdigest()[:32])
+
+def cached_response(entry: CachedBody, mimetype: str = "application/json") -> Response:
+    """Serves a cached body (precompressed if the client accepts it),
+    answering If-None-Match revalidations with 304."""
+    encoding   = negotiate_encoding(len(entry.body))
+    body, etag = entry.encoded(encoding) if encoding else (entry.body, entry.etag)
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype=mimetype)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    resp.vary.add("Accept-Encoding")
+    resp.cache_control.public   = True
+    resp.cache_control.no_cache = True  # always revalidate; 304s are cheap
+    return resp
 
-threading.Thread(target=_download_libs, daemon=True).start()
+_EMPTY_LIST = CachedBody.from_payload([])
+
+# ─── Static assets: fingerprinted /lib URLs ───────────────────────────────────
+# index.html is served with every "/lib/<name>" reference rewritten to
+# "/lib/<stem>.<content hash><ext>". Those URLs never change meaning, so they
+# are cached for a year as immutable; the page itself is revalidated by ETag.
+# Files go out through send_file (sendfile via the server's file_wrapper,
+# conditional GETs and byte ranges) instead of being read into memory.
+LIB_MAX_AGE     = 365 * 86400
+_FINGERPRINT_RE = re.compile(r"^(?P<stem>[\w.-]+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.\w+)$")
+_LIB_REF_RE     = re.compile(r"""(["'])/lib/([\w.-]+)\1""")
+LIB_COMPRESSED_DIR = os.path.join(STATIC_DIR, "_compressed")  # not reachable via /lib
+_lib_hashes: dict = {}   # fname -> (mtime_ns, size, hash)
+_index_cache = None      # (index.html stat, {fname: url}, CachedBody)
+
+def lib_fingerprint(fname: str):
+    """Content hash of a local /lib file (recomputed only when it changes), or None."""
+    path = os.path.join(STATIC_DIR, fname)
+    if not os.path.isfile(path):
+        return None
+    st    = os.stat(path)
+    known = _lib_hashes.get(fname)
+    if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+        return known[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    _lib_hashes[fname] = (st.st_mtime_ns, st.st_size, h.hexdigest()[:12])
+    return _lib_hashes[fname][2]
+
+def lib_url(fname: str) -> str:
+    """Fingerprinted URL when the file is vendored locally, else the plain one
+    (which redirects to the CDN)."""
+    digest = lib_fingerprint(fname)
+    if digest is None:
+        return f"/lib/{fname}"
+    stem, ext = os.path.splitext(fname)
+    return f"/lib/{stem}.{digest}{ext}"
+
+def render_index() -> CachedBody:
+    """index.html with fingerprinted /lib URLs (and, with BOOTSTRAP_INLINE, the
+    static bootstrap sections preloaded); re-rendered when the page, the
+    content pack or a referenced asset changes."""
+    global _index_cache
+    path    = os.path.join(BASE_DIR, "index.html")
+    st      = os.stat(path)
+    content = _content
+    stamp   = (st.st_mtime_ns, st.st_size, content.digest if BOOTSTRAP_INLINE else None)
+    cached  = _index_cache
+    if cached is not None and cached[0] == stamp and all(
+            lib_url(name) == url for name, url in cached[1].items()):
+        return cached[2]
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    refs = {}
+
+    def fingerprint(m):
+        refs[m[2]] = lib_url(m[2])
+        return f"{m[1]}{refs[m[2]]}{m[1]}"
+    body = _LIB_REF_RE.sub(fingerprint, html).encode("utf-8")
+    if BOOTSTRAP_INLINE:  # shared, cacheable page → static sections only, no user data
+        data = compose_bootstrap(content, BOOTSTRAP_LANG).replace(b"</", b"<\\/")
+        body = body.replace(b"</head>", b'<script id="cm-bootstrap" type="application/json">' +
+                            data + b"</script>\n</head>", 1)
+    entry = CachedBody(body, hashlib.sha256(body).hexdigest()[:32])
+    _index_cache = (stamp, refs, entry)
+    return entry
+
+def lib_compressed(fname: str, digest: str, encoding: str) -> str:
+    """Path of `fname` precompressed with `encoding`, written once per content
+    hash (atomically, so concurrent workers never see a partial file)."""
+    stem, ext = os.path.splitext(fname)
+    path = os.path.join(LIB_COMPRESSED_DIR, f"{stem}.{digest}{ext}.{encoding}")
+    if not os.path.exists(path):
+        os.makedirs(LIB_COMPRESSED_DIR, exist_ok=True)
+        with open(os.path.join(STATIC_DIR, fname), "rb") as f:
+            data = compress_bytes(f.read(), encoding, COMPRESS_LEVELS[encoding][1])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
+
+def _send_lib(fname: str, digest: str, **kwargs) -> Response:
+    """send_file for a vendored asset, picking a precompressed variant if accepted."""
+    path     = os.path.join(STATIC_DIR, fname)
+    mimetype = mimetypes.guess_type(fname)[0] or "application/octet-stream"
+    encoding = None
+    if mimetype.startswith(_COMPRESSIBLE):
+        encoding = negotiate_encoding(os.path.getsize(path))
+    if encoding:
+        path, digest = lib_compressed(fname, digest, encoding), f"{digest}-{encoding}"
+    resp = send_file(path, mimetype=mimetype, conditional=True, etag=digest, **kwargs)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    return resp
 
 @app.route("/lib/<path:filename>")
 def serve_lib(filename):
-    local = os.path.join(STATIC_DIR, filename)
-    if os.path.exists(local):
-        mime = "text/css" if filename.endswith(".css") else "application/javascript"
-        with open(local, "rb") as f:
-            return Response(f.read(), mimetype=mime)
+    # static/ also holds the vendoring lock and in-flight temp files
+    if filename.startswith(".") or filename.endswith(".tmp"):
+        abort(404)
+    m = _FINGERPRINT_RE.match(filename)
+    if m:
+        fname = m["stem"] + m["ext"]
+        if lib_fingerprint(fname) == m["hash"]:
+            resp = _send_lib(fname, m["hash"], max_age=LIB_MAX_AGE)
+            resp.cache_control.immutable = True
+            return resp
+        if fname in LIBS:  # stale fingerprint (asset was updated) → current URL
+            return redirect(lib_url(fname))
+    digest = lib_fingerprint(filename) if "/" not in filename else None
+    if digest is not None:
+        return _send_lib(filename, digest)
     if filename in CDN_FALLBACK:
         return redirect(CDN_FALLBACK[filename])
     abort(404)
 
 # ══════════════════════════════════════════════════════════════════════════════
-#  CONTENT DATABASE
+#  CONTENT PACK
+#  Lessons, exercises and quizzes are edited in content/*.json and compiled into
+#  one indexed pack. Workers mmap the pack, decode sections only when needed and
+#  hot-swap to a new pack when its mtime changes — no restart required.
+#
+#  Pack layout:  b"CMPK1\n" + header JSON + b"\n" + concatenated section bodies.
+#  The header maps each section name to [offset, length, etag] and lists all
+#  content IDs, so validation never has to decode lesson bodies.
+# ══════════════════════════════════════════════════════════════════════════════
+CONTENT_DIR    = os.environ.get("CODEMASTER_CONTENT_DIR", os.path.join(BASE_DIR, "content"))
+CONTENT_PACK   = os.environ.get("CODEMASTER_CONTENT_PACK", os.path.join(CONTENT_DIR, "content.pack"))
+CONTENT_CHECK_INTERVAL = float(os.environ.get("CODEMASTER_CONTENT_CHECK", "2"))
+PACK_MAGIC     = b"CMPK1\n"
+
+_LESSON_FIELDS   = ("id", "title", "level", "theory", "code")
+_EXERCISE_FIELDS = ("id", "lang", "level", "title", "desc", "starter", "solution")
+_QUIZ_FIELDS     = ("id", "lang", "level", "q", "opts", "ans", "exp")
+
+def _check_items(kind: str, items: list, fields: tuple, seen: set):
+    for item in items:
+        missing = [f for f in fields if f not in item]
+        if missing:
+            raise ValueError(f"{kind} {item.get('id', '?')}: campos ausentes {missing}")
+        if item["id"] in seen:
+            raise ValueError(f"{kind}: ID duplicado {item['id']}")
+        seen.add(item["id"])
+
+def write_content_pack(languages: list, lessons: dict, exercises: list,
+                       quizzes: list, dest: str = CONTENT_PACK, source: str = None) -> dict:
+    """Validates content and atomically writes it as an indexed pack. Returns the header.
+    `source` is the content_source_stamp() it was compiled from, if any."""
+    lang_ids = [meta["id"] for meta in languages]
+    lesson_ids, exercise_ids, quiz_ids = set(), set(), set()
+    for lang in lang_ids:
+        _check_items("lição", lessons.get(lang, []), _LESSON_FIELDS, lesson_ids)
+    _check_items("exercício", exercises, _EXERCISE_FIELDS, exercise_ids)
+    _check_items("quiz", quizzes, _QUIZ_FIELDS, quiz_ids)
+    for item in exercises + quizzes:
+        if item["lang"] not in lang_ids:
+            raise ValueError(f"{item['id']}: linguagem desconhecida {item['lang']!r}")
+    for q in quizzes:
+        if not isinstance(q["ans"], int) or not 0 <= q["ans"] < len(q["opts"]):
+            raise ValueError(f"quiz {q['id']}: resposta fora das opções")
+    for e in exercises:
+        if "expected" in e and (e["lang"] != "python" or not isinstance(e["expected"], str)):
+            raise ValueError(f"exercício {e['id']}: 'expected' só vale para Python (texto)")
+
+    sections = {
+        "languages": [{**meta, "lessons": len(lessons.get(meta["id"], []))} for meta in languages],
+        "exercises": exercises,
+        "quizzes":   quizzes,
+        # Server-side grading data: exercises with an expected output
+        "grading":   {e["id"]: {"expected": e["expected"], "stdin": e.get("stdin", ""),
+                                "xp": e.get("xp", 100)}
+                      for e in exercises if "expected" in e},
+    }
+    for lang in lang_ids:
+        sections[f"lessons/{lang}"]   = lessons.get(lang, [])
+        sections[f"exercises/{lang}"] = [e for e in exercises if e["lang"] == lang]
+
+    index, chunks, offset = {}, [], 0
+    digest = hashlib.sha256()
+    for name, payload in sections.items():
+        body = _serialize(payload)
+        index[name] = [offset, len(body), hashlib.sha256(body).hexdigest()[:32]]
+        digest.update(body)
+        chunks.append(body)
+        offset += len(body)
+    header = {
+        "version":  1,
+        "digest":   digest.hexdigest(),
+        "source":   source,
+        "sections": index,
+        "ids": {
+            "lessons":   [l["id"] for lang in lang_ids for l in lessons.get(lang, [])],
+            "exercises": [e["id"] for e in exercises],
+            "quizzes":   [q["id"] for q in quizzes],
+        },
+    }
+
+    # Write to temp file first, then rename (atomic) — readers keep their mmap
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(_serialize(header))
+        f.write(b"\n")
+        for body in chunks:
+            f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, dest)
+    return header
+
+def content_source_stamp(src_dir: str = CONTENT_DIR):
+    """Digest of every content/*.json (paths and bytes), or None if there are none."""
+    paths = sorted(os.path.relpath(os.path.join(root, name), src_dir)
+                   for root, _, names in os.walk(src_dir) for name in names if name.endswith(".json"))
+    if not paths:
+        return None
+    digest = hashlib.sha256()
+    for rel in paths:
+        with open(os.path.join(src_dir, rel), "rb") as f:
+            digest.update(rel.encode("utf-8") + b"\0" + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def compile_content_pack(src_dir: str = CONTENT_DIR, dest: str = CONTENT_PACK) -> dict:
+    """Compiles content/*.json into the pack served by the app."""
+    def read(*parts):
+        with open(os.path.join(src_dir, *parts), "r", encoding="utf-8") as f:
+            return json.load(f)
+    source    = content_source_stamp(src_dir)  # taken first: an edit meanwhile means one more rebuild
+    languages = read("languages.json")
+    lessons   = {meta["id"]: read("lessons", f"{meta['id']}.json") for meta in languages}
+    return write_content_pack(languages, lessons, read("exercises.json"), read("quizzes.json"),
+                              dest, source)
+
+class ContentPack:
+    """Read-only, memory-mapped view of a compiled pack.
+
+    Only the header and the quiz bank are decoded up front; lesson and exercise
+    bodies stay as raw bytes in the mapping until something asks for them.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_mtime_ns, st.st_size)
+            self._mm   = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f"{path}: não é um pacote de conteúdo")
+        end = self._mm.find(b"\n", len(PACK_MAGIC))
+        header = json.loads(self._mm[len(PACK_MAGIC):end])
+        if header.get("version") != 1:
+            raise ValueError(f"{path}: versão de pacote não suportada")
+
+        self._base     = end + 1
+        self._sections = header["sections"]
+        self._bodies: dict = {}
+        self._decoded: dict = {}
+        self.digest    = header["digest"]
+        self.source    = header.get("source")
+        ids = header["ids"]
+        self.valid_lesson_ids   = frozenset(ids["lessons"])
+        self.valid_exercise_ids = frozenset(ids["exercises"])
+        self.valid_quiz_ids     = frozenset(ids["quizzes"])
+        if (len(self.valid_lesson_ids), len(self.valid_exercise_ids), len(self.valid_quiz_ids)) != \
+           (len(ids["lessons"]), len(ids["exercises"]), len(ids["quizzes"])):
+            raise ValueError(f"{path}: IDs duplicados")
+        self.quizzes = self.decode("quizzes")
+        self._index_quizzes()
+        self._search      = None
+        self._search_lock = threading.Lock()
+
+    def _index_quizzes(self):
+        """Builds id→question lookup and sampling pools keyed by (lang, level).
+
+        "" acts as a wildcard, so every filter combination is one dict lookup.
+        Pool entries are (id, serialized client copy without answer), ready to join.
+        """
+        self.quiz_by_id = {q["id"]: q for q in self.quizzes}
+        self.quiz_client = {}
+        pools: dict = {}
+        for q in self.quizzes:
+            entry = (q["id"], _serialize({k: v for k, v in q.items() if k not in ("ans", "exp")}))
+            self.quiz_client[q["id"]] = entry[1]
+            for key in ((q["lang"], q["level"]), (q["lang"], ""), ("", q["level"]), ("", "")):
+                pools.setdefault(key, []).append(entry)
+        self.quiz_pools = {key: tuple(entries) for key, entries in pools.items()}
+
+    def body(self, name: str):
+        """Pre-serialized section as a CachedBody, or None if the pack has no such section."""
+        entry = self._bodies.get(name)
+        if entry is None:
+            loc = self._sections.get(name)
+            if loc is None:
+                return None
+            offset, length, etag = loc
+            start = self._base + offset
+            entry = self._bodies[name] = CachedBody(self._mm[start:start + length], etag)
+        return entry
+
+    def decode(self, name: str):
+        """Section as Python objects (decoded once, then shared — treat as read-only)."""
+        if name not in self._decoded:
+            entry = self.body(name)
+            self._decoded[name] = None if entry is None else json.loads(entry.body)
+        return self._decoded[name]
+
+    def grading(self, exercise_id: str):
+        """{"expected", "stdin", "xp"} if the exercise is graded server-side, else None."""
+        return (self.decode("grading") or {}).get(exercise_id)
+
+    def search_index(self) -> "SearchIndex":
+        """Full-text index over this pack (built on first use, then shared)."""
+        if self._search is None:
+            with self._search_lock:
+                if self._search is None:
+                    self._search = SearchIndex.from_pack(self)
+        return self._search
+
+def load_content() -> ContentPack:
+    """Opens the pack, rebuilding it first if it is missing or was compiled from
+    other content/*.json than what is on disk (edited without build-content)."""
+    if os.path.exists(CONTENT_PACK):
+        pack   = ContentPack(CONTENT_PACK)
+        source = content_source_stamp()
+        if source is None or pack.source == source:
+            return pack
+        app.logger.warning(f"{CONTENT_PACK} is older than {CONTENT_DIR}; rebuilding")
+    compile_content_pack()
+    return ContentPack(CONTENT_PACK)
+
+_content = load_content()
+_content_lock    = threading.Lock()
+_content_checked = time.monotonic()
+
+@app.before_request
+def _reload_content_if_changed():
+    """Swaps in a new pack when its file changes; in-flight requests keep the old one."""
+    global _content, _content_checked
+    now = time.monotonic()
+    if now - _content_checked < CONTENT_CHECK_INTERVAL or not _content_lock.acquire(blocking=False):
+        return
+    try:
+        _content_checked = now
+        st = os.stat(CONTENT_PACK)
+        if (st.st_mtime_ns, st.st_size) != _content.stamp:
+            _content = ContentPack(CONTENT_PACK)
+            warm_search()
+            app.logger.info(f"content pack reloaded ({_content.digest[:12]})")
+    except (OSError, ValueError, KeyError) as e:
+        app.logger.error(f"content reload failed: {e}")
+    finally:
+        _content_lock.release()
+
+# ─── Bootstrap: everything the SPA needs for first paint, in one body ─────────
+# Static sections — languages plus the lessons and exercises of one language —
+# are spliced in from the pack's pre-serialized bytes and carry their ETags; a
+# client that already holds a section (sent back as have=name:etag,…) gets its
+# name under "unchanged" instead of the bytes. Other languages' exercises are
+# fetched from /api/exercises when the learner opens them.
+BOOTSTRAP_LANG   = os.environ.get("CODEMASTER_BOOTSTRAP_LANG", "python")
+BOOTSTRAP_INLINE = os.environ.get("CODEMASTER_BOOTSTRAP_INLINE", "0") == "1"
+
+def bootstrap_parts(content: ContentPack, lang: str, have: dict = None, dynamic: dict = None) -> list:
+    """compose_bootstrap() as a list of bytes and (prefix, CachedBody) pairs,
+    so static sections can be served from their cached encodings."""
+    have, etags, unchanged = have or {}, {}, []
+    parts, sep = [b'{"lang":' + _serialize(lang) + b',"sections":{'], b""
+    for name in ("languages", f"exercises/{lang}", f"lessons/{lang}"):
+        entry = content.body(name)
+        if entry is None:
+            continue
+        etags[name] = entry.etag
+        if have.get(name) == entry.etag:
+            unchanged.append(name)
+        else:
+            parts.append((sep + _serialize(name) + b":", entry))
+            sep = b","
+    for name, payload in (dynamic or {}).items():
+        parts.append(sep + _serialize(name) + b":" + _serialize(payload))
+        sep = b","
+    parts.append(b'},"etags":' + _serialize(etags) + b',"unchanged":' + _serialize(unchanged) + b"}")
+    return parts
+
+def join_parts(parts) -> bytes:
+    return b"".join(part if isinstance(part, bytes) else part[0] + part[1].body for part in parts)
+
+def compose_bootstrap(content: ContentPack, lang: str, have: dict = None, dynamic: dict = None) -> bytes:
+    """{"lang", "sections": {name: data}, "etags": {name: etag}, "unchanged": [name]}"""
+    return join_parts(bootstrap_parts(content, lang, have, dynamic))
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  SEARCH
+#  /api/search runs on an inverted index built once per content pack, when a
+#  worker starts or a new pack is swapped in. Text is folded to lowercase
+#  ASCII ("função" → "funcao"), Portuguese stopwords are dropped and plurals
+#  are stemmed lightly. Each term's postings hold every document's BM25
+#  weight, precomputed and sorted best first, so a query only adds up a
+#  bounded head of a few arrays; the last word also matches as a prefix
+#  (typeahead) through a bisect over the sorted vocabulary.
 # ══════════════════════════════════════════════════════════════════════════════
-LESSONS = {
-  "python": [
-    {
-      "id": "py_01", "title": "Olá, Python!", "level": "Iniciante",
-      "emoji": "🐍", "duration": "10 min", "xp": 50,
-      "theory": (
-        "Python é uma linguagem de alto nível criada por Guido van Rossum em 1991.\n\n"
-        "POR QUE PYTHON?\n"
-        "  • Sintaxe simples e legível\n"
-        "  • Versátil: Web, IA, Data Science, Automação\n"
-        "  • Linguagem mais popular do mundo (TIOBE 2024)\n"
-        "  • Usado por Google, Netflix, Instagram, NASA\n\n"
-        "SEU PRIMEIRO PROGRAMA\n"
-        "  print() exibe texto na tela.\n"
-        "  Aceita qualquer tipo de valor como argumento.\n\n"
-        "COMENTÁRIOS\n"
-        "  Linhas que começam com # são ignoradas pelo interpretador.\n\n"
-        "EXECUTANDO\n"
-        "  Terminal:   python3 arquivo.py\n"
-        "  Pydroid 3:  salve e pressione ▶"
-      ),
-      "code": (
-        "# Meu primeiro programa Python!\n"
-        "# Tudo após # é comentário — ignorado pelo Python\n\n"
-        'print("Olá, Mundo!")\n'
-        'print("Bem-vindo ao CodeMaster Pro!")\n\n'
-        "# Tipos diferentes de dados\n"
-        "print(42)           # número inteiro\n"
-        "print(3.14)         # número decimal\n"
-        "print(True)         # booleano\n\n"
-        "# Combinando valores\n"
-        'print("Python", "é", "incrível!", sep=" | ")\n'
-        'print("2 + 2 =", 2 + 2)'
-      ),
-      "tip": "Python é case-sensitive: print() funciona, Print() dá erro!"
-    },
-    {
-      "id": "py_02", "title": "Variáveis e Tipos", "level": "Iniciante",
-      "emoji": "📦", "duration": "12 min", "xp": 50,
-      "theory": (
-        "Variáveis são contêineres que guardam dados na memória.\n\n"
-        "CRIANDO VARIÁVEIS\n"
-        "  nome  = 'Ana'   → str\n"
-        "  idade = 25      → int\n"
-        "  altura= 1.68    → float\n"
-        "  ativo = True    → bool\n\n"
-        "4 TIPOS BÁSICOS\n"
-        "  str   texto:    'Olá'  \"Python\"\n"
-        "  int   inteiro:  42  -10  0\n"
-        "  float decimal:  3.14  -0.5\n"
-        "  bool  lógico:   True  False\n\n"
-        "DESCOBRINDO O TIPO\n"
-        "  type('texto')  →  <class 'str'>\n"
-        "  type(42)       →  <class 'int'>\n\n"
-        "CONVERSÃO\n"
-        "  int('42')      →  42\n"
-        "  str(42)        →  '42'\n"
-        "  float('3.14')  →  3.14"
-      ),
-      "code": (
-        "# VARIÁVEIS EM AÇÃO\n\n"
-        'nome      = "Ana Silva"\n'
-        "idade     = 25\n"
-        "altura    = 1.68\n"
-        "estudante = True\n\n"
-        "# Exibindo com f-string (forma moderna)\n"
-        'print(f"Nome: {nome}")\n'
-        'print(f"Idade: {idade} anos")\n'
-        'print(f"Altura: {altura}m")\n'
-        'print(f"Estudante: {estudante}")\n\n'
-        "# Verificando tipos\n"
-        'print(f"\\nTipo nome:  {type(nome)}")\n'
-        'print(f"Tipo idade: {type(idade)}")\n\n'
-        "# Múltipla atribuição\n"
-        "x, y, z = 10, 20, 30\n"
-        'print(f"\\nx={x}, y={y}, z={z}")\n\n'
-        "# Incrementando\n"
-        "contador = 0\n"
-        "contador += 1\n"
-        'print(f"Contador: {contador}")'
-      ),
-      "tip": "Use nomes descritivos: 'idade_usuario' é melhor que 'x'!"
-    },
-    {
-      "id": "py_03", "title": "Operadores", "level": "Iniciante",
-      "emoji": "🔢", "duration": "10 min", "xp": 50,
-      "theory": (
-        "Operadores permitem cálculos e comparações.\n\n"
-        "ARITMÉTICOS\n"
-        "  +    adição:        5 + 3  =  8\n"
-        "  -    subtração:     5 - 3  =  2\n"
-        "  *    multiplicação: 5 * 3  =  15\n"
-        "  /    divisão:       7 / 2  =  3.5  (sempre float!)\n"
-        "  //   divisão int:   7 // 2 =  3    (trunca)\n"
-        "  %    módulo:        7 % 2  =  1    (resto)\n"
-        "  **   potência:      2 ** 8 =  256\n\n"
-        "COMPARAÇÃO (retornam bool)\n"
-        "  ==  igual\n"
-        "  !=  diferente\n"
-        "  >   maior\n"
-        "  <   menor\n"
-        "  >=  maior ou igual\n\n"
-        "LÓGICOS\n"
-        "  and  ambos True\n"
-        "  or   um é True\n"
-        "  not  inverte"
-      ),
-      "code": (
-        "a, b = 10, 3\n\n"
-        'print("=== ARITMÉTICA ===")\n'
-        'print(f"{a} + {b}  = {a + b}")\n'
-        'print(f"{a} - {b}  = {a - b}")\n'
-        'print(f"{a} * {b}  = {a * b}")\n'
-        'print(f"{a} / {b}  = {a / b:.4f}")\n'
-        'print(f"{a} // {b} = {a // b}  (inteira)")\n'
-        'print(f"{a} % {b}  = {a % b}  (resto)")\n'
-        'print(f"{a} ** {b} = {a ** b}  (potência)")\n\n'
-        'print("\\n=== COMPARAÇÃO ===")\n'
-        'print(f"{a} >  {b}  → {a > b}")\n'
-        'print(f"{a} == {b}  → {a == b}")\n'
-        'print(f"{a} != {b}  → {a != b}")\n\n'
-        'print("\\n=== LÓGICOS ===")\n'
-        'print(f"True and True  → {True and True}")\n'
-        'print(f"True or  False → {True or False}")\n'
-        'print(f"not True       → {not True}")'
-      ),
-      "tip": "7 / 2 = 3.5 (float), mas 7 // 2 = 3 (int). Atenção à diferença!"
-    },
-    {
-      "id": "py_04", "title": "Condicionais", "level": "Iniciante",
-      "emoji": "🔀", "duration": "15 min", "xp": 60,
-      "theory": (
-        "Condicionais permitem que o programa tome decisões!\n\n"
-        "ESTRUTURA IF/ELIF/ELSE\n"
-        "  if condicao_1:\n"
-        "      # executa se True\n"
-        "  elif condicao_2:\n"
-        "      # executa se True\n"
-        "  else:\n"
-        "      # nenhuma foi True\n\n"
-        "REGRAS\n"
-        "  • Indentação com 4 espaços é OBRIGATÓRIA\n"
-        "  • elif e else são opcionais\n"
-        "  • Pode ter quantos elif quiser\n\n"
-        "OPERADOR TERNÁRIO\n"
-        "  resultado = 'sim' if condicao else 'não'\n\n"
-        "VALORES FALSY (tratados como False)\n"
-        "  False, None, 0, 0.0, '', [], {}, ()"
-      ),
-      "code": (
-        "nota = 7.8\n\n"
-        "if nota >= 9.0:\n"
-        '    conceito = "A — Excelente!"\n'
-        "elif nota >= 7.0:\n"
-        '    conceito = "B — Bom!"\n'
-        "elif nota >= 5.0:\n"
-        '    conceito = "C — Regular"\n'
-        "else:\n"
-        '    conceito = "F — Reprovado"\n\n'
-        'print(f"Nota: {nota}")\n'
-        'print(f"Conceito: {conceito}")\n\n'
-        "# Operador ternário\n"
-        'aprovado = "Aprovado" if nota >= 5 else "Reprovado"\n'
-        'print(f"Situação: {aprovado}")\n\n'
-        "# Condições compostas\n"
-        "idade = 20\n"
-        "tem_cnh = True\n"
-        "if idade >= 18 and tem_cnh:\n"
-        '    print("\\nPode dirigir!")\n'
-        "elif idade >= 18:\n"
-        '    print("\\nTem idade mas precisa de CNH")\n'
-        "else:\n"
-        '    print("\\nMenor de idade")'
-      ),
-      "tip": "Sempre verifique n % 15 antes de n % 3 e n % 5 no FizzBuzz!"
-    },
-    {
-      "id": "py_05", "title": "Loops: for e while", "level": "Iniciante",
-      "emoji": "🔄", "duration": "18 min", "xp": 60,
-      "theory": (
-        "Loops repetem blocos de código!\n\n"
-        "FOR LOOP\n"
-        "  for i in range(5):         # 0,1,2,3,4\n"
-        "  for i in range(1, 6):      # 1,2,3,4,5\n"
-        "  for i in range(0, 10, 2):  # 0,2,4,6,8\n\n"
-        "WHILE LOOP\n"
-        "  while condicao:\n"
-        "      # SEMPRE atualize a condição!\n\n"
-        "⚠️  while True sem break = loop infinito!\n\n"
-        "CONTROLE\n"
-        "  break     → sai do loop\n"
-        "  continue  → pula iteração atual\n"
-        "  pass      → não faz nada\n\n"
-        "ENUMERATE (índice + valor)\n"
-        "  for i, valor in enumerate(lista):"
-      ),
-      "code": (
-        "# Range básico\n"
-        'print("=== Quadrados ===")\n'
-        "for i in range(1, 8):\n"
-        '    print(f"  {i}² = {i**2}")\n\n'
-        "# Iterando com enumerate\n"
-        'frutas = ["Maçã", "Banana", "Uva"]\n'
-        'print("\\n=== Frutas ===")\n'
-        "for i, fruta in enumerate(frutas):\n"
-        '    print(f"  [{i}] {fruta}")\n\n'
-        "# While\n"
-        'print("\\n=== Contagem ===")\n'
-        "n = 5\n"
-        "while n > 0:\n"
-        '    print(f"  {n}...", end=" ")\n'
-        "    n -= 1\n"
-        'print("LANÇAMENTO!")\n\n'
-        "# Break e Continue\n"
-        'print("\\n=== Sem múltiplos de 3 ===")\n'
-        "for num in range(1, 16):\n"
-        "    if num % 3 == 0:\n"
-        "        continue\n"
-        "    if num > 13:\n"
-        "        break\n"
-        '    print(f"  {num}", end=" ")'
-      ),
-      "tip": "Prefira for sobre while quando souber o número de iterações!"
-    },
-    {
-      "id": "py_06", "title": "Funções", "level": "Intermediário",
-      "emoji": "⚙️", "duration": "20 min", "xp": 80,
-      "theory": (
-        "Funções são blocos de código reutilizáveis!\n\n"
-        "DEFININDO\n"
-        "  def nome(parâmetros):\n"
-        "      '''Docstring'''\n"
-        "      return valor\n\n"
-        "TIPOS DE PARÂMETROS\n"
-        "  def f(a, b):       posicionais\n"
-        "  def f(a, b=10):    com default\n"
-        "  def f(*args):      qualquer qtd → tupla\n"
-        "  def f(**kwargs):   nomeados → dict\n\n"
-        "LAMBDA\n"
-        "  Funções anônimas de uma linha:\n"
-        "  dobro = lambda x: x * 2\n\n"
-        "ESCOPO\n"
-        "  • Variáveis dentro são LOCAIS\n"
-        "  • Use global para modificar externas\n"
-        "  • Prefira retornar valores a modificar globais"
-      ),
-      "code": (
-        "def calcular_imc(peso: float, altura: float) -> tuple:\n"
-        "    '''Calcula o IMC e retorna (valor, categoria)'''\n"
-        "    if altura <= 0:\n"
-        '        raise ValueError("Altura deve ser positiva")\n'
-        "    imc = peso / (altura ** 2)\n"
-        '    if imc < 18.5:   cat = "Abaixo do peso"\n'
-        '    elif imc < 25.0: cat = "Normal"\n'
-        '    elif imc < 30.0: cat = "Sobrepeso"\n'
-        '    else:            cat = "Obesidade"\n'
-        "    return round(imc, 1), cat\n\n"
-        "imc, cat = calcular_imc(70, 1.75)\n"
-        'print(f"IMC: {imc} — {cat}")\n\n'
-        "# *args\n"
-        "def somar(*numeros: float) -> float:\n"
-        "    return sum(numeros)\n\n"
-        'print(f"\\nSoma: {somar(1, 2, 3)}")\n'
-        'print(f"Soma: {somar(10, 20, 30, 40)}")\n\n'
-        "# **kwargs\n"
-        "def criar_perfil(**dados) -> None:\n"
-        '    print("\\nPERFIL:")\n'
-        "    for campo, valor in dados.items():\n"
-        '        print(f"  {campo}: {valor}")\n\n'
-        'criar_perfil(nome="Ana", idade=25, cidade="SP")\n\n'
-        "# Lambda com map\n"
-        "dobro = lambda x: x * 2\n"
-        "nums  = list(map(dobro, range(1, 6)))\n"
-        'print(f"\\nDobros: {nums}")'
-      ),
-      "tip": "Uma boa função: faz UMA coisa, tem nome descritivo e docstring!"
-    },
-    {
-      "id": "py_07", "title": "Listas", "level": "Intermediário",
-      "emoji": "📋", "duration": "22 min", "xp": 80,
-      "theory": (
-        "Listas são a estrutura mais usada em Python!\n\n"
-        "ACESSO\n"
-        "  lista[0]     → primeiro\n"
-        "  lista[-1]    → último\n"
-        "  lista[1:4]   → fatia [1,2,3]\n"
-        "  lista[::-1]  → invertida\n\n"
-        "MÉTODOS\n"
-        "  append(x)    adiciona ao fim\n"
-        "  insert(i,x)  insere na posição\n"
-        "  remove(x)    remove 1ª ocorrência\n"
-        "  pop()        remove e retorna o último\n"
-        "  sort()       ordena no lugar (in-place)\n"
-        "  sorted()     retorna nova lista ordenada\n"
-        "  len(lista)   tamanho\n\n"
-        "LIST COMPREHENSION\n"
-        "  [expr for item in iter if cond]\n"
-        "  quadrados = [x**2 for x in range(10)]\n"
-        "  pares = [x for x in range(20) if x%2==0]"
-      ),
-      "code": (
-        'linguagens = ["Python", "JavaScript", "Java", "Rust"]\n\n'
-        'print(f"Lista:   {linguagens}")\n'
-        'print(f"Primeira: {linguagens[0]}")\n'
-        'print(f"Última:   {linguagens[-1]}")\n'
-        'print(f"Fatia:    {linguagens[1:3]}")\n\n'
-        "# Manipulação\n"
-        'linguagens.append("Go")\n'
-        'linguagens.insert(0, "C++")\n'
-        'print(f"\\nApós add: {linguagens}")\n'
-        'linguagens.remove("C++")\n'
-        'print(f"Final:    {linguagens}")\n\n'
-        "# Ordenação\n"
-        "numeros = [64, 34, 25, 12, 22, 11, 90]\n"
-        'print(f"\\nOriginal:   {numeros}")\n'
-        'print(f"Crescente:  {sorted(numeros)}")\n'
-        'print(f"Decrescente:{sorted(numeros, reverse=True)}")\n\n'
-        "# List Comprehension\n"
-        'print("\\n=== List Comprehension ===")\n'
-        "quadrados = [x**2 for x in range(1, 9)]\n"
-        'print(f"Quadrados: {quadrados}")\n\n'
-        "pares = [x for x in range(1, 21) if x % 2 == 0]\n"
-        'print(f"Pares:     {pares}")'
-      ),
-      "tip": "List comprehension é até 35% mais rápida que loop for equivalente!"
-    },
-    {
-      "id": "py_08", "title": "Dicionários e Sets", "level": "Intermediário",
-      "emoji": "🗂️", "duration": "20 min", "xp": 80,
-      "theory": (
-        "Dicionários armazenam pares chave → valor!\n\n"
-        "CRIANDO\n"
-        "  pessoa = {\n"
-        "      'nome': 'Ana',\n"
-        "      'idade': 25\n"
-        "  }\n\n"
-        "ACESSANDO\n"
-        "  pessoa['nome']          → 'Ana'\n"
-        "  pessoa.get('nome')      → 'Ana' (seguro)\n"
-        "  pessoa.get('x', 'N/A') → 'N/A' (default)\n\n"
-        "MÉTODOS ÚTEIS\n"
-        "  .keys()    → chaves\n"
-        "  .values()  → valores\n"
-        "  .items()   → pares (k,v)\n"
-        "  .update()  → mescla outro dict\n"
-        "  .pop(k)    → remove e retorna\n\n"
-        "SETS — Coleção sem duplicatas:\n"
-        "  a | b  → união\n"
-        "  a & b  → interseção\n"
-        "  a - b  → diferença\n"
-        "  a ^ b  → diferença simétrica"
-      ),
-      "code": (
-        "dev = {\n"
-        '    "nome":   "Carlos",\n'
-        '    "idade":  28,\n'
-        '    "skills": ["Python", "Django", "Docker"],\n'
-        '    "nivel":  "Senior"\n'
-        "}\n\n"
-        'print(f"Nome: {dev[\'nome\']}")\n'
-        'print(f"Cargo: {dev.get(\'cargo\', \'Não informado\')}")\n\n'
-        'print("\\nPerfil completo:")\n'
-        "for chave, valor in dev.items():\n"
-        '    print(f"  {chave:12} → {valor}")\n\n'
-        "# Dict Comprehension\n"
-        'print("\\n=== Potências ===")\n'
-        'potencias = {f"2^{i}": 2**i for i in range(1, 9)}\n'
-        "for k, v in potencias.items():\n"
-        '    print(f"  {k:5} = {v}")\n\n'
-        "# Sets\n"
-        'print("\\n=== Sets ===")\n'
-        "a = {1, 2, 3, 4, 5}\n"
-        "b = {3, 4, 5, 6, 7}\n"
-        'print(f"União:     {a | b}")\n'
-        'print(f"Interseção:{a & b}")\n'
-        'print(f"Diferença: {a - b}")\n\n'
-        "# Remove duplicatas\n"
-        "lista = [1, 2, 2, 3, 3, 3, 4]\n"
-        'print(f"\\nSem duplicatas: {list(set(lista))}")'
-      ),
-      "tip": "Use set() para remover duplicatas de uma lista rapidamente!"
-    },
-  ],
-  "javascript": [
-    {
-      "id": "js_01", "title": "Fundamentos do JS", "level": "Iniciante",
-      "emoji": "⚡", "duration": "12 min", "xp": 50,
-      "theory": (
-        "JavaScript é a linguagem da web!\n\n"
-        "VARIÁVEIS\n"
-        "  var x = 1;   → EVITE (escopo problemático)\n"
-        "  let y = 2;   → mutável, escopo de bloco\n"
-        "  const Z = 3; → imutável\n\n"
-        "TIPOS PRIMITIVOS\n"
-        "  number:    42, 3.14, NaN, Infinity\n"
-        "  string:    'texto', \"texto\", `template`\n"
-        "  boolean:   true, false\n"
-        "  null:      valor vazio intencional\n"
-        "  undefined: variável declarada sem valor\n"
-        "  bigint:    9007199254740993n\n"
-        "  symbol:    Symbol('id')\n\n"
-        "TEMPLATE LITERALS\n"
-        "  const msg = `Olá, ${nome}! Você tem ${idade} anos.`;\n\n"
-        "⚠️  ARMADILHAS\n"
-        "  typeof null  → 'object'  (bug histórico!)\n"
-        "  5 == '5'     → true   (coerção)\n"
-        "  5 === '5'    → false  (sem coerção)\n"
-        "  SEMPRE use === !"
-      ),
-      "code": (
-        "// JAVASCRIPT FUNDAMENTOS\n\n"
-        'let nome = "Ana Silva";\n'
-        "const ANO_NASC = 1999;\n"
-        "let ativo = true;\n\n"
-        "const idade = new Date().getFullYear() - ANO_NASC;\n"
-        "console.log(`${nome} tem ${idade} anos`);\n\n"
-        "// Operadores\n"
-        "const a = 10, b = 3;\n"
-        'console.log(`${a} + ${b} = ${a + b}`);\n'
-        'console.log(`${a} ** ${b} = ${a ** b}`);\n'
-        'console.log(`${a} % ${b} = ${a % b}`);\n\n'
-        "// == vs ===\n"
-        "console.log('\\n=== Comparação ===');\n"
-        'console.log(`5 == "5"  → ${5 == "5"}`);\n'
-        'console.log(`5 === "5" → ${5 === "5"}`);\n\n'
-        "// typeof\n"
-        "const vals = [42, 'texto', true, null, undefined];\n"
-        "vals.forEach(v => {\n"
-        "  console.log(`${String(v).padEnd(10)} → typeof: ${typeof v}`);\n"
-        "});"
-      ),
-      "tip": "Sempre use === (triplo igual) — nunca == em JavaScript!"
-    },
-    {
-      "id": "js_02", "title": "Arrow Functions", "level": "Iniciante",
-      "emoji": "🏹", "duration": "18 min", "xp": 60,
-      "theory": (
-        "JavaScript tem 3 formas de criar funções!\n\n"
-        "FUNCTION DECLARATION (com hoisting)\n"
-        "  function somar(a, b) { return a + b; }\n\n"
-        "FUNCTION EXPRESSION (sem hoisting)\n"
-        "  const somar = function(a, b) { return a + b; };\n\n"
-        "ARROW FUNCTION (ES6+)\n"
-        "  const somar = (a, b) => a + b;\n\n"
-        "SIMPLIFICAÇÕES\n"
-        "  1 parâmetro: sem parênteses → x => x * 2\n"
-        "  1 linha:     sem {} e sem return\n"
-        "  0 params:    parênteses obrigatórios → () => 42\n\n"
-        "DEFAULT PARAMS\n"
-        "  const greet = (nome = 'Dev') => `Olá, ${nome}!`;\n\n"
-        "REST PARAMS\n"
-        "  const soma = (...nums) => nums.reduce((a,b)=>a+b,0);\n\n"
-        "⚠️  Arrow functions NÃO têm 'this' próprio!"
-      ),
-      "code": (
-        "// Arrow functions\n"
-        "const dobro    = x => x * 2;\n"
-        "const quadrado = x => x ** 2;\n"
-        "const saudar   = (nome = 'Dev') => `Olá, ${nome}!`;\n\n"
-        'console.log(`Dobro de 7: ${dobro(7)}`);\n'
-        'console.log(`Quadrado de 8: ${quadrado(8)}`);\n'
-        'console.log(saudar());\n'
-        'console.log(saudar("Ana"));\n\n'
-        "// Rest parameters\n"
-        "const somar = (...nums) => {\n"
-        "  const total = nums.reduce((acc, n) => acc + n, 0);\n"
-        '  console.log(`Soma de [${nums}] = ${total}`);\n'
-        "  return total;\n"
-        "};\n"
-        "somar(1, 2, 3);\n"
-        "somar(10, 20, 30, 40, 50);\n\n"
-        "// Higher-order functions encadeadas\n"
-        "const nums = [1,2,3,4,5,6,7,8,9,10];\n"
-        "const resultado = nums\n"
-        "  .filter(n => n % 2 === 0)    // pares\n"
-        "  .map(n => n ** 2)            // quadrado\n"
-        "  .reduce((acc, n) => acc + n, 0); // soma\n\n"
-        'console.log(`\\nSoma dos quadrados dos pares: ${resultado}`);'
-      ),
-      "tip": "Arrow functions não têm 'this' — use function para métodos de objeto!"
-    },
-    {
-      "id": "js_03", "title": "Arrays Modernos", "level": "Intermediário",
-      "emoji": "📊", "duration": "25 min", "xp": 80,
-      "theory": (
-        "Arrays em JS têm métodos funcionais poderosos!\n\n"
-        "TRANSFORMAÇÃO\n"
-        "  map(fn)        → novo array transformado\n"
-        "  filter(fn)     → novo array filtrado\n"
-        "  reduce(fn, i)  → reduz a um único valor\n"
-        "  flatMap(fn)    → map + flatten\n\n"
-        "BUSCA\n"
-        "  find(fn)       → primeiro que passa\n"
-        "  findIndex(fn)  → índice do primeiro\n"
-        "  includes(x)    → boolean\n"
-        "  some(fn)       → true se ALGUM passa\n"
-        "  every(fn)      → true se TODOS passam\n\n"
-        "OUTROS\n"
-        "  sort(fn)       → SEMPRE passe comparador!\n"
-        "  slice(i,j)     → cópia (não modifica)\n"
-        "  splice(i,n)    → modifica no lugar\n"
-        "  flat(depth)    → achata arrays aninhados\n\n"
-        "DESTRUCTURING\n"
-        "  const [a, b, ...resto] = [1, 2, 3, 4];"
-      ),
-      "code": (
-        "const produtos = [\n"
-        '  { nome: "Notebook",  preco: 2500, estoque: 15 },\n'
-        '  { nome: "Mouse",     preco: 80,   estoque: 50 },\n'
-        '  { nome: "Teclado",   preco: 150,  estoque: 30 },\n'
-        '  { nome: "Monitor",   preco: 1200, estoque: 0  },\n'
-        "];\n\n"
-        "// filter + map + sort encadeados\n"
-        "const pipeline = produtos\n"
-        "  .filter(p => p.estoque > 0)\n"
-        "  .map(p => ({ ...p, total: p.preco * p.estoque }))\n"
-        "  .sort((a, b) => b.total - a.total);\n\n"
-        "console.log('=== Produtos em estoque (por valor) ===');\n"
-        "pipeline.forEach(p =>\n"
-        '  console.log(`  ${p.nome.padEnd(10)} → R$${p.total.toLocaleString()}`)\n'
-        ");\n\n"
-        "// reduce\n"
-        "const valorTotal = pipeline.reduce((acc, p) => acc + p.total, 0);\n"
-        'console.log(`\\nEstoque total: R$${valorTotal.toLocaleString()}`);\n\n'
-        "// Destructuring\n"
-        "const [maisValioso, ...resto] = pipeline;\n"
-        'console.log(`\\nMais valioso: ${maisValioso.nome}`);\n\n'
-        'console.log(`Algum > R$2000? ${produtos.some(p => p.preco > 2000)}`);\n'
-        'console.log(`Todos com preço? ${produtos.every(p => p.preco > 0)}`);'
-      ),
-      "tip": "Nunca use .sort() sem comparador para números — dá resultado errado!"
-    },
-    {
-      "id": "js_04", "title": "Classes ES6+", "level": "Intermediário",
-      "emoji": "🏛️", "duration": "28 min", "xp": 90,
-      "theory": (
-        "JavaScript moderno tem classes reais!\n\n"
-        "ESTRUTURA\n"
-        "  class Animal {\n"
-        "    #nome;           // campo privado (ES2022)\n"
-        "    static count = 0; // campo estático\n\n"
-        "    constructor(nome) {\n"
-        "      this.#nome = nome;\n"
-        "      Animal.count++;\n"
-        "    }\n"
-        "    get nome() { return this.#nome; }\n"
-        "    falar() { return `${this.nome}...`; }\n"
-        "  }\n\n"
-        "HERANÇA\n"
-        "  class Cachorro extends Animal {\n"
-        "    falar() { return `${this.nome}: Au au!`; }\n"
-        "  }\n\n"
-        "SPREAD / REST\n"
-        "  const novo = { ...pessoa, cidade: 'SP' };\n"
-        "  const copia = [...array, 99];"
-      ),
-      "code": (
-        "class ContaBancaria {\n"
-        "  #saldo = 0;\n"
-        "  #historico = [];\n\n"
-        "  constructor(titular, numero) {\n"
-        "    if (!titular) throw new Error('Titular obrigatório');\n"
-        "    this.titular = titular;\n"
-        "    this.numero  = numero;\n"
-        "  }\n\n"
-        "  depositar(valor) {\n"
-        "    if (valor <= 0) throw new Error('Valor inválido');\n"
-        "    this.#saldo += valor;\n"
-        "    this.#historico.push({ tipo: 'Depósito', valor, saldo: this.#saldo });\n"
-        "    return this; // permite encadeamento\n"
-        "  }\n\n"
-        "  sacar(valor) {\n"
-        "    if (valor > this.#saldo) throw new Error('Saldo insuficiente');\n"
-        "    this.#saldo -= valor;\n"
-        "    this.#historico.push({ tipo: 'Saque', valor, saldo: this.#saldo });\n"
-        "    return this;\n"
-        "  }\n\n"
-        "  get saldo() { return this.#saldo; }\n\n"
-        "  extrato() {\n"
-        "    console.log(`\\n=== Conta ${this.numero} — ${this.titular} ===`);\n"
-        "    this.#historico.forEach(({ tipo, valor, saldo }) =>\n"
-        "      console.log(`  ${tipo.padEnd(9)} R$${valor.toFixed(2).padStart(8)} | Saldo: R$${saldo.toFixed(2)}`)\n"
-        "    );\n"
-        "  }\n"
-        "}\n\n"
-        "const conta = new ContaBancaria('Ana', '001-234');\n"
-        "conta.depositar(1000).depositar(500).sacar(200);\n"
-        "conta.extrato();\n"
-        'console.log(`\\nSaldo: R$${conta.saldo.toFixed(2)}`);'
-      ),
-      "tip": "Use # para campos privados reais em classes modernas (ES2022)!"
-    },
-  ],
-  "java": [
-    {
-      "id": "java_01", "title": "Introdução ao Java", "level": "Iniciante",
-      "emoji": "☕", "duration": "15 min", "xp": 60,
-      "theory": (
-        "Java é fortemente tipada e orientada a objetos!\n\n"
-        "ESTRUTURA OBRIGATÓRIA\n"
-        "  public class NomeArquivo {\n"
-        "      public static void main(String[] args) {\n"
-        "          // código aqui\n"
-        "      }\n"
-        "  }\n"
-        "  ⚠️  Nome da classe == nome do arquivo!\n\n"
-        "TIPOS PRIMITIVOS\n"
-        "  int     inteiro       (4 bytes, -2^31 a 2^31-1)\n"
-        "  long    inteiro grande (8 bytes) → use 100L\n"
-        "  double  decimal (64-bit) → padrão para reais\n"
-        "  float   decimal (32-bit) → use 3.14f\n"
-        "  char    caractere Unicode → 'A'\n"
-        "  boolean true / false\n\n"
-        "⚠️  String NÃO é primitivo — é uma Classe!\n\n"
-        "SAÍDA\n"
-        "  System.out.println()  → com quebra de linha\n"
-        "  System.out.printf()   → formatação estilo C"
-      ),
-      "code": (
-        "// JAVA FUNDAMENTOS\n"
-        "// Arquivo: Fundamentos.java\n\n"
-        "public class Fundamentos {\n\n"
-        "    public static void main(String[] args) {\n\n"
-        "        // Tipos primitivos\n"
-        "        int     idade  = 25;\n"
-        "        double  altura = 1.75;\n"
-        "        float   peso   = 70.5f;       // 'f' obrigatório!\n"
-        "        long    pop    = 8_000_000_000L; // '_' melhora leitura\n"
-        "        char    inicial= 'A';\n"
-        "        boolean ativo  = true;\n\n"
-        "        // String (é uma Classe!)\n"
-        '        String nome = "Carlos Silva";\n\n'
-        "        // Printf formatado\n"
-        '        System.out.println("=== DADOS ===");\n'
-        '        System.out.printf("Nome:   %s%n",   nome);\n'
-        '        System.out.printf("Idade:  %d anos%n", idade);\n'
-        '        System.out.printf("Altura: %.2f m%n", altura);\n'
-        '        System.out.printf("Ativo:  %b%n", ativo);\n\n'
-        "        // CUIDADO: int / int = int !\n"
-        "        int a = 10, b = 3;\n"
-        '        System.out.println("\\n=== OPERAÇÕES ===");\n'
-        '        System.out.println("int/int:  " + (a / b));          // 3\n'
-        '        System.out.println("double:   " + (a / (double)b));  // 3.333\n'
-        '        System.out.println("Módulo:   " + (a % b));\n'
-        '        System.out.println("Potência: " + (int)Math.pow(a, b));\n'
-        "    }\n"
-        "}"
-      ),
-      "tip": "int/int = int em Java! Use (double)a / b para resultado decimal."
-    },
-    {
-      "id": "java_02", "title": "Condicionais e Loops", "level": "Iniciante",
-      "emoji": "🔄", "duration": "18 min", "xp": 70,
-      "theory": (
-        "Java tem as mesmas estruturas do C/C++!\n\n"
-        "IF/ELSE IF/ELSE\n"
-        "  if (condicao) { }\n"
-        "  else if (outra) { }\n"
-        "  else { }\n\n"
-        "SWITCH EXPRESSION (Java 14+)\n"
-        "  String result = switch (valor) {\n"
-        "      case 1 -> \"Um\";\n"
-        "      case 2, 3 -> \"Dois ou Três\";\n"
-        "      default -> \"Outro\";\n"
-        "  };\n\n"
-        "LOOPS\n"
-        "  for (int i=0; i<10; i++) { }     // clássico\n"
-        "  while (cond) { }                 // testa antes\n"
-        "  do { } while (cond);             // testa depois\n"
-        "  for (int n : array) { }          // for-each\n\n"
-        "CONTROLE\n"
-        "  break    → sai do loop\n"
-        "  continue → pula iteração\n"
-        "  return   → sai do método"
-      ),
-      "code": (
-        "public class ControleDeFluxo {\n\n"
-        "    public static void main(String[] args) {\n\n"
-        "        // Switch Expression (Java 14+)\n"
-        "        int mes = 7;\n"
-        "        String estacao = switch (mes) {\n"
-        "            case 12, 1, 2  -> \"Verão\";\n"
-        "            case 3, 4, 5   -> \"Outono\";\n"
-        "            case 6, 7, 8   -> \"Inverno\";\n"
-        "            case 9, 10, 11 -> \"Primavera\";\n"
-        "            default -> throw new IllegalArgumentException(\"Mês inválido: \" + mes);\n"
-        "        };\n"
-        "        System.out.println(\"Mês \" + mes + \": \" + estacao);\n\n"
-        "        // For — Tabuada com printf\n"
-        "        System.out.println(\"\\n=== TABUADA DO 7 ===\");\n"
-        "        for (int i = 1; i <= 10; i++)\n"
-        "            System.out.printf(\"  7 × %2d = %2d%n\", i, 7 * i);\n\n"
-        "        // For-each\n"
-        "        String[] langs = {\"Java\", \"Python\", \"JavaScript\"};\n"
-        "        System.out.println(\"\\n=== LINGUAGENS ===\");\n"
-        "        for (String lang : langs)\n"
-        "            System.out.println(\"  → \" + lang);\n\n"
-        "        // Do-while — potências de 2\n"
-        "        System.out.println(\"\\n=== POTÊNCIAS DE 2 ===\");\n"
-        "        int v = 1;\n"
-        "        do {\n"
-        "            System.out.print(v + \" \");\n"
-        "            v *= 2;\n"
-        "        } while (v <= 1024);\n"
-        "    }\n"
-        "}"
-      ),
-      "tip": "Use for-each quando não precisar do índice — mais seguro e legível!"
-    },
-    {
-      "id": "java_03", "title": "Classes e OOP", "level": "Intermediário",
-      "emoji": "🏛️", "duration": "35 min", "xp": 100,
-      "theory": (
-        "Java foi construído para OOP!\n\n"
-        "OS 4 PILARES\n"
-        "  1. ENCAPSULAMENTO\n"
-        "     Oculte dados com private.\n"
-        "     Exponha via getters/setters.\n\n"
-        "  2. HERANÇA\n"
-        "     class Filho extends Pai { }\n"
-        "     Use super() para chamar o pai.\n\n"
-        "  3. POLIMORFISMO\n"
-        "     Mesma interface, comportamentos diferentes.\n"
-        "     @Override para sobrescrever métodos.\n\n"
-        "  4. ABSTRAÇÃO\n"
-        "     abstract class / interface simplificam.\n\n"
-        "ABSTRACT vs INTERFACE\n"
-        "  abstract: herança única, pode ter estado\n"
-        "  interface: múltipla, apenas contrato"
-      ),
-      "code": (
-        "abstract class Funcionario {\n"
-        "    protected final String nome;\n"
-        "    protected double salarioBase;\n\n"
-        "    public Funcionario(String nome, double salBase) {\n"
-        "        if (nome == null || nome.isBlank())\n"
-        "            throw new IllegalArgumentException(\"Nome inválido\");\n"
-        "        if (salBase <= 0)\n"
-        "            throw new IllegalArgumentException(\"Salário deve ser > 0\");\n"
-        "        this.nome = nome;\n"
-        "        this.salarioBase = salBase;\n"
-        "    }\n\n"
-        "    public abstract double calcularSalario();\n\n"
-        "    public void exibirInfo() {\n"
-        "        System.out.printf(\"  %-20s → R$ %,10.2f%n\",\n"
-        "                          nome, calcularSalario());\n"
-        "    }\n"
-        "}\n\n"
-        "class Desenvolvedor extends Funcionario {\n"
-        "    private final int horasExtras;\n"
-        "    private static final double VALOR_HORA_EXTRA = 80.0;\n\n"
-        "    public Desenvolvedor(String nome, double base, int horas) {\n"
-        "        super(nome, base);\n"
-        "        this.horasExtras = Math.max(0, horas);\n"
-        "    }\n\n"
-        "    @Override\n"
-        "    public double calcularSalario() {\n"
-        "        return salarioBase + (horasExtras * VALOR_HORA_EXTRA);\n"
-        "    }\n"
-        "}\n\n"
-        "class Gerente extends Funcionario {\n"
-        "    private final double bonus;\n\n"
-        "    public Gerente(String nome, double base, double bonus) {\n"
-        "        super(nome, base);\n"
-        "        this.bonus = Math.max(0, bonus);\n"
-        "    }\n\n"
-        "    @Override\n"
-        "    public double calcularSalario() {\n"
-        "        return salarioBase + bonus;\n"
-        "    }\n"
-        "}\n\n"
-        "public class SistemaRH {\n"
-        "    public static void main(String[] args) {\n"
-        "        Funcionario[] equipe = {\n"
-        '            new Desenvolvedor("Ana Silva",     8000, 20),\n'
-        '            new Desenvolvedor("Carlos Lima",   9500, 15),\n'
-        '            new Gerente("Beatriz Costa",       12000, 3000),\n'
-        "        };\n\n"
-        '        System.out.println("=== FOLHA DE PAGAMENTO ===");\n'
-        "        double total = 0;\n"
-        "        for (Funcionario f : equipe) {\n"
-        "            f.exibirInfo();\n"
-        "            total += f.calcularSalario();\n"
-        "        }\n"
-        '        System.out.printf("%n  TOTAL: R$ %,10.2f%n", total);\n'
-        "    }\n"
-        "}"
-      ),
-      "tip": "Programe para interfaces/abstrações, não para implementações!"
-    },
-  ]
+SEARCH_K1, SEARCH_B   = 1.2, 0.75
+SEARCH_MAX_POSTINGS   = 500    # per exact term; lower-weighted matches beyond it are not scored
+SEARCH_MAX_EXPANSIONS = 8      # vocabulary terms a typeahead prefix expands to
+SEARCH_PREFIX_WEIGHT  = 0.6
+SEARCH_MAX_QUERY      = 200
+SEARCH_MAX_RESULTS    = 50
+SEARCH_SNIPPET        = 160
+# (field, weight) per kind: a title hit counts like several body hits
+SEARCH_FIELDS = {
+    "lesson":   (("title", 3), ("theory", 1), ("tip", 1), ("code", 1)),
+    "exercise": (("title", 3), ("desc", 1), ("hint", 1)),
+    "quiz":     (("q", 2), ("opts", 1)),  # never `exp`: it gives the answer away
 }
+_SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+    a o e as os um uma uns umas de do da dos das em no na nos nas ao aos para pra por pelo
+    pela pelos pelas com sem que se ou mas como mais menos muito ja nao sim sao ser esta este
+    esse essa isso isto ele ela eles elas voce seu sua seus suas meu minha eu lhe quando onde
+    qual quais ha foi era tem ter entre sobre ate so tambem cada
+""".split())
+# Light stemmer: plurals and -mente adverbs, first matching suffix wins
+_STEM_RULES = (("coes", "cao"), ("soes", "sao"), ("oes", "ao"), ("aes", "ao"), ("ais", "al"),
+               ("eis", "el"), ("ois", "ol"), ("mente", ""), ("ns", "m"), ("res", "r"), ("s", ""))
+
+def fold_text(text: str) -> str:
+    """Lowercase ASCII: accents and symbols outside ASCII are dropped."""
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+@lru_cache(maxsize=1 << 16)  # a catalogue has far fewer distinct words than tokens
+def _stem(token: str) -> str:
+    if len(token) > 4:
+        for suffix, repl in _STEM_RULES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                if suffix == "s" and token.endswith(("ss", "us", "is")):
+                    break
+                return token[:-len(suffix)] + repl
+    return token
+
+def search_terms(text: str) -> list:
+    return [_stem(t) for t in _SEARCH_TOKEN_RE.findall(fold_text(text))
+            if len(t) > 1 and t not in _STOPWORDS]
+
+class SearchIndex:
+    """BM25 over lessons, exercises and quizzes.
+
+    `postings[term]` is (doc numbers, weights) as two arrays sorted by weight,
+    so memory stays at ~8 bytes per posting even for large catalogues.
+    `filtered[term]` counts its documents per (lang, kind), "" acting as a
+    wildcard, so a filtered total never has to scan the postings.
+    """
+
+    def __init__(self, docs: list, postings: dict, filtered: dict):
+        self.docs     = docs        # (kind, id, lang, level, title, snippet)
+        self.postings = postings
+        self.filtered = filtered
+        self.vocab    = sorted(postings)
+
+    @classmethod
+    def from_pack(cls, content: "ContentPack") -> "SearchIndex":
+        docs, counts = [], []
+
+        def add(kind: str, item: dict, lang: str):
+            tf = {}
+            for field, weight in SEARCH_FIELDS[kind]:
+                value = item.get(field)
+                if value:
+                    for term in search_terms(" ".join(value) if isinstance(value, list) else str(value)):
+                        tf[term] = tf.get(term, 0) + weight
+            text = item.get("theory") or item.get("desc") or item.get("q") or ""
+            docs.append((kind, item["id"], lang, item.get("level", ""), item.get("title") or item.get("q", ""),
+                         " ".join(text.split())[:SEARCH_SNIPPET]))
+            counts.append(tf)
+
+        # Lesson bodies are parsed here without going through decode(), so the
+        # pack doesn't keep every lesson as Python objects afterwards
+        for meta in content.decode("languages"):
+            entry = content.body(f"lessons/{meta['id']}")
+            for lesson in json.loads(entry.body) if entry is not None else ():
+                add("lesson", lesson, meta["id"])
+        for exercise in content.decode("exercises"):
+            add("exercise", exercise, exercise["lang"])
+        for quiz in content.quizzes:
+            add("quiz", quiz, quiz["lang"])
+
+        n      = len(docs)
+        avg_dl = sum(sum(tf.values()) for tf in counts) / n if n else 1
+        by_term: dict = {}
+        for doc, tf in enumerate(counts):
+            norm = SEARCH_K1 * (1 - SEARCH_B + SEARCH_B * sum(tf.values()) / avg_dl)
+            for term, f in tf.items():
+                by_term.setdefault(term, []).append((f * (SEARCH_K1 + 1) / (f + norm), doc))
+        postings, filtered = {}, {}
+        for term, entries in by_term.items():
+            idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            entries.sort(reverse=True)
+            postings[term] = (array("I", [doc for _, doc in entries]),
+                              array("f", [w * idf for w, _ in entries]))
+            per_filter = filtered[term] = {}
+            for _, doc in entries:
+                kind, lang = docs[doc][0], docs[doc][2]
+                for key in ((lang, kind), (lang, ""), ("", kind)):
+                    per_filter[key] = per_filter.get(key, 0) + 1
+        return cls(docs, postings, filtered)
+
+    def _expand(self, prefix: str, exact: str) -> list:
+        terms, i = [], bisect.bisect_left(self.vocab, prefix)
+        while i < len(self.vocab) and len(terms) < SEARCH_MAX_EXPANSIONS and self.vocab[i].startswith(prefix):
+            if self.vocab[i] != exact:
+                terms.append(self.vocab[i])
+            i += 1
+        return terms
+
+    def search(self, query: str, limit: int = 10, lang: str = "", kind: str = ""):
+        """(hits, matched, exact): the `limit` best documents, how many documents
+        matched and whether that count is exact. With several terms only the
+        best SEARCH_MAX_POSTINGS of each are scored, so past that cap `matched`
+        is a lower bound. Unless the query ends in a space, its last word also
+        matches as a prefix."""
+        words = _SEARCH_TOKEN_RE.findall(fold_text(query))
+        typeahead = bool(words) and not query[-1:].isspace()
+        groups = []   # (term, doc numbers, weights, how many to read, factor)
+        for i, word in enumerate(words):
+            term = _stem(word)
+            if term in self.postings and word not in _STOPWORDS:
+                docs, weights = self.postings[term]
+                groups.append((term, docs, weights, SEARCH_MAX_POSTINGS, 1.0))
+            if typeahead and i == len(words) - 1 and len(word) > 1:
+                for extra in self._expand(word, term):
+                    docs, weights = self.postings[extra]
+                    groups.append((extra, docs, weights, SEARCH_MAX_POSTINGS // SEARCH_MAX_EXPANSIONS,
+                                   SEARCH_PREFIX_WEIGHT))
+        if not groups:
+            return [], 0, True
+
+        def wanted(doc: int) -> bool:
+            d = self.docs[doc]
+            return (not kind or d[0] == kind) and (not lang or d[2] == lang)
 
-EXERCISES = [
-  {
-    "id": "ex_py_01", "lang": "python", "level": "Iniciante", "emoji": "👋", "xp": 100,
-    "title": "Saudação Personalizada",
-    "desc": (
-      "Crie a função saudar(nome) que retorne:\n"
-      "  'Olá, [NOME]! Bem-vindo ao CodeMaster Pro!'\n\n"
-      "O nome deve estar em MAIÚSCULAS.\n\n"
-      "Exemplos:\n"
-      "  saudar('ana')    → 'Olá, ANA! Bem-vindo ao CodeMaster Pro!'\n"
-      "  saudar('carlos') → 'Olá, CARLOS! Bem-vindo ao CodeMaster Pro!'"
-    ),
-    "hint": "Use .upper() para maiúsculas e f-strings para formatar.",
-    "starter": (
-      "def saudar(nome: str) -> str:\n"
-      "    nome_maiusculo = nome._____()\n"
-      '    return f"_____, {_____}! Bem-vindo ao CodeMaster Pro!"\n\n'
-      'print(saudar("ana"))\n'
-      'print(saudar("carlos"))'
-    ),
-    "solution": (
-      "def saudar(nome: str) -> str:\n"
-      "    nome_maiusculo = nome.upper()\n"
-      '    return f"Olá, {nome_maiusculo}! Bem-vindo ao CodeMaster Pro!"\n\n'
-      'print(saudar("ana"))\n'
-      'print(saudar("carlos"))'
-    )
-  },
-  {
-    "id": "ex_py_02", "lang": "python", "level": "Iniciante", "emoji": "🔢", "xp": 100,
-    "title": "Par ou Ímpar",
-    "desc": (
-      "Crie verificar(n) que retorne 'par' ou 'ímpar'.\n"
-      "Depois use list comprehension para listar todos\n"
-      "os pares de 1 a 20."
-    ),
-    "hint": "Use % 2. Se n % 2 == 0, é par!",
-    "starter": (
-      "def verificar(numero: int) -> str:\n"
-      "    if numero % ___ == ___:\n"
-      '        return "par"\n'
-      '    return "ímpar"\n\n'
-      "for i in range(1, 11):\n"
-      '    print(f"{i} é {verificar(i)}")\n\n'
-      "pares = [n for n in range(1, 21) if ___]\n"
-      'print("Pares:", pares)'
-    ),
-    "solution": (
-      "def verificar(numero: int) -> str:\n"
-      "    if numero % 2 == 0:\n"
-      "        return 'par'\n"
-      "    return 'ímpar'\n\n"
-      "for i in range(1, 11):\n"
-      '    print(f"{i} é {verificar(i)}")\n\n'
-      "pares = [n for n in range(1, 21) if n % 2 == 0]\n"
-      "print('Pares:', pares)"
-    )
-  },
-  {
-    "id": "ex_py_03", "lang": "python", "level": "Iniciante", "emoji": "✖️", "xp": 120,
-    "title": "Tabuada Formatada",
-    "desc": (
-      "Crie tabuada(n) imprimindo a tabuada de 1 a 10:\n\n"
-      "  ====================\n"
-      "    TABUADA DO 7\n"
-      "  ====================\n"
-      "  7 x  1 =   7\n"
-      "  7 x  2 =  14\n"
-      "    ..."
-    ),
-    "hint": "Use range(1, 11) e f-strings com :2d para alinhar.",
-    "starter": (
-      "def tabuada(n: int) -> None:\n"
-      '    print(f"\\n{\'=\'*22}")\n'
-      '    print(f"  TABUADA DO {n}")\n'
-      '    print(f"{\'=\'*22}")\n'
-      "    for i in range(___, ___):\n"
-      "        resultado = ___ * ___\n"
-      '        print(f"  {n} x {i:2d} = {resultado:3d}")\n\n'
-      "tabuada(7)"
-    ),
-    "solution": (
-      "def tabuada(n: int) -> None:\n"
-      '    print(f"\\n{\'=\'*22}")\n'
-      '    print(f"  TABUADA DO {n}")\n'
-      '    print(f"{\'=\'*22}")\n'
-      "    for i in range(1, 11):\n"
-      "        resultado = n * i\n"
-      '        print(f"  {n} x {i:2d} = {resultado:3d}")\n\n'
-      "tabuada(7)"
-    )
-  },
-  {
-    "id": "ex_py_04", "lang": "python", "level": "Intermediário", "emoji": "🎯", "xp": 150,
-    "title": "FizzBuzz Clássico",
-    "desc": (
-      "Para números de 1 a 50:\n"
-      "  • Divisível por 15 → 'FizzBuzz'\n"
-      "  • Divisível por 3  → 'Fizz'\n"
-      "  • Divisível por 5  → 'Buzz'\n"
-      "  • Outro            → o número\n\n"
-      "Imprima 10 por linha."
-    ),
-    "hint": "Verifique % 15 PRIMEIRO! A ordem dos elif importa.",
-    "starter": (
-      "resultado = []\n"
-      "for n in range(1, 51):\n"
-      "    if n % ___ == 0:\n"
-      "        resultado.append('FizzBuzz')\n"
-      "    elif n % ___ == 0:\n"
-      "        resultado.append('Fizz')\n"
-      "    elif n % ___ == 0:\n"
-      "        resultado.append('Buzz')\n"
-      "    else:\n"
-      "        resultado.append(str(n))\n\n"
-      "for i in range(0, 50, 10):\n"
-      "    print(' '.join(resultado[i:i+10]))"
-    ),
-    "solution": (
-      "resultado = []\n"
-      "for n in range(1, 51):\n"
-      "    if n % 15 == 0:\n"
-      "        resultado.append('FizzBuzz')\n"
-      "    elif n % 3 == 0:\n"
-      "        resultado.append('Fizz')\n"
-      "    elif n % 5 == 0:\n"
-      "        resultado.append('Buzz')\n"
-      "    else:\n"
-      "        resultado.append(str(n))\n\n"
-      "for i in range(0, 50, 10):\n"
-      "    print(' '.join(resultado[i:i+10]))"
-    )
-  },
-  {
-    "id": "ex_py_05", "lang": "python", "level": "Intermediário", "emoji": "📊", "xp": 180,
-    "title": "Analisador de Lista",
-    "desc": (
-      "Crie analisar(nums) retornando um dicionário com:\n"
-      "  soma, media, maior, menor, qtd_pares, qtd_impares"
-    ),
-    "hint": "Use sum(), max(), min(), len() nativos do Python.",
-    "starter": (
-      "def analisar(nums: list) -> dict:\n"
-      "    return {\n"
-      "        'soma':        ___,\n"
-      "        'media':       round(___ / len(nums), 2),\n"
-      "        'maior':       ___,\n"
-      "        'menor':       ___,\n"
-      "        'qtd_pares':   len([n for n in nums if ___ == 0]),\n"
-      "        'qtd_impares': len([n for n in nums if ___ != 0]),\n"
-      "    }\n\n"
-      "numeros = [3, 7, 2, 9, 4, 1, 8, 5, 6, 10]\n"
-      "stats = analisar(numeros)\n"
-      "for k, v in stats.items():\n"
-      "    print(f'{k:14}: {v}')"
-    ),
-    "solution": (
-      "def analisar(nums: list) -> dict:\n"
-      "    return {\n"
-      "        'soma':        sum(nums),\n"
-      "        'media':       round(sum(nums) / len(nums), 2),\n"
-      "        'maior':       max(nums),\n"
-      "        'menor':       min(nums),\n"
-      "        'qtd_pares':   len([n for n in nums if n % 2 == 0]),\n"
-      "        'qtd_impares': len([n for n in nums if n % 2 != 0]),\n"
-      "    }\n\n"
-      "numeros = [3, 7, 2, 9, 4, 1, 8, 5, 6, 10]\n"
-      "stats = analisar(numeros)\n"
-      "for k, v in stats.items():\n"
-      "    print(f'{k:14}: {v}')"
-    )
-  },
-  {
-    "id": "ex_js_01", "lang": "javascript", "level": "Iniciante", "emoji": "🌡️", "xp": 120,
-    "title": "Conversor de Temperatura",
-    "desc": (
-      "Crie 3 arrow functions:\n"
-      "  celsiusParaF(c)   → (c × 9/5) + 32\n"
-      "  fahrenheitParaC(f) → (f-32) × 5/9\n"
-      "  celsiusParaK(c)   → c + 273.15\n\n"
-      "Retorne sempre com 2 casas decimais."
-    ),
-    "hint": "Use arrow functions e .toFixed(2) para 2 casas decimais.",
-    "starter": (
-      "const celsiusParaF    = (c) => ___;\n"
-      "const fahrenheitParaC = (f) => ___;\n"
-      "const celsiusParaK    = (c) => ___;\n\n"
-      "console.log('100°C =', celsiusParaF(100), '°F');\n"
-      "console.log('212°F =', fahrenheitParaC(212), '°C');\n"
-      "console.log('  0°C =', celsiusParaK(0), 'K');"
-    ),
-    "solution": (
-      "const celsiusParaF    = (c) => ((c * 9/5) + 32).toFixed(2);\n"
-      "const fahrenheitParaC = (f) => ((f - 32) * 5/9).toFixed(2);\n"
-      "const celsiusParaK    = (c) => (c + 273.15).toFixed(2);\n\n"
-      "console.log('100°C =', celsiusParaF(100), '°F');\n"
-      "console.log('212°F =', fahrenheitParaC(212), '°C');\n"
-      "console.log('  0°C =', celsiusParaK(0), 'K');"
-    )
-  },
-  {
-    "id": "ex_js_02", "lang": "javascript", "level": "Intermediário", "emoji": "🛒", "xp": 160,
-    "title": "Pipeline de Produtos",
-    "desc": (
-      "Use filter/map/sort/reduce para:\n"
-      "  1. Filtrar apenas produtos em estoque\n"
-      "  2. Aplicar 15% de desconto em produtos > R$100\n"
-      "  3. Ordenar por preço final crescente\n"
-      "  4. Calcular o total"
-    ),
-    "hint": "Encadeie: .filter().map().sort() depois .reduce()",
-    "starter": (
-      "const produtos = [\n"
-      "  {nome:'Notebook',preco:2500,estoque:3},\n"
-      "  {nome:'Caneta',preco:5,estoque:0},\n"
-      "  {nome:'Mouse',preco:80,estoque:10},\n"
-      "  {nome:'Monitor',preco:1200,estoque:2},\n"
-      "];\n\n"
-      "const pipeline = produtos\n"
-      "  ._____(p => p.estoque > 0)\n"
-      "  ._____(p => ({...p, final: p.preco > 100 ? p.preco * 0.85 : p.preco}))\n"
-      "  ._____((a, b) => a.final - b.final);\n\n"
-      "const total = pipeline.reduce((acc, p) => ___ + p.final, 0);\n"
-      "pipeline.forEach(p => console.log(`${p.nome}: R$${p.final.toFixed(2)}`));\n"
-      "console.log('Total: R$' + total.toFixed(2));"
-    ),
-    "solution": (
-      "const produtos = [\n"
-      "  {nome:'Notebook',preco:2500,estoque:3},\n"
-      "  {nome:'Caneta',preco:5,estoque:0},\n"
-      "  {nome:'Mouse',preco:80,estoque:10},\n"
-      "  {nome:'Monitor',preco:1200,estoque:2},\n"
-      "];\n\n"
-      "const pipeline = produtos\n"
-      "  .filter(p => p.estoque > 0)\n"
-      "  .map(p => ({...p, final: p.preco > 100 ? p.preco * 0.85 : p.preco}))\n"
-      "  .sort((a, b) => a.final - b.final);\n\n"
-      "const total = pipeline.reduce((acc, p) => acc + p.final, 0);\n"
-      "pipeline.forEach(p => console.log(`${p.nome}: R$${p.final.toFixed(2)}`));\n"
-      "console.log('Total: R$' + total.toFixed(2));"
-    )
-  },
-  {
-    "id": "ex_java_01", "lang": "java", "level": "Intermediário", "emoji": "🌀", "xp": 180,
-    "title": "Fibonacci",
-    "desc": (
-      "Implemente dois métodos:\n"
-      "  fibonacci(n)     → recursivo\n"
-      "  fibonacciLoop(n) → iterativo (mais eficiente!)\n\n"
-      "Imprima os 12 primeiros termos de cada.\n"
-      "F(0)=0, F(1)=1, F(n)=F(n-1)+F(n-2)"
-    ),
-    "hint": "Iterativo: 2 variáveis que vão trocando de valor (temp = a+b; a=b; b=temp).",
-    "starter": (
-      "public class Fibonacci {\n\n"
-      "    static long fibonacci(int n) {\n"
-      "        if (n <= 1) return ___;\n"
-      "        return ___(n-1) + ___(n-2);\n"
-      "    }\n\n"
-      "    static long fibonacciLoop(int n) {\n"
-      "        if (n <= 1) return n;\n"
-      "        long a = 0, b = 1;\n"
-      "        for (int i = 2; i <= n; i++) {\n"
-      "            long temp = a + b;\n"
-      "            a = ___;\n"
-      "            b = ___;\n"
-      "        }\n"
-      "        return b;\n"
-      "    }\n\n"
-      "    public static void main(String[] args) {\n"
-      '        System.out.print("Recursivo: ");\n'
-      "        for (int i = 0; i < 12; i++)\n"
-      "            System.out.print(fibonacci(i) + \" \");\n"
-      "    }\n"
-      "}"
-    ),
-    "solution": (
-      "public class Fibonacci {\n"
-      "    static long fibonacci(int n) {\n"
-      "        if (n <= 1) return n;\n"
-      "        return fibonacci(n-1) + fibonacci(n-2);\n"
-      "    }\n"
-      "    static long fibonacciLoop(int n) {\n"
-      "        if (n <= 1) return n;\n"
-      "        long a = 0, b = 1;\n"
-      "        for (int i = 2; i <= n; i++) {\n"
-      "            long temp = a + b; a = b; b = temp;\n"
-      "        }\n"
-      "        return b;\n"
-      "    }\n"
-      "    public static void main(String[] args) {\n"
-      '        System.out.print("Recursivo: ");\n'
-      "        for (int i=0;i<12;i++) System.out.print(fibonacci(i)+\" \");\n"
-      '        System.out.print("\\nIterativo: ");\n'
-      "        for (int i=0;i<12;i++) System.out.print(fibonacciLoop(i)+\" \");\n"
-      "    }\n"
-      "}"
-    )
-  },
-]
-
-# FIX #3: Correct lang prefix for langDone — use full prefix
-QUIZZES = [
-  {"id":"q01","lang":"python","level":"Iniciante",
-   "q":"O que imprime: print(10 // 3)?",
-   "opts":["3.33","3","4","1"],"ans":1,
-   "exp":"// é divisão inteira (floor division). 10 // 3 = 3 (trunca o decimal)."},
-
-  {"id":"q02","lang":"python","level":"Iniciante",
-   "q":"Qual função verifica o tipo de uma variável em Python?",
-   "opts":["typeof()","typeOf()","type()","getType()"],"ans":2,
-   "exp":"type(variavel) retorna o tipo. Ex: type(42) → <class 'int'>."},
-
-  {"id":"q03","lang":"python","level":"Iniciante",
-   "q":"O que faz o operador ** em Python?",
-   "opts":["Multiplicação","Divisão","Potência","Bitwise AND"],"ans":2,
-   "exp":"** é potência. 2**8 = 256, 3**3 = 27."},
-
-  {"id":"q04","lang":"python","level":"Intermediário",
-   "q":"O que imprime: print([x**2 for x in range(4)])?",
-   "opts":["[0,1,4,9]","[1,4,9,16]","[0,1,2,3]","[1,2,3,4]"],"ans":0,
-   "exp":"range(4) gera [0,1,2,3]. Elevando ao quadrado: [0,1,4,9]."},
-
-  {"id":"q05","lang":"python","level":"Intermediário",
-   "q":"Qual método de dict retorna None se a chave não existir?",
-   "opts":["d['chave']","d.find()","d.get()","d.fetch()"],"ans":2,
-   "exp":"d.get('chave') retorna None. d['chave'] lança KeyError!"},
-
-  {"id":"q06","lang":"python","level":"Avançado",
-   "q":"O que são *args em Python?",
-   "opts":["Apenas 1 argumento","Argumentos nomeados","Qualquer qtd de args como tupla","Argumento obrigatório"],"ans":2,
-   "exp":"*args captura qualquer número de argumentos posicionais como tupla."},
-
-  {"id":"q07","lang":"javascript","level":"Iniciante",
-   "q":"Diferença entre let e const?",
-   "opts":["let é mais rápido","const não pode ser reatribuído","let tem escopo global","Não há diferença"],"ans":1,
-   "exp":"const cria referência imutável. let pode ser reatribuído."},
-
-  {"id":"q08","lang":"javascript","level":"Iniciante",
-   "q":"O que retorna typeof null?",
-   "opts":["'null'","'undefined'","'object'","'boolean'"],"ans":2,
-   "exp":"Bug histórico do JS! typeof null retorna 'object'. Use === null para checar nulo."},
-
-  {"id":"q09","lang":"javascript","level":"Intermediário",
-   "q":"O que faz Array.filter()?",
-   "opts":["Transforma cada elemento","Filtra e retorna novo array","Ordena o array","Encontra 1 elemento"],"ans":1,
-   "exp":"filter(fn) retorna novo array com elementos onde fn retorna true."},
-
-  {"id":"q10","lang":"javascript","level":"Intermediário",
-   "q":"Arrow function correta para dobrar um número:",
-   "opts":["function => x*2","x -> x*2","x => x*2","(x) >> x*2"],"ans":2,
-   "exp":"Arrow function: x => x * 2. Com 2 params: (x, y) => x + y."},
-
-  {"id":"q11","lang":"java","level":"Iniciante",
-   "q":"int x = 7 / 2 em Java resulta em?",
-   "opts":["3.5","3","4","Erro de compilação"],"ans":1,
-   "exp":"Java: int/int = int (trunca). 7/2 = 3. Use (double)7/2 para obter 3.5."},
-
-  {"id":"q12","lang":"java","level":"Iniciante",
-   "q":"Qual modificador torna um membro acessível apenas dentro da própria classe?",
-   "opts":["public","protected","package-private","private"],"ans":3,
-   "exp":"private: acesso somente dentro da própria classe."},
-
-  {"id":"q13","lang":"java","level":"Intermediário",
-   "q":"O que a anotação @Override faz em Java?",
-   "opts":["Cria nova classe","Indica sobrescrita de método","Torna o método estático","Declara exceção"],"ans":1,
-   "exp":"@Override indica sobrescrita de método da superclasse. O compilador verifica se o método existe!"},
-
-  {"id":"q14","lang":"python","level":"Avançado",
-   "q":"Qual estrutura de dados Python NÃO permite duplicatas?",
-   "opts":["list","tuple","dict","set"],"ans":3,
-   "exp":"set não aceita duplicatas. {1,2,2,3} = {1,2,3}."},
-
-  {"id":"q15","lang":"javascript","level":"Avançado",
-   "q":"O que é uma Closure em JavaScript?",
-   "opts":["Um tipo de loop","Uma função que lembra seu escopo léxico","Uma forma de importar módulos","Um método de array"],"ans":1,
-   "exp":"Closure é uma função que lembra o ambiente (escopo) onde foi criada, mesmo após esse escopo ter encerrado."},
-]
-
-# ── Allowed content IDs (FIX #4: input validation) ──────────────────────────
-_VALID_LESSON_IDS    = {l["id"] for lessons in LESSONS.values() for l in lessons}
-_VALID_EXERCISE_IDS  = {e["id"] for e in EXERCISES}
-_VALID_QUIZ_IDS      = {q["id"] for q in QUIZZES}
+        if len(groups) == 1:  # already in rank order: no accumulation needed
+            term, docs, weights, _, factor = groups[0]
+            ranked = []
+            for doc, weight in zip(docs, weights):
+                if wanted(doc):
+                    ranked.append((doc, weight * factor))
+                    if len(ranked) == limit:
+                        break
+            matched = self.filtered[term].get((lang, kind), 0) if kind or lang else len(docs)
+            exact   = True
+        else:
+            scores: dict = {}
+            get = scores.get
+            for _, docs, weights, cap, factor in groups:
+                for doc, weight in zip(docs[:cap], weights[:cap]):
+                    scores[doc] = get(doc, 0.0) + weight * factor
+            if kind or lang:
+                scores = {doc: s for doc, s in scores.items() if wanted(doc)}
+            ranked  = heapq.nlargest(limit, scores.items(), key=lambda e: e[1])
+            matched = len(scores)
+            exact   = all(len(docs) <= cap for _, docs, _, cap, _ in groups)
+
+        hits = []
+        for doc, score in ranked:
+            d_kind, d_id, d_lang, level, title, snippet = self.docs[doc]
+            hits.append({"kind": d_kind, "id": d_id, "lang": d_lang, "level": level,
+                         "title": title, "snippet": snippet, "score": round(score, 3)})
+        return hits, matched, exact
+
+def warm_search():
+    """Builds the current pack's index in the background (worker start, pack swap)."""
+    threading.Thread(target=lambda: _content.search_index(), name="search-warmup", daemon=True).start()
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  PROGRESS PERSISTENCE
+#  One SQLite database (WAL) keyed by learner id. Counters are bumped in place
+#  and completed lessons/exercises are set-membership rows, so every write is
+#  O(1) and concurrent workers only contend on SQLite's own write lock.
 # ══════════════════════════════════════════════════════════════════════════════
-_progress_lock = threading.Lock()
+LEGACY_UID = "legacy"   # owner of the migrated single-user JSON file
+UID_COOKIE = "cm_uid"
+_UID_RE    = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+_PROGRESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid           TEXT PRIMARY KEY,
+    xp            INTEGER NOT NULL DEFAULT 0,
+    quizzes_taken INTEGER NOT NULL DEFAULT 0,
+    quiz_correct  INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_lessons (
+    uid TEXT NOT NULL, item TEXT NOT NULL, done_at REAL NOT NULL,
+    PRIMARY KEY (uid, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_exercises (
+    uid TEXT NOT NULL, item TEXT NOT NULL, done_at REAL NOT NULL,
+    PRIMARY KEY (uid, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS quiz_reviews (
+    uid    TEXT NOT NULL,
+    item   TEXT NOT NULL,
+    due    INTEGER NOT NULL,   -- epoch seconds
+    ivl    INTEGER NOT NULL,   -- minutes
+    ease   INTEGER NOT NULL,   -- SM-2 ease factor × 1000
+    reps   INTEGER NOT NULL,   -- correct answers in a row
+    lapses INTEGER NOT NULL,
+    PRIMARY KEY (uid, item)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS quiz_reviews_due ON quiz_reviews (uid, due);
+"""
+
+# ─── Spaced repetition (SM-2) ─────────────────────────────────────────────────
+# Every checked quiz answer reschedules that question for that learner. A quiz
+# answer is only right or wrong, so "right" is SM-2 quality 4 (ease unchanged)
+# and "wrong" a lapse. The update is a single UPSERT computed from the stored
+# row, so it needs no read-modify-write and batches like the other ops.
+# Due questions come off the (uid, due) index, oldest first: a review round
+# reads N index entries, however large the bank or the learner's history.
+SRS_EASE      = 2500
+SRS_EASE_MIN  = 1300
+SRS_LAPSE     = 200                # ease lost on a wrong answer
+SRS_RELEARN   = 10                 # minutes until a missed question is due again
+SRS_STEPS     = (1440, 6 * 1440)   # first two intervals, then interval × ease
+SRS_MAX_IVL   = 365 * 1440
+
+_SRS_NEXT_IVL = (f"CASE WHEN :ok = 0 THEN {SRS_RELEARN} WHEN reps = 0 THEN {SRS_STEPS[0]} "
+                 f"WHEN reps = 1 THEN {SRS_STEPS[1]} ELSE MIN({SRS_MAX_IVL}, ivl * ease / 1000) END")
+_SRS_UPSERT = f"""
+INSERT INTO quiz_reviews (uid, item, due, ivl, ease, reps, lapses)
+VALUES (:uid, :item, :ts + 60 * CASE WHEN :ok THEN {SRS_STEPS[0]} ELSE {SRS_RELEARN} END,
+        CASE WHEN :ok THEN {SRS_STEPS[0]} ELSE {SRS_RELEARN} END,
+        CASE WHEN :ok THEN {SRS_EASE} ELSE {SRS_EASE - SRS_LAPSE} END, :ok, 1 - :ok)
+ON CONFLICT (uid, item) DO UPDATE SET
+    ivl    = {_SRS_NEXT_IVL},
+    due    = :ts + 60 * ({_SRS_NEXT_IVL}),
+    ease   = CASE WHEN :ok THEN ease ELSE MAX({SRS_EASE_MIN}, ease - {SRS_LAPSE}) END,
+    reps   = CASE WHEN :ok THEN reps + 1 ELSE 0 END,
+    lapses = lapses + 1 - :ok
+"""
+
+_DONE_TABLES = {"lesson": "user_lessons", "exercise": "user_exercises"}
+_SYNC_PRAGMA = {"full": "FULL", "batch": "NORMAL", "off": "OFF"}
 
 def _default_progress() -> dict:
     return {
@@ -1284,36 +1872,1099 @@ def _default_progress() -> dict:
         "quizzes_taken": 0, "quiz_correct": 0
     }
 
-def load_progress() -> dict:
-    """Thread-safe progress loader with validation."""
+class _ProgressOps:
+    """Mutations as ops — ("lesson"|"exercise", uid, item, xp, ts), ("quiz", uid, correct, xp),
+    ("review", uid, item, ok, ts) or ("reset", uid) — so a backend can apply
+    them one by one or in batches."""
+
+    def complete_lesson(self, uid: str, lesson_id: str, xp: int = 50):
+        """Marks a lesson done; XP is awarded only the first time."""
+        self.write([("lesson", uid, lesson_id, xp, time.time())])
+
+    def complete_exercise(self, uid: str, exercise_id: str, xp: int = 100):
+        """Marks an exercise done; XP is awarded only the first time."""
+        self.write([("exercise", uid, exercise_id, xp, time.time())])
+
+    def record_quiz(self, uid: str, correct: int, xp_per_correct: int = 20, outcomes: list = ()):
+        """One quiz round; `outcomes` ([(quiz_id, correct)]) reschedules each question."""
+        now = time.time()
+        self.write([("quiz", uid, correct, correct * xp_per_correct)] +
+                   [("review", uid, qid, bool(ok), now) for qid, ok in outcomes])
+
+    def reset(self, uid: str):
+        self.write([("reset", uid)])
+
+class ProgressStore(_ProgressOps):
+    """Multi-user progress backend on SQLite in WAL mode.
+
+    Connections are per thread and re-opened after fork, so the store can be
+    created before gunicorn forks its workers. `durability` picks the fsync
+    policy: "full" (every commit), "batch" (WAL checkpoints) or "off".
+    """
+
+    def __init__(self, path: str, durability: str = "batch"):
+        self.path   = path
+        self._sync  = _SYNC_PRAGMA[durability]
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_PROGRESS_SCHEMA)
+        self._legacy_pending = conn.execute(
+            "SELECT 1 FROM users WHERE uid = ?", (LEGACY_UID,)).fetchone() is not None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self._sync}")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, uid: str, marker: str = None):
+        """Progress for `uid`. With `marker`, also returns that meta counter read
+        from the same snapshot (used by the write-behind buffer)."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute(
+                "SELECT xp, quizzes_taken, quiz_correct FROM users WHERE uid = ?", (uid,)).fetchone()
+            if row is None:
+                p = _default_progress()
+            else:
+                xp, taken, right = row
+
+                def done(table):
+                    return [r[0] for r in conn.execute(
+                        f"SELECT item FROM {table} WHERE uid = ? ORDER BY done_at", (uid,))]
+                p = {
+                    "lessons": done("user_lessons"), "exercises": done("user_exercises"),
+                    "xp": xp, "level": xp // 500 + 1,
+                    "quizzes_taken": taken, "quiz_correct": right
+                }
+            if marker is None:
+                return p
+            seen = conn.execute("SELECT value FROM meta WHERE key = ?", (marker,)).fetchone()
+            return p, int(seen[0]) if seen else 0
+        finally:
+            conn.commit()
+
+    def write(self, ops: list, marker: tuple = None):
+        """Applies a batch of ops in one transaction — one commit, one fsync."""
+        started = time.perf_counter()
+        try:
+            self._write(ops, marker)
+        finally:
+            _progress_write_series.observe(time.perf_counter() - started)
+
+    def _write(self, ops: list, marker: tuple):
+        with self._conn() as conn:
+            for op in ops:
+                kind, uid = op[0], op[1]
+                if kind in _DONE_TABLES:
+                    added = conn.execute(
+                        f"INSERT OR IGNORE INTO {_DONE_TABLES[kind]} (uid, item, done_at) VALUES (?, ?, ?)",
+                        (uid, op[2], op[4])).rowcount == 1
+                    if added:
+                        conn.execute(
+                            "INSERT INTO users (uid, xp) VALUES (?, ?) "
+                            "ON CONFLICT (uid) DO UPDATE SET xp = xp + excluded.xp", (uid, op[3]))
+                elif kind == "quiz":
+                    conn.execute(
+                        "INSERT INTO users (uid, xp, quizzes_taken, quiz_correct) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (uid) DO UPDATE SET xp = xp + excluded.xp, quizzes_taken = "
+                        "quizzes_taken + 1, quiz_correct = quiz_correct + excluded.quiz_correct",
+                        (uid, op[3], op[2]))
+                elif kind == "review":
+                    conn.execute(_SRS_UPSERT, {"uid": uid, "item": op[2], "ok": int(op[3]), "ts": int(op[4])})
+                elif kind == "reset":
+                    for table in ("users", "user_lessons", "user_exercises", "quiz_reviews"):
+                        conn.execute(f"DELETE FROM {table} WHERE uid = ?", (uid,))
+            if marker is not None:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", marker)
+
+    def due_reviews(self, uid: str, now: float, limit: int, keep=None) -> list:
+        """Up to `limit` question ids due at `now`, most overdue first. `keep(id)`
+        filters (e.g. by language); skipped rows cost one index step each."""
+        cur = self._conn().execute(
+            "SELECT item FROM quiz_reviews WHERE uid = ? AND due <= ? ORDER BY due", (uid, int(now)))
+        items = []
+        try:
+            while len(items) < limit:
+                rows = cur.fetchmany(limit)
+                if not rows:
+                    break
+                items += [item for item, in rows if keep is None or keep(item)]
+        finally:
+            cur.close()
+        return items[:limit]
+
+    def review_summary(self, uid: str, now: float) -> dict:
+        """{"due": questions due now, "next_due": epoch seconds of the next one, or None}"""
+        conn = self._conn()
+        due = conn.execute("SELECT COUNT(*) FROM quiz_reviews WHERE uid = ? AND due <= ?",
+                           (uid, int(now))).fetchone()[0]
+        nxt = conn.execute("SELECT MIN(due) FROM quiz_reviews WHERE uid = ? AND due > ?",
+                           (uid, int(now))).fetchone()[0]
+        return {"due": due, "next_due": nxt}
+
+    def migrate_json(self, path: str) -> bool:
+        """Imports the old single-user JSON file once, as the LEGACY_UID learner."""
+        if not os.path.exists(path):
+            return False
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # serializes workers racing to migrate
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                conn.rollback()
+                return False
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = {**_default_progress(), **json.load(f)}
+                now = time.time()
+                conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)",
+                             (LEGACY_UID, int(data["xp"]), int(data["quizzes_taken"]),
+                              int(data["quiz_correct"])))
+                for table, key in (("user_lessons", "lessons"), ("user_exercises", "exercises")):
+                    conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?, ?)",
+                                     [(LEGACY_UID, item, now + i) for i, item in enumerate(data[key])])
+            except (json.JSONDecodeError, OSError, TypeError, ValueError) as e:
+                app.logger.error(f"progress migration skipped: {e}")
+            conn.execute("INSERT INTO meta VALUES ('json_migrated', ?)", (str(time.time()),))
+            conn.commit()
+            self._legacy_pending = True
+            return True
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def claim_legacy(self, uid: str) -> bool:
+        """Moves the migrated single-user record to `uid`, unless that learner
+        already has progress of their own."""
+        if not self._legacy_pending:
+            return False
+        with self._conn() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE uid = ?", (uid,)).fetchone() is not None:
+                return False
+            claimed = conn.execute(
+                "UPDATE users SET uid = ? WHERE uid = ?", (uid, LEGACY_UID)).rowcount == 1
+            if claimed:
+                for table in ("user_lessons", "user_exercises"):
+                    conn.execute(f"UPDATE {table} SET uid = ? WHERE uid = ?", (uid, LEGACY_UID))
+        self._legacy_pending = False
+        return claimed
+
+def _apply_op(p: dict, op: tuple):
+    """In-memory mirror of ProgressStore.write for a single op."""
+    kind = op[0]
+    if kind in _DONE_TABLES:
+        done = p["lessons" if kind == "lesson" else "exercises"]
+        if op[2] not in done:
+            done.append(op[2])
+            p["xp"] += op[3]
+    elif kind == "quiz":
+        p["quizzes_taken"] += 1
+        p["quiz_correct"]  += op[2]
+        p["xp"]            += op[3]
+    elif kind == "reset":
+        p.clear()
+        p.update(_default_progress())
+    p["level"] = p["xp"] // 500 + 1
+
+_WRITE_BEHIND_LOCK_WAIT = m_lock_wait.labels("write_behind")
+_WRITE_BEHIND_LOCK_HOLD = m_lock_hold.labels("write_behind")
+
+class WriteBehindProgress(_ProgressOps):
+    """Buffers progress ops in memory and group-commits them to a ProgressStore.
+
+    Requests only append an op and return; a flusher thread commits batches
+    every `interval` seconds or once `max_pending` ops are queued. Reads merge
+    the stored row with this worker's unflushed ops. Each batch also records
+    its last op sequence number in `meta`, read in the same snapshot as the
+    row, so an op is never counted twice or missed while a flush is landing.
+    Ops are deltas (not whole records), so several workers can buffer at once.
+    """
+
+    def __init__(self, store: ProgressStore, interval: float = 0.5, max_pending: int = 256):
+        self.store       = store
+        self.interval    = interval
+        self.max_pending = max_pending
+        self._cond       = threading.Condition()
+        self._pending: dict  = {}   # uid -> [(seq, op)], not yet handed to the flusher
+        self._inflight: dict = {}   # uid -> [(seq, op)], being committed right now
+        self._count  = 0
+        self._seq    = time.time_ns()  # stays above markers left by earlier runs
+        self._pid    = None
+        self._flush_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @property
+    def _marker(self) -> str:
+        return f"write_behind:{os.getpid()}"
+
+    def _ensure_flusher(self):
+        if self._pid != os.getpid():  # threads do not survive fork
+            self._pid = os.getpid()
+            self._pending, self._inflight, self._count = {}, {}, 0
+            # A forked child may reuse the pid (so the marker) of a process
+            # that started after our parent did: re-seed above its sequence
+            self._seq = time.time_ns()
+            threading.Thread(target=self._run, name="progress-flusher", daemon=True).start()
+
+    def write(self, ops: list, marker: tuple = None):
+        t0 = time.perf_counter()
+        with self._cond:
+            t1 = time.perf_counter()
+            self._ensure_flusher()
+            for op in ops:
+                self._seq += 1
+                self._pending.setdefault(op[1], []).append((self._seq, op))
+            self._count += len(ops)
+            if self._count >= self.max_pending:
+                self._cond.notify()
+            t2 = time.perf_counter()
+        _WRITE_BEHIND_LOCK_WAIT.observe(t1 - t0)
+        _WRITE_BEHIND_LOCK_HOLD.observe(t2 - t1)
+
+    def get(self, uid: str) -> dict:
+        # Copy the unflushed ops *before* reading the store: if a flush lands in
+        # between, the marker read with the row tells us which ops it contains.
+        with self._cond:
+            ops = self._inflight.get(uid, []) + self._pending.get(uid, [])
+        p, committed = self.store.get(uid, marker=self._marker)
+        for seq, op in ops:
+            if seq > committed:
+                _apply_op(p, op)
+        return p
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._count >= self.max_pending, timeout=self.interval)
+            self.flush()
+
+    def flush(self):
+        """Group-commits everything buffered so far (also called at exit)."""
+        with self._flush_lock:
+            with self._cond:
+                if not self._count:
+                    return
+                self._inflight, self._pending, self._count = self._pending, {}, 0
+                batch = sorted(entry for entries in self._inflight.values() for entry in entries)
+            try:
+                self.store.write([op for _, op in batch], marker=(self._marker, str(batch[-1][0])))
+            except sqlite3.Error as e:
+                app.logger.error(f"progress flush failed, will retry: {e}")
+                with self._cond:
+                    for uid, entries in self._inflight.items():
+                        self._pending[uid] = entries + self._pending.get(uid, [])
+                        self._count += len(entries)
+            with self._cond:
+                self._inflight = {}
+
+    def claim_legacy(self, uid: str) -> bool:
+        return self.store.claim_legacy(uid)
+
+    # Schedules are read from the store: answers still buffered here (at most
+    # `interval` seconds old) only show up in the next review round.
+    def due_reviews(self, uid: str, now: float, limit: int, keep=None) -> list:
+        return self.store.due_reviews(uid, now, limit, keep)
+
+    def review_summary(self, uid: str, now: float) -> dict:
+        return self.store.review_summary(uid, now)
+
+_progress_store = ProgressStore(PROGRESS_DB, durability=PROGRESS_DURABILITY)
+# No state-backend lock: migrate_json's BEGIN IMMEDIATE already serializes the
+# workers sharing this database, and a Redis outage mustn't stop them booting
+_progress_store.migrate_json(PROGRESS_F)
+_progress = (WriteBehindProgress(_progress_store, PROGRESS_FLUSH_INTERVAL, PROGRESS_FLUSH_MAX)
+             if PROGRESS_WRITE_BEHIND else _progress_store)
+
+def _is_local_request() -> bool:
+    """Straight from this machine: loopback peer and nothing forwarded it (a
+    reverse proxy on the same host would otherwise make every visitor local)."""
+    return (request.remote_addr in ("127.0.0.1", "::1")
+            and "X-Forwarded-For" not in request.headers and "Forwarded" not in request.headers)
+
+def current_uid() -> str:
+    """Learner id from the cm_uid cookie; new visitors get one (set after the request)."""
+    uid = request.cookies.get(UID_COOKIE, "")
+    if _UID_RE.fullmatch(uid):
+        return uid
+    uid = g.get("new_uid")
+    if uid is None:
+        uid = g.new_uid = secrets.token_urlsafe(16)
+        if SINGLE_USER or _is_local_request():
+            _progress_store.claim_legacy(uid)
+    return uid
+
+@app.after_request
+def _set_uid_cookie(resp):
+    uid = g.get("new_uid")
+    if uid:
+        resp.set_cookie(UID_COOKIE, uid, max_age=2 * 365 * 86400, httponly=True, samesite="Lax")
+    return resp
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  PERSISTENT CACHES
+#  An in-process LRU in front of a SQLite table, both with a TTL. The disk tier
+#  survives restarts and is shared by every worker on the host.
+# ══════════════════════════════════════════════════════════════════════════════
+CACHE_DB = os.environ.get("CODEMASTER_CACHE_DB",
+                          os.path.join(os.path.expanduser("~"), ".codemaster_cache.db"))
+
+class TieredCache:
+    """Bytes cache: memory LRU (`max_memory` entries) over a SQLite table
+    (`max_disk` entries, least recently used trimmed first). Entries expire
+    after `ttl` seconds in both tiers."""
+
+    def __init__(self, name: str, path: str = CACHE_DB, max_memory: int = 512,
+                 max_disk: int = 20000, ttl: float = 7 * 86400):
+        self.name, self.path = name, path
+        self.max_memory, self.max_disk, self.ttl = max_memory, max_disk, ttl
+        self._lru: OrderedDict = OrderedDict()  # key -> (expires, value)
+        self._lock  = threading.Lock()
+        self._local = threading.local()
+        self._sets  = 0
+        self.hits_memory = self.hits_disk = self.misses = 0
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            f"expires REAL NOT NULL, used REAL NOT NULL) WITHOUT ROWID")
+        self._conn().execute(f"CREATE INDEX IF NOT EXISTS {name}_used ON {name} (used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # a lost cache entry is harmless
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _remember(self, key: str, expires: float, value: bytes):
+        with self._lock:
+            self._lru[key] = (expires, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_memory:
+                self._lru.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and entry[0] > now:
+                self._lru.move_to_end(key)
+                self.hits_memory += 1
+                return entry[1]
+        try:
+            conn = self._conn()
+            row  = conn.execute(f"SELECT value, expires FROM {self.name} WHERE key = ? AND expires > ?",
+                                (key, now)).fetchone()
+            if row is not None:
+                conn.execute(f"UPDATE {self.name} SET used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            app.logger.error(f"{self.name} cache read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits_disk += 1
+        self._remember(key, row[1], row[0])
+        return row[0]
+
+    def set(self, key: str, value: bytes):
+        now, expires = time.time(), time.time() + self.ttl
+        self._remember(key, expires, value)
+        try:
+            conn = self._conn()
+            conn.execute(f"INSERT OR REPLACE INTO {self.name} VALUES (?, ?, ?, ?)",
+                         (key, value, expires, now))
+            self._sets += 1
+            if self._sets % 256 == 0:
+                conn.execute(f"DELETE FROM {self.name} WHERE expires <= ?", (now,))
+                conn.execute(f"DELETE FROM {self.name} WHERE key IN (SELECT key FROM {self.name} "
+                             f"ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_disk,))
+        except sqlite3.Error as e:
+            app.logger.error(f"{self.name} cache write failed: {e}")
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        return {
+            "hits": hits, "hits_memory": self.hits_memory, "hits_disk": self.hits_disk,
+            "misses": self.misses, "hit_ratio": round(hits / ((hits + self.misses) or 1), 4),
+            "memory_entries": len(self._lru),
+        }
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  AI TUTOR
+# ══════════════════════════════════════════════════════════════════════════════
+AI_MODEL      = "claude-opus-4-5"
+AI_MAX_TOKENS = 1024
+AI_SYSTEM     = (
+    "Você é o CodeMaster AI, tutor especialista em Python, JavaScript e Java. "
+    "Responda sempre em português brasileiro. "
+    "Seja didático, use exemplos práticos de código quando relevante. "
+    "Use emojis com moderação. "
+    "Para código, use blocos markdown com a linguagem: ```python, ```javascript ou ```java."
+)
+AI_OFFLINE_MSG = (
+    "⚠️  A IA não está configurada.\n\n"
+    "Para ativar, defina a variável de ambiente:\n"
+    "  export ANTHROPIC_API_KEY='sk-ant-...'\n\n"
+    "Enquanto isso, explore as lições e exercícios!"
+)
+AI_INSTALL_MSG = "Instale o pacote Anthropic:\n  pip install anthropic"
+AI_ERROR_MSG   = "Erro temporário. Tente novamente."
+
+# Upstream connection pool (per worker)
+AI_POOL_SIZE       = int(os.environ.get("CODEMASTER_AI_POOL_SIZE", "10"))
+AI_TIMEOUT         = float(os.environ.get("CODEMASTER_AI_TIMEOUT", "60"))
+AI_CONNECT_TIMEOUT = float(os.environ.get("CODEMASTER_AI_CONNECT_TIMEOUT", "5"))
+AI_KEEPALIVE       = float(os.environ.get("CODEMASTER_AI_KEEPALIVE", "120"))
+
+# Answer cache: identical (model, system prompt, normalized conversation) → same answer
+AI_CACHE_ENABLED = os.environ.get("CODEMASTER_AI_CACHE", "1") != "0"
+AI_CACHE_TTL     = float(os.environ.get("CODEMASTER_AI_CACHE_TTL", str(7 * 86400)))
+AI_CACHE_MAX     = int(os.environ.get("CODEMASTER_AI_CACHE_MAX", "20000"))
+
+_ai_cache = TieredCache("ai_answers", max_disk=AI_CACHE_MAX, ttl=AI_CACHE_TTL)
+
+def _normalize_text(text: str) -> str:
+    """NFC, no trailing spaces; one-line messages also get inner whitespace collapsed
+    (multi-line ones keep it — indentation matters in code)."""
+    lines = [line.rstrip() for line in unicodedata.normalize("NFC", text).strip().splitlines()]
+    return " ".join(lines[0].split()) if len(lines) == 1 else "\n".join(lines)
+
+def ai_cache_key(clean_msgs: list, system: str = AI_SYSTEM, model: str = AI_MODEL) -> str:
+    """Hash of the model, system prompt and *whole* normalized conversation, so a
+    cached answer is only ever reused for exactly the same context."""
+    convo = [[m["role"], _normalize_text(m["content"])] for m in clean_msgs]
+    return hashlib.sha256(json.dumps([model, system, convo], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _ai_cache_get(key: str):
+    if not AI_CACHE_ENABLED:
+        return None
+    hit = _ai_cache.get(key)
+    return None if hit is None else hit.decode("utf-8")
+
+def _ai_cache_put(key: str, text: str):
+    if AI_CACHE_ENABLED and text:
+        _ai_cache.set(key, text.encode("utf-8"))
+
+_ai_client      = None
+_ai_client_pid  = None
+_ai_client_lock = threading.Lock()
+
+def get_ai_client():
+    """Process-wide Anthropic client over a keep-alive connection pool.
+
+    Built lazily and rebuilt after fork (sockets must not be shared between
+    workers), then reused by every request in the worker. Raises ImportError
+    if the SDK is missing.
+    """
+    global _ai_client, _ai_client_pid
+    if _ai_client is None or _ai_client_pid != os.getpid():
+        with _ai_client_lock:
+            if _ai_client is None or _ai_client_pid != os.getpid():
+                import anthropic
+                limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+                    max_connections           = AI_POOL_SIZE,
+                    max_keepalive_connections = AI_POOL_SIZE,
+                    keepalive_expiry          = AI_KEEPALIVE,
+                )
+                http = anthropic.DefaultHttpxClient(
+                    limits  = limits,
+                    timeout = anthropic.Timeout(AI_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+                )
+                _ai_client     = anthropic.Anthropic(api_key=API_KEY, http_client=http)
+                _ai_client_pid = os.getpid()
+    return _ai_client
+
+def warm_ai_client():
+    """Builds the client and opens a pooled TLS connection in the background,
+    so the first chat after a deploy doesn't pay for the handshake."""
+    if not API_KEY:
+        return
+
+    def warm():
+        try:
+            get_ai_client().models.list(limit=1)
+        except Exception as e:
+            app.logger.warning(f"AI warm-up failed: {e}")
+    threading.Thread(target=warm, name="ai-warmup", daemon=True).start()
+
+def _clean_messages(data: dict) -> list:
+    """Sanitize: only keep role/content, limit history."""
+    msgs = data.get("messages", [])
+    if not isinstance(msgs, list):
+        return []
+    return [
+        {"role": m["role"], "content": str(m["content"])[:4000]}
+        for m in msgs[-12:]
+        if isinstance(m, dict) and m.get("role") in ("user", "assistant")
+        and m.get("content")
+    ]
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# ─── AI gateway: bounded concurrency + admission control ──────────────────────
+# Upstream calls run on a small dedicated thread pool. At most AI_CONCURRENCY
+# run and AI_QUEUE wait; beyond that requests are shed at once with 503, and a
+# queued call that waited longer than AI_QUEUE_TIMEOUT is dropped rather than
+# started late. Slow upstreams can then only ever tie up a bounded number of
+# request threads, leaving the rest (see gunicorn.conf.py) for cheap endpoints.
+AI_CONCURRENCY   = int(os.environ.get("CODEMASTER_AI_CONCURRENCY", "2"))
+AI_QUEUE         = int(os.environ.get("CODEMASTER_AI_QUEUE", "2"))
+AI_QUEUE_TIMEOUT = float(os.environ.get("CODEMASTER_AI_QUEUE_TIMEOUT", "10"))
+AI_RETRY_AFTER   = int(os.environ.get("CODEMASTER_AI_RETRY_AFTER", "5"))
+AI_BUSY_MSG      = "A IA está ocupada agora. Tente novamente em alguns segundos."
+
+class AIGatewayBusy(Exception):
+    pass
+
+class AIGateway:
+    """Bounded executor for upstream AI calls (rebuilt after fork)."""
+
+    def __init__(self, concurrency: int, queue_size: int, queue_timeout: float, name: str = "ai-gateway"):
+        self.concurrency   = concurrency
+        self.queue_timeout = queue_timeout
+        self.name      = name
+        self._slots    = threading.BoundedSemaphore(concurrency + queue_size)
+        self._executor = None
+        self._pid      = None
+        self._lock     = threading.Lock()
+        self.rejected  = 0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix=self.name)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        """Schedules fn(*args); raises AIGatewayBusy at once if the queue is full."""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise AIGatewayBusy()
+        queued = time.monotonic()
+
+        def run():
+            try:
+                if time.monotonic() - queued > self.queue_timeout:
+                    self.rejected += 1
+                    raise AIGatewayBusy()
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            return self._pool().submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def call(self, fn, *args):
+        return self.submit(fn, *args).result(timeout=self.queue_timeout + AI_TIMEOUT)
+
+    def stats(self) -> dict:
+        return {"concurrency": self.concurrency, "rejected": self.rejected}
+
+_ai_gateway = AIGateway(AI_CONCURRENCY, AI_QUEUE, AI_QUEUE_TIMEOUT)
+
+def _ai_busy_response():
+    resp = jsonify({"error": AI_BUSY_MSG})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(AI_RETRY_AFTER)
+    return resp
+
+# ─── Singleflight: identical in-flight requests share one upstream call ───────
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+class Singleflight:
+    """Coalesces concurrent calls with the same key onto one execution.
+
+    The first caller (leader) runs the function; callers arriving while it is
+    in flight wait and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock  = threading.Lock()
+        self.leaders = self.coalesced = self.coalesced_remote = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "coalesced": self.coalesced,
+                "coalesced_remote": self.coalesced_remote}
+
+_ai_flight = Singleflight()
+
+def _ai_fetch_coalesced(key: str, clean_msgs: list, system: str = AI_SYSTEM) -> str:
+    """Leader path: one upstream call per key, across workers too.
+
+    Workers take a per-key lock from the shared state backend (a lock file with
+    STATE_BACKEND=file) and re-check the answer cache once they hold it — if
+    another worker finished the same request meanwhile, its answer is reused.
+    """
+    def fetch():
+        text = _ai_gateway.call(_ai_complete, clean_msgs, system)
+        _ai_cache_put(key, text)
+        return text
+    if not AI_CACHE_ENABLED:  # nothing to hand results over between workers
+        return fetch()
+    with _state.lock(f"ai-flight:{key}", timeout=AI_QUEUE_TIMEOUT + AI_TIMEOUT):
+        cached = _ai_cache_get(key)
+        if cached is not None:
+            _ai_flight.coalesced_remote += 1
+            return cached
+        return fetch()
+
+@contextmanager
+def _ai_timed(kind: str):
+    """Records upstream latency and failures for one AI call."""
+    started = time.perf_counter()
     try:
-        with _progress_lock:
-            if not os.path.exists(PROGRESS_F):
-                return _default_progress()
-            with open(PROGRESS_F, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            # Validate & patch missing keys
-            defaults = _default_progress()
-            for k, v in defaults.items():
-                if k not in data:
-                    data[k] = v
-            return data
-    except (json.JSONDecodeError, OSError):
-        return _default_progress()
-
-def save_progress(data: dict) -> bool:
-    """Thread-safe progress saver. Returns True on success."""
+        yield
+    except Exception:
+        m_ai_errors.labels(kind).inc()
+        raise
+    finally:
+        m_ai_latency.labels(kind).observe(time.perf_counter() - started)
+
+def _ai_complete(clean_msgs: list, system: str = AI_SYSTEM) -> str:
+    """One upstream completion (runs on the gateway)."""
+    with _ai_timed("complete"):
+        resp = get_ai_client().messages.create(
+            model      = AI_MODEL,
+            max_tokens = AI_MAX_TOKENS,
+            system     = system,
+            messages   = clean_msgs
+        )
+    return resp.content[0].text
+
+def _ai_stream_upstream(clean_msgs: list, system: str, out: queue.Queue, cancelled: threading.Event):
+    """Gateway task: pumps the upstream stream into `out`, always ending with None."""
     try:
-        with _progress_lock:
-            # Write to temp file first, then rename (atomic)
-            tmp = PROGRESS_F + ".tmp"
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            os.replace(tmp, PROGRESS_F)
-        return True
-    except OSError as e:
-        app.logger.error(f"save_progress failed: {e}")
-        return False
+        with _ai_timed("stream"), get_ai_client().messages.stream(
+            model      = AI_MODEL,
+            max_tokens = AI_MAX_TOKENS,
+            system     = system,
+            messages   = clean_msgs
+        ) as stream:
+            for text in stream.text_stream:
+                if cancelled.is_set():  # client went away — stop paying for tokens
+                    break
+                out.put(("delta", text))
+            else:
+                out.put(("final", stream.get_final_message()))
+    except Exception as e:
+        out.put(("error", e))
+    finally:
+        out.put(None)
+
+def _sse_reply(text: str, **summary):
+    yield _sse("delta", {"text": text})
+    yield _sse("done", {"response": text, **summary})
+
+def _ai_stream_events(key: str, out: queue.Queue, cancelled: threading.Event, started: float,
+                      on_done=None, **extra):
+    """Yields SSE frames: `delta` per text chunk, `error` on failure, then `done`.
+    `on_done(text)` runs once the full answer has arrived."""
+    parts, summary = [], {"offline": False, **extra}
+    try:
+        while (item := out.get()) is not None:
+            kind, value = item
+            if kind == "delta":
+                if not parts:
+                    summary["ttft_ms"] = round((time.perf_counter() - started) * 1000)
+                parts.append(value)
+                yield _sse("delta", {"text": value})
+            elif kind == "final":
+                summary["stop_reason"] = value.stop_reason
+                summary["usage"] = {"input_tokens":  value.usage.input_tokens,
+                                    "output_tokens": value.usage.output_tokens}
+                _ai_cache_put(key, "".join(parts))
+                if on_done is not None:
+                    on_done("".join(parts))
+            elif isinstance(value, AIGatewayBusy):
+                summary["error"] = True
+                yield _sse("error", {"error": AI_BUSY_MSG, "retry_after": AI_RETRY_AFTER})
+            elif isinstance(value, ImportError):
+                summary["offline"] = True
+                yield _sse("error", {"error": AI_INSTALL_MSG})
+            else:
+                app.logger.error(f"AI stream error: {value}")
+                summary["error"] = True
+                yield _sse("error", {"error": AI_ERROR_MSG})
+        summary["response"] = "".join(parts)
+        summary["ms"] = round((time.perf_counter() - started) * 1000)
+        yield _sse("done", summary)
+    finally:
+        cancelled.set()
+
+def _ai_stream_response(clean_msgs: list, system: str = AI_SYSTEM, session=None) -> Response:
+    """SSE response for a chat turn. Raises AIGatewayBusy before any byte is sent."""
+    started = time.perf_counter()
+    extra   = {"session_id": session.sid} if session is not None else {}
+    on_done = None
+    if session is not None:
+        question = clean_msgs[-1]["content"]
+        on_done  = lambda text: _chat_record(session.uid, session.sid, question, text)
+    if not API_KEY:
+        events = _sse_reply(AI_OFFLINE_MSG, offline=True, **extra)
+    else:
+        key    = ai_cache_key(clean_msgs, system)
+        cached = _ai_cache_get(key)
+        if cached is not None:
+            if on_done is not None:
+                on_done(cached)
+            events = _sse_reply(cached, offline=False, cached=True,
+                                ms=round((time.perf_counter() - started) * 1000), **extra)
+        else:
+            out, cancelled = queue.Queue(), threading.Event()
+            fut = _ai_gateway.submit(_ai_stream_upstream, clean_msgs, system, out, cancelled)
+
+            def shed(f):  # dropped from the queue before running: unblock the reader
+                if not f.cancelled() and isinstance(f.exception(), AIGatewayBusy):
+                    out.put(("error", f.exception()))
+                    out.put(None)
+            fut.add_done_callback(shed)
+            events = _ai_stream_events(key, out, cancelled, started, on_done, **extra)
+    resp = Response(events, mimetype="text/event-stream")
+    resp.headers["Cache-Control"]     = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return resp
+
+# ─── Chat sessions: server-held history, compacted past a token budget ────────
+# Clients post only {"session_id", "message"}; the conversation lives in the
+# shared state backend as zlib'd JSON with an idle TTL and a size cap. Once it
+# passes CHAT_TOKEN_BUDGET (estimated at ~4 chars per token), all but the last
+# CHAT_KEEP_PAIRS exchanges are folded into a running summary that rides along
+# in the system prompt — so it is also part of the answer-cache key. Summaries
+# run on their own small gateway so they never take an interactive slot; when
+# it is full the fold is done extractively instead.
+CHAT_SESSION_TTL    = float(os.environ.get("CODEMASTER_CHAT_TTL", str(6 * 3600)))
+CHAT_TOKEN_BUDGET   = int(os.environ.get("CODEMASTER_CHAT_TOKEN_BUDGET", "3000"))
+CHAT_KEEP_PAIRS     = int(os.environ.get("CODEMASTER_CHAT_KEEP_PAIRS", "3"))
+CHAT_MAX_BYTES      = int(os.environ.get("CODEMASTER_CHAT_MAX_BYTES", "65536"))  # compressed
+CHAT_SUMMARY_CHARS  = 2000
+CHAT_SUMMARY_CONCURRENCY = int(os.environ.get("CODEMASTER_CHAT_SUMMARY_CONCURRENCY", "1"))
+CHAT_SUMMARY_QUEUE       = int(os.environ.get("CODEMASTER_CHAT_SUMMARY_QUEUE", "4"))
+CHAT_SUMMARY_TOKENS = 400
+CHAT_SUMMARY_PROMPT = (
+    "Resuma a conversa abaixo entre um aluno e o tutor CodeMaster em no máximo "
+    "8 tópicos curtos, em português. Preserve o que o aluno já entendeu, dúvidas "
+    "em aberto, nomes de funções/variáveis e trechos de código importantes."
+)
+
+_chat_summary_gateway = AIGateway(CHAT_SUMMARY_CONCURRENCY, CHAT_SUMMARY_QUEUE,
+                                  AI_QUEUE_TIMEOUT, name="ai-summary")
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+class ChatSession:
+    """One tutor conversation: a running summary plus the recent turns,
+    stored as [role, content] pairs (always whole user/assistant exchanges)."""
+
+    __slots__ = ("uid", "sid", "summary", "turns")
+
+    def __init__(self, uid: str, sid: str = None, summary: str = "", turns: list = None):
+        self.uid     = uid
+        self.sid     = sid or secrets.token_urlsafe(16)
+        self.summary = summary
+        self.turns   = turns or []
+
+    @property
+    def key(self) -> str:
+        return f"chat:{self.uid}:{self.sid}"
+
+    @classmethod
+    def load(cls, uid: str, sid: str):
+        """The stored session, or None if the id is unknown, expired or malformed."""
+        if not sid or not _UID_RE.fullmatch(sid):
+            return None
+        raw = _state.get(f"chat:{uid}:{sid}")
+        if raw is None:
+            return None
+        try:
+            summary, turns = json.loads(zlib.decompress(raw))
+        except (zlib.error, ValueError):
+            return None
+        return cls(uid, sid, summary, turns)
+
+    def _pack(self) -> bytes:
+        return zlib.compress(json.dumps([self.summary, self.turns], ensure_ascii=False,
+                                        separators=(",", ":")).encode("utf-8"))
+
+    def save(self):
+        """Writes the session back, refreshing its idle TTL. Over CHAT_MAX_BYTES
+        the oldest exchanges are dropped (compaction normally keeps it far below)."""
+        raw = self._pack()
+        while len(raw) > CHAT_MAX_BYTES and len(self.turns) > 2:
+            del self.turns[:2]
+            raw = self._pack()
+        _state.set(self.key, raw, ttl=CHAT_SESSION_TTL)
+
+    def messages(self) -> list:
+        return [{"role": role, "content": content} for role, content in self.turns]
+
+    def system_prompt(self) -> str:
+        if not self.summary:
+            return AI_SYSTEM
+        return f"{AI_SYSTEM}\n\nResumo da conversa até aqui:\n{self.summary}"
+
+    def tokens(self) -> int:
+        return _estimate_tokens(self.summary) + sum(_estimate_tokens(c) for _, c in self.turns)
+
+def _ai_summarize(summary: str, turns: list) -> str:
+    """Upstream summary of `turns`, folding in the previous summary (runs on the gateway)."""
+    transcript = "\n\n".join(f"{'Aluno' if role == 'user' else 'Tutor'}: {content}"
+                              for role, content in turns)
+    if summary:
+        transcript = f"Resumo anterior:\n{summary}\n\n{transcript}"
+    with _ai_timed("summary"):
+        resp = get_ai_client().messages.create(
+            model      = AI_MODEL,
+            max_tokens = CHAT_SUMMARY_TOKENS,
+            system     = CHAT_SUMMARY_PROMPT,
+            messages   = [{"role": "user", "content": transcript}]
+        )
+    return resp.content[0].text.strip()[:CHAT_SUMMARY_CHARS]
+
+def _extractive_summary(summary: str, turns: list) -> str:
+    """Fallback when the model is unavailable: the first line of each old turn."""
+    lines = [summary] if summary else []
+    for role, content in turns:
+        first = content.strip().splitlines()[0] if content.strip() else ""
+        lines.append(f"- {'Aluno' if role == 'user' else 'Tutor'}: {first[:160]}")
+    text = "\n".join(lines)
+    if len(text) > CHAT_SUMMARY_CHARS:  # keep the most recent lines
+        text = text[-CHAT_SUMMARY_CHARS:].split("\n", 1)[-1]
+    return text
+
+def _chat_compact(uid: str, sid: str, use_ai: bool):
+    """Folds all but the last CHAT_KEEP_PAIRS exchanges into the summary.
+
+    The summary is built without holding the session lock; it is only applied
+    if nobody else compacted the session in the meantime.
+    """
+    sess = ChatSession.load(uid, sid)
+    keep = 2 * CHAT_KEEP_PAIRS
+    if sess is None or len(sess.turns) <= keep:
+        return
+    old, summary = sess.turns[:-keep], None
+    if use_ai and API_KEY:
+        try:
+            summary = _ai_summarize(sess.summary, old)
+        except Exception as e:
+            app.logger.warning(f"Chat summary failed, using extractive fallback: {e}")
+    summary = summary or _extractive_summary(sess.summary, old)
+    with _state.lock(sess.key):
+        current = ChatSession.load(uid, sid)
+        if current is None or current.summary != sess.summary or current.turns[:len(old)] != old:
+            return
+        current.summary, current.turns = summary, current.turns[len(old):]
+        current.save()
+
+def _chat_record(uid: str, sid: str, question: str, answer: str):
+    """Appends a finished exchange; over budget, compaction is scheduled on the
+    summary gateway (or done extractively right here if it is full)."""
+    try:
+        with _state.lock(f"chat:{uid}:{sid}"):
+            sess = ChatSession.load(uid, sid) or ChatSession(uid, sid)
+            sess.turns += [["user", question], ["assistant", answer]]
+            sess.save()
+        if sess.tokens() > CHAT_TOKEN_BUDGET and len(sess.turns) > 2 * CHAT_KEEP_PAIRS:
+            try:
+                _chat_summary_gateway.submit(_chat_compact, uid, sid, True)
+            except AIGatewayBusy:
+                _chat_compact(uid, sid, False)
+    except (TimeoutError, StateBackendError) as e:
+        app.logger.warning(f"Chat session {sid} not saved: {e}")
+
+def _chat_request(data: dict):
+    """(messages, system prompt, session) for a chat call.
+
+    Session mode — {"message": "...", "session_id": "..."} — rebuilds the context
+    from the server-held history; a missing or expired id starts a new session.
+    The stateless {"messages": [...]} form is still accepted.
+    """
+    if "message" not in data:
+        return _clean_messages(data), AI_SYSTEM, None
+    uid  = current_uid()
+    sess = ChatSession.load(uid, str(data.get("session_id") or "")) or ChatSession(uid)
+    text = str(data.get("message") or "").strip()[:4000]
+    msgs = sess.messages() + [{"role": "user", "content": text}] if text else []
+    return msgs, sess.system_prompt(), sess
+
+@app.route("/api/ai/chat", methods=["POST"])
+@rate_limit(max_calls=15, window_seconds=60)
+def ai_chat():
+    clean_msgs, system, session = _chat_request(request.get_json(silent=True) or {})
+    wants_sse = request.accept_mimetypes.best == "text/event-stream"
+    extra     = {"session_id": session.sid} if session is not None else {}
+
+    if not API_KEY and not wants_sse:
+        return jsonify({"response": AI_OFFLINE_MSG, "offline": True, **extra})
+    if not clean_msgs:
+        return jsonify({"error": "Mensagem vazia"}), 400
+    try:
+        if wants_sse:
+            return _ai_stream_response(clean_msgs, system, session)
+
+        key    = ai_cache_key(clean_msgs, system)
+        cached = _ai_cache_get(key)
+        if cached is not None:
+            text = cached
+        else:
+            text = _ai_flight.do(key, lambda: _ai_fetch_coalesced(key, clean_msgs, system))
+        if session is not None:
+            _chat_record(session.uid, session.sid, clean_msgs[-1]["content"], text)
+        if cached is not None:
+            return jsonify({"response": text, "offline": False, "cached": True, **extra})
+        return jsonify({"response": text, "offline": False, **extra})
+
+    except AIGatewayBusy:
+        return _ai_busy_response()
+    except ImportError:
+        return jsonify({"response": AI_INSTALL_MSG, "offline": True})
+    except Exception as e:
+        app.logger.error(f"AI error: {e}")
+        return jsonify({"response": AI_ERROR_MSG, "offline": True})
+
+@app.route("/api/ai/chat/stream", methods=["POST"])
+@rate_limit(max_calls=15, window_seconds=60, scope="ai_chat")
+def ai_chat_stream():
+    clean_msgs, system, session = _chat_request(request.get_json(silent=True) or {})
+    if not clean_msgs:
+        return jsonify({"error": "Mensagem vazia"}), 400
+    try:
+        return _ai_stream_response(clean_msgs, system, session)
+    except AIGatewayBusy:
+        return _ai_busy_response()
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  EXERCISE GRADING
+#  Python exercises with an `expected` output are graded by running the
+#  submission in sandbox.py's pool of pre-forked, rlimited workers; their XP
+#  is only awarded on a verified pass.
+# ══════════════════════════════════════════════════════════════════════════════
+SANDBOX_POOL          = int(os.environ.get("CODEMASTER_SANDBOX_POOL", "2"))
+SANDBOX_CPU           = int(os.environ.get("CODEMASTER_SANDBOX_CPU", "2"))
+SANDBOX_MEMORY_MB     = int(os.environ.get("CODEMASTER_SANDBOX_MEMORY_MB", "256"))
+SANDBOX_WALL          = float(os.environ.get("CODEMASTER_SANDBOX_WALL", "5"))
+SANDBOX_QUEUE_TIMEOUT = float(os.environ.get("CODEMASTER_SANDBOX_QUEUE_TIMEOUT", "10"))
+# Isolation (see sandbox.py): as root the zygotes switch to SANDBOX_USER; any
+# other worker needs a wrapper (e.g. "bwrap --unshare-all --die-with-parent
+# --ro-bind / / --proc /proc --dev /dev") or an explicit same-user opt-in
+SANDBOX_USER          = os.environ.get("CODEMASTER_SANDBOX_USER", "nobody")
+SANDBOX_WRAPPER       = shlex.split(os.environ.get("CODEMASTER_SANDBOX_WRAPPER", ""))
+SANDBOX_SAME_USER     = os.environ.get("CODEMASTER_SANDBOX_ALLOW_SAME_USER", "0") == "1"
+SANDBOX_MAX_SOURCE    = 20000
+SANDBOX_BUSY_MSG      = "Muitas execuções no momento. Tente novamente em alguns segundos."
+SANDBOX_OFF_MSG       = "A execução de código não está disponível neste servidor."
+
+_sandbox      = None
+_sandbox_lock = threading.Lock()
+
+def get_sandbox():
+    """Process-wide sandbox pool, built lazily. Raises SandboxUnavailable off POSIX
+    (and, from run(), when the host can't isolate the zygotes)."""
+    global _sandbox
+    if _sandbox is None:
+        with _sandbox_lock:
+            if _sandbox is None:
+                from sandbox import SandboxPool
+                pool = SandboxPool(SANDBOX_POOL, SANDBOX_CPU, SANDBOX_MEMORY_MB,
+                                   SANDBOX_WALL, queue_timeout=SANDBOX_QUEUE_TIMEOUT,
+                                   user=SANDBOX_USER, wrapper=SANDBOX_WRAPPER,
+                                   allow_same_user=SANDBOX_SAME_USER)
+                atexit.register(pool.close)
+                _sandbox = pool
+    return _sandbox
+
+def warm_sandbox():
+    """Forks the zygotes before the first submission arrives."""
+    try:
+        get_sandbox().start()
+    except Exception as e:
+        app.logger.warning(f"Sandbox warm-up failed: {e}")
+
+def _normalize_output(text: str) -> str:
+    """Trailing whitespace and line endings don't count when comparing output."""
+    return "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).rstrip()
+
+# ─── Grading cache ────────────────────────────────────────────────────────────
+# Resubmissions of the same code (filled-in starters, the copied solution) are
+# answered from a TieredCache keyed by exercise, grading data version and the
+# normalized source. Only completed runs are cached — timeouts and crashes can
+# depend on load, so those always run again.
+GRADING_CACHE_ENABLED = os.environ.get("CODEMASTER_GRADING_CACHE", "1") != "0"
+GRADING_CACHE_TTL     = float(os.environ.get("CODEMASTER_GRADING_CACHE_TTL", str(30 * 86400)))
+GRADING_CACHE_MAX     = int(os.environ.get("CODEMASTER_GRADING_CACHE_MAX", "50000"))
+
+_grading_cache = TieredCache("grading", max_disk=GRADING_CACHE_MAX, ttl=GRADING_CACHE_TTL)
+
+def _normalize_source(source: str) -> str:
+    """NFC, LF line endings, no trailing whitespace — line numbers stay intact,
+    so cached error messages still point at the right line."""
+    lines = unicodedata.normalize("NFC", source).replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).rstrip("\n")
+
+def grading_cache_key(exercise_id: str, grading: dict, source: str) -> str:
+    """Changes whenever the exercise's expected output/stdin does (not on unrelated
+    content edits) or the code differs in more than trailing whitespace."""
+    version = hashlib.sha256(_serialize(grading)).hexdigest()
+    code    = hashlib.sha256(_normalize_source(source).encode("utf-8")).hexdigest()
+    return f"{exercise_id}:{version[:16]}:{code}"
+
+def grade_submission(exercise_id: str, grading: dict, source: str) -> dict:
+    """Runs `source` against an exercise's grading data (or returns the cached
+    verdict); raises SandboxBusy/SandboxUnavailable."""
+    key = grading_cache_key(exercise_id, grading, source)
+    if GRADING_CACHE_ENABLED:
+        hit = _grading_cache.get(key)
+        if hit is not None:
+            return {**json.loads(hit), "cached": True}
+    result = get_sandbox().run(_normalize_source(source), grading["stdin"])
+    result["passed"] = (result["status"] == "ok" and
+                        _normalize_output(result["stdout"]) == _normalize_output(grading["expected"]))
+    if GRADING_CACHE_ENABLED and result["status"] in ("ok", "error"):
+        _grading_cache.set(key, _serialize(result))
+    return result
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  ROUTES
@@ -1321,46 +2972,145 @@ def save_progress(data: dict) -> bool:
 
 @app.route("/")
 def index():
-    return send_from_directory(BASE_DIR, "index.html")
+    return cached_response(render_index(), mimetype="text/html")
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(collect_metrics()), mimetype="text/plain; version=0.0.4")
 
 @app.route("/api/health")
 def health():
-    return jsonify({"status": "ok", "ai": bool(API_KEY)})
+    return jsonify({"status": "ok", "ai": bool(API_KEY),
+                    "ai_cache": _ai_cache.stats(), "ai_gateway": _ai_gateway.stats(),
+                    "ai_summary_gateway": _chat_summary_gateway.stats(),
+                    "ai_singleflight": _ai_flight.stats(), "grading_cache": _grading_cache.stats(),
+                    "sandbox": _sandbox.stats() if _sandbox is not None else None})
+
+@app.route("/api/bootstrap")
+def bootstrap():
+    content = _content
+    lang = request.args.get("lang", BOOTSTRAP_LANG)
+    if content.body(f"lessons/{lang}") is None:
+        lang = BOOTSTRAP_LANG
+    have = dict(item.split(":", 1) for item in request.args.get("have", "").split(",") if ":" in item)
+    parts = bootstrap_parts(content, lang, have, {
+        "progress": _progress.get(current_uid()),
+        "health":   {"status": "ok", "ai": bool(API_KEY)},
+    })
+    # Static sections are named by their ETags, so only the dynamic bytes are hashed
+    digest, size = hashlib.sha256(), 0
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+            size += len(part)
+        else:
+            digest.update(part[0] + part[1].etag.encode())
+            size += len(part[0]) + len(part[1].body)
+    etag     = digest.hexdigest()[:32]
+    encoding = "gzip" if size >= COMPRESS_MIN_SIZE and request.accept_encodings.best_match(["gzip"]) else None
+    if encoding:
+        etag += "-gzip"
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    elif encoding:
+        resp = Response(gzip_splice(parts), mimetype="application/json")
+        resp.headers["Content-Encoding"] = encoding
+    else:
+        resp = Response(join_parts(parts), mimetype="application/json")
+    resp.set_etag(etag)
+    resp.vary.update(("Accept-Encoding", "Cookie"))
+    resp.cache_control.private  = True  # carries the user's progress
+    resp.cache_control.no_cache = True
+    return resp
 
 @app.route("/api/languages")
 def get_languages():
-    return jsonify([
-        {"id": "python",     "name": "Python",     "emoji": "🐍", "color": "#3b82f6",
-         "lessons": len(LESSONS["python"]),     "desc": "Simples, poderoso e versátil"},
-        {"id": "javascript", "name": "JavaScript", "emoji": "⚡", "color": "#fbbf24",
-         "lessons": len(LESSONS["javascript"]), "desc": "A linguagem da web moderna"},
-        {"id": "java",       "name": "Java",       "emoji": "☕", "color": "#ef4444",
-         "lessons": len(LESSONS["java"]),       "desc": "Robusto e orientado a objetos"},
-    ])
+    return cached_response(_content.body("languages"))
 
 @app.route("/api/lessons/<lang>")
 def get_lessons(lang: str):
-    if lang not in LESSONS:
+    entry = _content.body(f"lessons/{lang}")
+    if entry is None:
         return jsonify({"error": "Linguagem não encontrada"}), 404
-    return jsonify(LESSONS[lang])
+    return cached_response(entry)
 
 @app.route("/api/exercises")
 def get_exercises():
-    lang = request.args.get("lang", "").strip()
-    exs  = EXERCISES if not lang else [e for e in EXERCISES if e["lang"] == lang]
-    return jsonify(exs)
+    lang  = request.args.get("lang", "").strip()
+    entry = _content.body(f"exercises/{lang}" if lang else "exercises") or _EMPTY_LIST
+    return cached_response(entry)
+
+@app.route("/api/exercises/<exercise_id>/run", methods=["POST"])
+@rate_limit(max_calls=20, window_seconds=60)
+def run_exercise(exercise_id: str):
+    from sandbox import SandboxBusy, SandboxUnavailable
+    content = _content
+    if exercise_id not in content.valid_exercise_ids:
+        return jsonify({"error": "Exercício não encontrado"}), 404
+    grading = content.grading(exercise_id)
+    if grading is None:
+        return jsonify({"error": "Este exercício não tem verificação automática"}), 400
+    source = (request.get_json(silent=True) or {}).get("code")
+    if not isinstance(source, str) or not source.strip():
+        return jsonify({"error": "Código vazio"}), 400
+    if len(source) > SANDBOX_MAX_SOURCE:
+        return jsonify({"error": "Código muito longo"}), 413
+    try:
+        result = grade_submission(exercise_id, grading, source)
+    except SandboxBusy:
+        resp = jsonify({"error": SANDBOX_BUSY_MSG})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "2"
+        return resp
+    except SandboxUnavailable:
+        return jsonify({"error": SANDBOX_OFF_MSG}), 503
+    if result["passed"]:
+        uid = current_uid()
+        _progress.complete_exercise(uid, exercise_id, grading["xp"])
+        result["progress"] = _progress.get(uid)
+    return jsonify(result)
+
+@app.route("/api/search")
+def search():
+    q     = request.args.get("q", "")[:SEARCH_MAX_QUERY]
+    lang  = request.args.get("lang", "").strip()
+    kind  = request.args.get("kind", "").strip()
+    limit = max(1, min(request.args.get("limit", 10, type=int), SEARCH_MAX_RESULTS))
+    if not q.strip():
+        return jsonify({"q": q, "results": [], "total": 0, "total_exact": True})
+    hits, total, exact = _content.search_index().search(q, limit, lang, kind)
+    # total_exact is false when the total only counts the postings that were scored
+    return jsonify({"q": q, "results": hits, "total": total, "total_exact": exact})
 
 @app.route("/api/quiz/random")
 def get_quiz():
     lang  = request.args.get("lang", "").strip()
-    count = min(int(request.args.get("count", 8)), 15)
-    pool  = [q for q in QUIZZES if q["lang"] == lang] if lang else QUIZZES
+    level = request.args.get("level", "").strip()
+    count = max(1, min(request.args.get("count", 8, type=int), 15))
+    if request.args.get("mode") == "review":
+        return _review_quiz(lang, level, count)
+    pool  = _content.quiz_pools.get((lang, level), ())
     if not pool:
         return jsonify({"questions": [], "ids": []})
     selected = random.sample(pool, min(count, len(pool)))
-    # Strip answer before sending to client
-    clean = [{k: v for k, v in q.items() if k not in ("ans", "exp")} for q in selected]
-    return jsonify({"questions": clean, "ids": [q["id"] for q in selected]})
+    # Client copies are pre-serialized without answers — just join them
+    body = b'{"questions":[' + b",".join(frag for _, frag in selected) + \
+           b'],"ids":' + _serialize([qid for qid, _ in selected]) + b"}"
+    return Response(body, mimetype="application/json")
+
+def _review_quiz(lang: str, level: str, count: int) -> Response:
+    """The learner's `count` most overdue questions (spaced repetition)."""
+    content, uid, now = _content, current_uid(), time.time()
+
+    def keep(qid):
+        q = content.quiz_by_id.get(qid)  # questions removed from the bank are skipped
+        return q is not None and (not lang or q["lang"] == lang) and (not level or q["level"] == level)
+    ids  = _progress.due_reviews(uid, now, count, keep)
+    body = b'{"questions":[' + b",".join(content.quiz_client[qid] for qid in ids) + \
+           b'],"ids":' + _serialize(ids) + b',"review":' + _serialize(_progress.review_summary(uid, now)) + b"}"
+    resp = Response(body, mimetype="application/json")
+    resp.headers["Cache-Control"] = "private, no-store"
+    return resp
 
 @app.route("/api/quiz/check", methods=["POST"])
 @rate_limit(max_calls=60, window_seconds=60)
@@ -1372,17 +3122,16 @@ def check_quiz():
     if not isinstance(answers, dict) or len(answers) > 15:
         return jsonify({"error": "Payload inválido"}), 400
 
+    content = _content
     correct = 0
     results = []
     for qid, user_ans in answers.items():
         # FIX: validate qid
-        if qid not in _VALID_QUIZ_IDS:
+        if qid not in content.valid_quiz_ids:
             continue
         if not isinstance(user_ans, int):
             continue
-        q  = next((x for x in QUIZZES if x["id"] == qid), None)
-        if not q:
-            continue
+        q  = content.quiz_by_id[qid]
         ok = (user_ans == q["ans"])
         if ok:
             correct += 1
@@ -1391,106 +3140,43 @@ def check_quiz():
             "right_answer": q["ans"], "explanation": q["exp"]
         })
 
-    p = load_progress()
-    p["quizzes_taken"] = p.get("quizzes_taken", 0) + 1  # Once per quiz-session
-    p["quiz_correct"]  = p.get("quiz_correct",  0) + correct
-    p["xp"]            = p.get("xp",  0) + correct * 20
-    p["level"]         = p["xp"] // 500 + 1
-    save_progress(p)
+    # Once per quiz-session; every answer also reschedules its question
+    _progress.record_quiz(current_uid(), correct, outcomes=[(r["id"], r["correct"]) for r in results])
 
     return jsonify({"correct": correct, "total": len(answers), "results": results})
 
 @app.route("/api/progress", methods=["GET", "POST"])
 def progress():
+    uid = current_uid()
     if request.method == "GET":
-        return jsonify(load_progress())
+        return jsonify(_progress.get(uid))
 
     data = request.get_json(silent=True) or {}
     action = data.get("action", "")
-    p = load_progress()
 
     if action == "complete_lesson":
         lid = data.get("lesson_id", "")
         # FIX: validate lesson_id
-        if lid not in _VALID_LESSON_IDS:
+        if lid not in _content.valid_lesson_ids:
             return jsonify({"error": "lesson_id inválido"}), 400
-        if lid not in p.get("lessons", []):
-            p.setdefault("lessons", []).append(lid)
-            p["xp"]    = p.get("xp", 0) + 50
-            p["level"] = p["xp"] // 500 + 1
+        _progress.complete_lesson(uid, lid)
 
     elif action == "complete_exercise":
         eid = data.get("exercise_id", "")
         # FIX: validate exercise_id
-        if eid not in _VALID_EXERCISE_IDS:
+        if eid not in _content.valid_exercise_ids:
             return jsonify({"error": "exercise_id inválido"}), 400
-        if eid not in p.get("exercises", []):
-            p.setdefault("exercises", []).append(eid)
-            p["xp"]    = p.get("xp", 0) + 100
-            p["level"] = p["xp"] // 500 + 1
+        if _content.grading(eid) is not None:
+            return jsonify({"error": "Este exercício é verificado pelo servidor: use ▶ Executar"}), 403
+        _progress.complete_exercise(uid, eid)
 
     elif action == "reset":
-        p = _default_progress()
+        _progress.reset(uid)
 
     else:
         return jsonify({"error": "Ação inválida"}), 400
 
-    save_progress(p)
-    return jsonify(p)
-
-@app.route("/api/ai/chat", methods=["POST"])
-@rate_limit(max_calls=15, window_seconds=60)
-def ai_chat():
-    if not API_KEY:
-        return jsonify({
-            "response": (
-                "⚠️  A IA não está configurada.\n\n"
-                "Para ativar, defina a variável de ambiente:\n"
-                "  export ANTHROPIC_API_KEY='sk-ant-...'\n\n"
-                "Enquanto isso, explore as lições e exercícios!"
-            ),
-            "offline": True
-        })
-
-    data = request.get_json(silent=True) or {}
-    msgs = data.get("messages", [])
-
-    # Sanitize: only keep role/content, limit history
-    clean_msgs = [
-        {"role": m["role"], "content": str(m["content"])[:4000]}
-        for m in msgs[-12:]
-        if isinstance(m, dict) and m.get("role") in ("user", "assistant")
-        and m.get("content")
-    ]
-
-    if not clean_msgs:
-        return jsonify({"error": "Mensagem vazia"}), 400
-
-    try:
-        import anthropic
-        client = anthropic.Anthropic(api_key=API_KEY)
-        resp   = client.messages.create(
-            model      = "claude-opus-4-5",
-            max_tokens = 1024,
-            system     = (
-                "Você é o CodeMaster AI, tutor especialista em Python, JavaScript e Java. "
-                "Responda sempre em português brasileiro. "
-                "Seja didático, use exemplos práticos de código quando relevante. "
-                "Use emojis com moderação. "
-                "Para código, use blocos markdown com a linguagem: ```python, ```javascript ou ```java."
-            ),
-            messages   = clean_msgs
-        )
-        return jsonify({"response": resp.content[0].text, "offline": False})
-
-    except ImportError:
-        return jsonify({
-            "response": "Instale o pacote Anthropic:\n  pip install anthropic",
-            "offline": True
-        })
-    except Exception as e:
-        app.logger.error(f"AI error: {e}")
-        return jsonify({"response": f"Erro temporário. Tente novamente.", "offline": True})
+    return jsonify(_progress.get(uid))
 
 # ─── 404 / Error handlers ────────────────────────────────────────────────────
 @app.errorhandler(404)
@@ -1503,9 +3189,42 @@ def server_error(e):
 
 # ── Entry point ───────────────────────────────────────────────────────────────
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["claim-legacy"]:
+        if len(sys.argv) != 3 or not _UID_RE.fullmatch(sys.argv[2]):
+            print(f"  usage: app.py claim-legacy <{UID_COOKIE} cookie value>")
+            sys.exit(2)
+        claimed = _progress_store.claim_legacy(sys.argv[2])
+        print(f"  Legacy progress {'moved to ' + sys.argv[2] if claimed else 'not claimed (none left, or that learner has progress)'}")
+        sys.exit(0 if claimed else 1)
+    if sys.argv[1:] == ["build-content"]:
+        header = compile_content_pack()
+        print(f"  Content: {CONTENT_PACK} ({len(header['sections'])} sections, {header['digest'][:12]})")
+        sys.exit(0)
+    if sys.argv[1:2] == ["vendor-libs"]:
+        import argparse
+        parser = argparse.ArgumentParser(prog="app.py vendor-libs")
+        parser.add_argument("--bundle", default=LIBS_BUNDLE, help="install from this tarball first")
+        parser.add_argument("--mirror", default=LIBS_MIRROR, help="base URL to download from instead of the CDNs")
+        parser.add_argument("--make-bundle", metavar="PATH", help="then write the vendored libs to a tarball")
+        parser.add_argument("--require-pin", action="store_true", default=LIBS_REQUIRE_PIN,
+                            help="refuse libs that have no pin in libs.lock.json")
+        parser.add_argument("--update-lock", action="store_true",
+                            help="rewrite libs.lock.json, pinning the libs vendored without one")
+        args   = parser.parse_args(sys.argv[2:])
+        report = vendor_libs(args.bundle, args.mirror, allow_unpinned=not args.require_pin)
+        for fname, status in report.items():
+            print(f"  [lib] {fname}: {status}")
+        if args.update_lock:
+            added = update_lib_lock(allow_new=not args.require_pin)
+            for fname, integrity in added.items():
+                print(f"  [lock] NEW PIN {fname}: {integrity} — compare with the publisher's SRI before committing")
+            print(f"  Lock: {LIBS_LOCK} ({len(load_lib_pins())}/{len(LIBS)} libs pinned)")
+        if args.make_bundle:
+            print(f"  Bundle: {args.make_bundle} ({len(make_lib_bundle(args.make_bundle))} libs)")
+        sys.exit(0 if all(not s.startswith("error") for s in report.values()) else 1)
     print("\n╔══════════════════════════════════════════╗")
     print("║     CodeMaster Pro v3.0 — Iniciando     ║")
     print("╚══════════════════════════════════════════╝")
     print(f"  AI:       {'✅ Configurada' if API_KEY else '⚠️  Sem ANTHROPIC_API_KEY'}")
-    print(f"  Progress: {PROGRESS_F}")
+    print(f"  Progress: {PROGRESS_DB}")
     print( "  URL:      http://localhost:5000\n")
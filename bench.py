@@ -0,0 +1,298 @@
+"""
+CodeMaster Pro — in-process benchmarks.
+
+Fills the content pack with synthetic lessons, exercises and quizzes (10³–10⁵
+of each; the real pack is far too small to show how anything scales), then
+drives every route through Flask's test client and reports throughput and
+latency percentiles per route as JSON. The AI upstream is replaced by a stub
+client with a fixed latency, so the chat routes measure our own overhead.
+
+    python bench.py --items 1000,10000 --out bench.json
+    python bench.py --items 1000,10000 --baseline bench.json --threshold 0.25
+
+With --baseline the run exits with status 1 if any route's p50 or p95 got
+slower than the baseline by more than the threshold (and by more than
+--min-delta-ms, so sub-millisecond noise doesn't fail a build).
+
+Everything runs against a throwaway directory: progress, caches and the pack
+never touch the real ones.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import platform
+import tempfile
+
+LEVELS = ("Iniciante", "Intermediário", "Avançado")
+WORDS  = ("função", "variável", "laço", "lista", "dicionário", "classe", "objeto", "método",
+          "módulo", "exceção", "recursão", "iterador", "gerador", "escopo", "tipo", "string",
+          "inteiro", "arquivo", "teste", "algoritmo", "índice", "valor", "retorno", "parâmetro")
+METRICS = ("p50_ms", "p95_ms")
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate_content(items: int, languages: list, seed: int = 42, lesson_words: int = 60):
+    """`items` lessons, exercises and quizzes each, spread over `languages` and
+    the three levels. Returns the arguments of app.write_content_pack."""
+    rng = random.Random(seed)
+    lessons   = {meta["id"]: [] for meta in languages}
+    exercises, quizzes = [], []
+    for i in range(items):
+        lang  = languages[i % len(languages)]["id"]
+        level = LEVELS[i % len(LEVELS)]
+        lessons[lang].append({
+            "id": f"syn_l{i}", "title": _text(rng, 4).title(), "level": level,
+            "theory": _text(rng, lesson_words), "code": f"# {_text(rng, 6)}\nprint({i})",
+        })
+        exercises.append({
+            "id": f"syn_e{i}", "lang": lang, "level": level, "xp": 100,
+            "title": _text(rng, 3).title(), "desc": _text(rng, 25),
+            "starter": f"# {_text(rng, 5)}\n", "solution": f"print({i})\n",
+        })
+        quizzes.append({
+            "id": f"syn_q{i}", "lang": lang, "level": level, "q": _text(rng, 10) + "?",
+            "opts": [_text(rng, 2) for _ in range(4)], "ans": rng.randrange(4),
+            "exp": _text(rng, 15),
+        })
+    return languages, lessons, exercises, quizzes
+
+
+class _StubAIClient:
+    """Stands in for anthropic.Anthropic: answers after `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency  = latency
+        self.messages = self
+
+    def _reply(self):
+        time.sleep(self.latency)
+        return type("Message", (), {"content": [type("Block", (), {"text": "Resposta simulada."})()]})()
+
+    def create(self, **kwargs):
+        return self._reply()
+
+    def stream(self, **kwargs):
+        client = self
+
+        class Stream:
+            def __enter__(self):
+                self.final = client._reply()
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            @property
+            def text_stream(self):
+                yield from ("Resposta ", "simulada.")
+
+            def get_final_message(self):
+                return self.final
+        return Stream()
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Bench:
+    """Test-client driver: each request comes from one of `users` learners
+    (own cookie) and a distinct address, so rate limits never kick in."""
+
+    def __init__(self, app, users: int = 64):
+        self.app    = app
+        self.client = app.app.test_client()
+        self.uids   = [secrets.token_urlsafe(16) for _ in range(users)]
+        self.n      = 0
+
+    def request(self, method: str, path: str, **kwargs):
+        self.n += 1
+        uid = self.uids[self.n % len(self.uids)]
+        ip  = f"10.{self.n >> 16 & 255}.{self.n >> 8 & 255}.{self.n & 255}"
+        headers = {"Cookie": f"{self.app.UID_COOKIE}={uid}", **kwargs.pop("headers", {})}
+        resp = self.client.open(path, method=method, headers=headers,
+                                environ_overrides={"REMOTE_ADDR": ip}, **kwargs)
+        resp.get_data()  # drain streamed bodies too
+        resp.close()
+        return resp.status_code
+
+    def measure(self, call, requests: int, warmup: int) -> dict:
+        for i in range(warmup):
+            call(i)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for i in range(requests):
+            t0     = time.perf_counter()
+            status = call(warmup + i)
+            latencies.append(time.perf_counter() - t0)
+            if status >= 400:
+                errors += 1
+        total = time.perf_counter() - started
+        latencies.sort()
+        return {
+            "requests": requests,
+            "errors":   errors,
+            "rps":      round(requests / total, 1),
+            "mean_ms":  round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50_ms":   round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms":   round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms":   round(percentile(latencies, 99) * 1000, 3),
+            "max_ms":   round(latencies[-1] * 1000, 3),
+        }
+
+
+def routes(bench: Bench, lesson_ids: list, quiz_ids: list, lib: str) -> dict:
+    """name -> call(i) for every route worth tracking."""
+    rng = random.Random(7)
+    req = bench.request
+
+    def check(i):
+        picked = rng.sample(quiz_ids, min(8, len(quiz_ids)))
+        return req("POST", "/api/quiz/check", json={"answers": {qid: rng.randrange(4) for qid in picked}})
+
+    return {
+        "GET /":                         lambda i: req("GET", "/", headers={"Accept-Encoding": "gzip"}),
+        "GET /api/bootstrap":            lambda i: req("GET", "/api/bootstrap"),
+        "GET /api/languages":            lambda i: req("GET", "/api/languages"),
+        "GET /api/lessons/<lang>":       lambda i: req("GET", "/api/lessons/python"),
+        "GET /api/lessons/<lang> (gzip)": lambda i: req("GET", "/api/lessons/python",
+                                                        headers={"Accept-Encoding": "gzip"}),
+        "GET /api/exercises":            lambda i: req("GET", "/api/exercises?lang=python"),
+        "GET /api/quiz/random":          lambda i: req("GET", "/api/quiz/random?lang=python&count=8"),
+        "GET /api/quiz/random (review)": lambda i: req("GET", "/api/quiz/random?mode=review&count=8"),
+        "POST /api/quiz/check":          check,
+        "GET /api/search":               lambda i: req("GET", "/api/search?q=fun%C3%A7%C3%A3o+lis&limit=10"),
+        "GET /api/progress":             lambda i: req("GET", "/api/progress"),
+        "POST /api/progress":            lambda i: req("POST", "/api/progress", json={
+                                             "action": "complete_lesson", "lesson_id": rng.choice(lesson_ids)}),
+        "GET /lib/<file>":               lambda i: req("GET", lib, headers={"Accept-Encoding": "gzip"}),
+        "POST /api/ai/chat":             lambda i: req("POST", "/api/ai/chat",
+                                                       json={"message": f"Explique recursão ({i})"}),
+    }
+
+
+def run_size(app, bench: Bench, items: int, requests: int, warmup: int, lib: str, only: set) -> dict:
+    t0 = time.perf_counter()
+    languages = app._content.decode("languages")
+    languages = [{k: v for k, v in meta.items() if k != "lessons"} for meta in languages]
+    content   = generate_content(items, languages)
+    header    = app.write_content_pack(*content, dest=app.CONTENT_PACK)
+    app._content = app.ContentPack(app.CONTENT_PACK)
+    built = time.perf_counter() - t0
+
+    results = {}
+    for name, call in routes(bench, header["ids"]["lessons"], header["ids"]["quizzes"], lib).items():
+        if only and not any(word in name for word in only):
+            continue
+        results[name] = bench.measure(call, requests, warmup)
+        print(f"  {items:>7}  {name:<32} {results[name]['rps']:>9.1f}/s  "
+              f"p50 {results[name]['p50_ms']:>8.3f}ms  p95 {results[name]['p95_ms']:>8.3f}ms",
+              file=sys.stderr)
+    return {"pack_bytes": os.path.getsize(app.CONTENT_PACK), "build_s": round(built, 3), "routes": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """Regressions as (items, route, metric, baseline, current)."""
+    regressions = []
+    for items, run in current["results"].items():
+        base_run = baseline.get("results", {}).get(items)
+        if base_run is None:
+            continue
+        for route, stats in run["routes"].items():
+            base = base_run["routes"].get(route)
+            if base is None:
+                continue
+            for metric in METRICS:
+                was, now = base[metric], stats[metric]
+                if now > was * (1 + threshold) and now - was > min_delta_ms:
+                    regressions.append((items, route, metric, was, now))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="In-process benchmarks for CodeMaster Pro.")
+    parser.add_argument("--items", default="1000,10000",
+                        help="comma-separated synthetic content sizes (lessons/exercises/quizzes each)")
+    parser.add_argument("--requests", type=int, default=300, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument("--routes", default="", help="comma-separated substrings to select routes")
+    parser.add_argument("--ai-latency-ms", type=float, default=0, help="stubbed upstream AI latency")
+    parser.add_argument("--out", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier --out file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="codemaster-bench-")
+    static  = os.path.join(workdir, "static")
+    os.makedirs(static)
+    os.environ.update({
+        "CODEMASTER_CONTENT_PACK":  os.path.join(workdir, "content.pack"),
+        "CODEMASTER_PROGRESS_DB":   os.path.join(workdir, "progress.db"),
+        "CODEMASTER_CACHE_DB":      os.path.join(workdir, "cache.db"),
+        "CODEMASTER_VENDOR_LIBS":   "0",
+        "CODEMASTER_PROFILE":       "0",
+        "STATE_BACKEND":            "local",
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    # A vendored lib of realistic size, served from the throwaway static dir
+    app.STATIC_DIR, app.LIB_COMPRESSED_DIR = static, os.path.join(static, "_compressed")
+    with open(os.path.join(static, "vue.min.js"), "w", encoding="utf-8") as f:
+        f.write("".join(f"var v{i}=function(a,b){{return a+b*{i}}};\n" for i in range(4000)))
+    app.API_KEY = "bench"
+    stub = _StubAIClient(args.ai_latency_ms / 1000)
+    app.get_ai_client = lambda: stub
+
+    bench = Bench(app)
+    lib   = app.lib_url("vue.min.js")
+    only  = set(filter(None, args.routes.split(",")))
+    report = {
+        "meta": {
+            "python":   platform.python_version(),
+            "platform": platform.platform(),
+            "time":     time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "requests": args.requests,
+            "ai_latency_ms": args.ai_latency_ms,
+        },
+        "results": {},
+    }
+    for items in (int(n) for n in args.items.split(",") if n.strip()):
+        report["results"][str(items)] = run_size(app, bench, items, args.requests, args.warmup, lib, only)
+
+    data = json.dumps(report, indent=2, ensure_ascii=False) + "\n"
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        for items, route, metric, was, now in regressions:
+            print(f"  REGRESSION {items} {route} {metric}: {was:.3f}ms -> {now:.3f}ms "
+                  f"(+{(now / was - 1) * 100 if was else float('inf'):.0f}%)", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"  No regressions beyond {args.threshold:.0%} vs {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
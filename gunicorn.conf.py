@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for CodeMaster Pro — picked up automatically by
+`gunicorn app:app` when started from this directory.
+"""
+import os
+
+# Threaded workers: AI calls may only occupy CODEMASTER_AI_CONCURRENCY +
+# CODEMASTER_AI_QUEUE threads per worker (see AIGateway in app.py); the other
+# threads keep serving lessons, quizzes and health checks.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads      = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+def post_worker_init(worker):
+    # Open the upstream AI connection pool, fork the grading sandboxes and
+    # build the search index before the first request lands
+    from app import warm_ai_client, warm_sandbox, warm_search
+    warm_ai_client()
+    warm_sandbox()
+    warm_search()
@@ -0,0 +1,376 @@
+"""
+CodeMaster Pro — multi-worker load harness.
+
+Boots the app under gunicorn on localhost (worker class, worker and thread
+counts and the state backend are all options) against a throwaway progress
+database, then runs many concurrent learners against it for a fixed time.
+Each learner keeps its own cookie and keep-alive connection and mixes
+content reads, quiz rounds and lesson completions.
+
+Every XP-bearing answer the server acknowledges is also tallied on the
+client. Once the run ends, gunicorn is stopped gracefully (so write-behind
+buffers flush) and the final rows are read straight from SQLite: any XP or
+quiz round the server acknowledged but did not keep is a lost update.
+
+    python loadtest.py --workers 4 --clients 64 --duration 20
+    python loadtest.py --worker-class sync --state file --write-behind --out run.json
+
+By default every learner connects from its own loopback address
+(127.0.x.y), so the per-IP rate limits only bite with --shared-ip; with it,
+compare the accepted quiz checks against the configured budget to see
+whether the limit holds across workers (STATE_BACKEND=file) or is
+multiplied by them (local). Lock wait/hold times are taken from /metrics
+when the run ends.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import sqlite3
+import secrets
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# op -> weight in the traffic mix
+MIX = {
+    "lessons":         30,
+    "quiz_random":     15,
+    "quiz_check":      25,
+    "complete_lesson": 15,
+    "progress":        10,
+    "languages":        5,
+}
+QUIZ_XP, LESSON_XP = 20, 50    # app.py: record_quiz / complete_lesson defaults
+QUIZ_RATE_LIMIT    = 60        # app.py: check_quiz calls per IP per minute
+_METRIC_RE = re.compile(r'^codemaster_lock_(wait|hold)_seconds_(sum|count)\{lock="([^"]+)"\} (\S+)$')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, int(-(-len(sorted_values) * pct // 100)) - 1)]
+
+
+class Server:
+    """gunicorn running app:app from this directory, in a private work dir."""
+
+    def __init__(self, args, workdir: str):
+        self.port    = args.port or _free_port()
+        self.workdir = workdir
+        self.log     = os.path.join(workdir, "gunicorn.log")
+        self.env     = dict(os.environ,
+                            CODEMASTER_PROGRESS_DB=os.path.join(workdir, "progress.db"),
+                            CODEMASTER_CACHE_DB=os.path.join(workdir, "cache.db"),
+                            CODEMASTER_CONTENT_PACK=os.path.join(workdir, "content.pack"),
+                            CODEMASTER_METRICS_DIR=os.path.join(workdir, "metrics"),
+                            CODEMASTER_METRICS_FLUSH_INTERVAL="1",
+                            CODEMASTER_VENDOR_LIBS="0",
+                            CODEMASTER_PROGRESS_WRITE_BEHIND="1" if args.write_behind else "0",
+                            STATE_BACKEND=(f"file:{os.path.join(workdir, 'state')}"
+                                           if args.state == "file" else args.state))
+        self.cmd = [sys.executable, "-m", "gunicorn", "app:app",
+                    "--bind", f"127.0.0.1:{self.port}",
+                    "--workers", str(args.workers),
+                    "--worker-class", args.worker_class,
+                    "--error-logfile", self.log,
+                    "--graceful-timeout", "10"]
+        if args.worker_class == "gthread":  # with sync, threads > 1 would silently mean gthread
+            self.cmd += ["--threads", str(args.threads)]
+        self.proc = None
+
+    def start(self, timeout: float = 30):
+        log = open(self.log, "ab")
+        self.proc = subprocess.Popen(self.cmd, cwd=BASE_DIR, env=self.env, stdout=log, stderr=log)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"gunicorn exited ({self.proc.returncode}), see {self.log}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", "/api/health")
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"gunicorn did not become ready in {timeout}s, see {self.log}")
+
+    def get(self, path: str) -> bytes:
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        try:
+            conn.request("GET", path)
+            return conn.getresponse().read()
+        finally:
+            conn.close()
+
+    def stop(self):
+        """Graceful stop: workers finish in-flight requests and run their atexit flushes."""
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class Learner(threading.Thread):
+    """One simulated user: own uid cookie, own keep-alive connection, own tally."""
+
+    def __init__(self, n: int, port: int, shared_ip: bool, lesson_ids: list, deadline: float,
+                 seed: int, stats: dict, stats_lock: threading.Lock):
+        super().__init__(name=f"learner-{n}", daemon=True)
+        self.uid      = secrets.token_urlsafe(16)
+        self.port     = port
+        self.source   = None if shared_ip else (f"127.0.{1 + n // 250}.{1 + n % 250}", 0)
+        self.lessons  = lesson_ids
+        self.deadline = deadline
+        self.rng      = random.Random(seed)
+        self.stats, self.stats_lock = stats, stats_lock
+        self.conn     = None
+        self.quiz     = []            # ids from the last /api/quiz/random
+        self.done     = set()         # lessons acknowledged as completed
+        self.expected = {"xp": 0, "quizzes_taken": 0, "quiz_correct": 0}
+        self.uncertain = 0            # writes whose outcome we never saw
+
+    def _call(self, method: str, path: str, body: dict = None):
+        headers = {"Cookie": f"cm_uid={self.uid}"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30,
+                                                       source_address=self.source)
+            try:
+                self.conn.request(method, path, data, headers)
+                resp = self.conn.getresponse()
+                payload = resp.read()
+                if resp.getheader("Connection", "").lower() == "close":
+                    self.conn.close()
+                    self.conn = None
+                return resp.status, payload
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.conn.close()
+                self.conn = None
+                if method != "GET" or attempt == 2:  # a write may or may not have landed
+                    raise
+
+    def _record(self, op: str, seconds: float, status):
+        with self.stats_lock:
+            s = self.stats.setdefault(op, {"latencies": [], "status": {}})
+            s["latencies"].append(seconds)
+            s["status"][status] = s["status"].get(status, 0) + 1
+
+    def step(self):
+        op = self.rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        if op == "quiz_check" and not self.quiz:
+            op = "quiz_random"
+        t0 = time.perf_counter()
+        try:
+            if op == "lessons":
+                status, _ = self._call("GET", f"/api/lessons/{self.rng.choice(('python', 'javascript', 'java'))}")
+            elif op == "languages":
+                status, _ = self._call("GET", "/api/languages")
+            elif op == "progress":
+                status, _ = self._call("GET", "/api/progress")
+            elif op == "quiz_random":
+                status, payload = self._call("GET", "/api/quiz/random?count=8")
+                if status == 200:
+                    self.quiz = json.loads(payload)["ids"]
+            elif op == "quiz_check":
+                answers = {qid: self.rng.randrange(4) for qid in self.quiz}
+                self.quiz = []
+                status, payload = self._call("POST", "/api/quiz/check", {"answers": answers})
+                if status == 200:
+                    correct = json.loads(payload)["correct"]
+                    self.expected["xp"] += correct * QUIZ_XP
+                    self.expected["quizzes_taken"] += 1
+                    self.expected["quiz_correct"] += correct
+            else:
+                lesson = self.rng.choice(self.lessons)
+                status, _ = self._call("POST", "/api/progress",
+                                       {"action": "complete_lesson", "lesson_id": lesson})
+                if status == 200 and lesson not in self.done:
+                    self.done.add(lesson)
+                    self.expected["xp"] += LESSON_XP
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+            if op in ("quiz_check", "complete_lesson"):
+                self.uncertain += 1
+        self._record(op, time.perf_counter() - t0, status)
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.step()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def _lesson_ids(server: Server) -> list:
+    ids = []
+    for lang in json.loads(server.get("/api/languages")):
+        ids += [lesson["id"] for lesson in json.loads(server.get(f"/api/lessons/{lang['id']}"))]
+    return ids
+
+
+def _lock_metrics(text: str) -> dict:
+    locks = {}
+    for line in text.splitlines():
+        m = _METRIC_RE.match(line)
+        if m:
+            kind, field, lock, value = m.groups()
+            locks.setdefault(lock, {})[f"{kind}_{field}"] = float(value)
+    for stats in locks.values():
+        for kind in ("wait", "hold"):
+            count = stats.get(f"{kind}_count", 0)
+            stats[f"{kind}_mean_us"] = round(stats.get(f"{kind}_sum", 0) / count * 1e6, 2) if count else 0
+    return locks
+
+
+def _final_progress(db: str) -> dict:
+    conn = sqlite3.connect(db)
+    try:
+        rows = conn.execute("SELECT uid, xp, quizzes_taken, quiz_correct FROM users").fetchall()
+    finally:
+        conn.close()
+    return {uid: {"xp": xp, "quizzes_taken": taken, "quiz_correct": right} for uid, xp, taken, right in rows}
+
+
+def _summarize(stats: dict, elapsed: float) -> dict:
+    ops, total, failed = {}, 0, 0
+    for op, s in sorted(stats.items()):
+        lat = sorted(s["latencies"])
+        errors = sum(n for status, n in s["status"].items() if not isinstance(status, int) or status >= 500)
+        ops[op] = {
+            "requests": len(lat),
+            "rps":      round(len(lat) / elapsed, 1),
+            "errors":   errors,
+            "rate_limited": s["status"].get(429, 0),
+            "status":   {str(k): v for k, v in sorted(s["status"].items(), key=str)},
+            "p50_ms":   round(_percentile(lat, 50) * 1000, 2),
+            "p95_ms":   round(_percentile(lat, 95) * 1000, 2),
+            "p99_ms":   round(_percentile(lat, 99) * 1000, 2),
+            "max_ms":   round(lat[-1] * 1000, 2) if lat else 0,
+        }
+        total  += len(lat)
+        failed += errors
+    return {"requests": total, "rps": round(total / elapsed, 1),
+            "error_rate": round(failed / total, 5) if total else 0, "ops": ops}
+
+
+def _lost_updates(learners: list, final: dict) -> dict:
+    report = {"learners": len(learners), "checked": 0, "skipped_uncertain": 0,
+              "expected_xp": 0, "actual_xp": 0, "lost_xp": 0, "extra_xp": 0,
+              "lost_quiz_rounds": 0, "learners_with_lost_updates": 0}
+    for learner in learners:
+        if learner.uncertain:  # can't tell a lost update from a write that never landed
+            report["skipped_uncertain"] += 1
+            continue
+        got = final.get(learner.uid, {"xp": 0, "quizzes_taken": 0, "quiz_correct": 0})
+        want = learner.expected
+        report["checked"]     += 1
+        report["expected_xp"] += want["xp"]
+        report["actual_xp"]   += got["xp"]
+        report["lost_xp"]     += max(0, want["xp"] - got["xp"])
+        report["extra_xp"]    += max(0, got["xp"] - want["xp"])
+        report["lost_quiz_rounds"] += max(0, want["quizzes_taken"] - got["quizzes_taken"])
+        if got != want:
+            report["learners_with_lost_updates"] += 1
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load CodeMaster Pro under gunicorn and count lost updates.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--worker-class", default="gthread", help="sync, gthread, gevent, …")
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker (gthread)")
+    parser.add_argument("--state", default="local", help="STATE_BACKEND: local, file or a redis:// URL")
+    parser.add_argument("--write-behind", action="store_true", help="enable CODEMASTER_PROGRESS_WRITE_BEHIND")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent learners")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load")
+    parser.add_argument("--shared-ip", action="store_true",
+                        help="all learners from 127.0.0.1 (exercises the per-IP rate limits)")
+    parser.add_argument("--port", type=int, default=0, help="default: a free port")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--keep", action="store_true", help="keep the work dir (logs, database)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="codemaster-load-")
+    server  = Server(args, workdir)
+    threads = f" (threads={args.threads})" if args.worker_class == "gthread" else ""
+    print(f"  gunicorn: {args.workers} × {args.worker_class}{threads} "
+          f"state={args.state} write-behind={args.write_behind} on :{server.port}", file=sys.stderr)
+    server.start()
+    try:
+        lessons  = _lesson_ids(server)
+        stats, stats_lock = {}, threading.Lock()
+        started  = time.monotonic()
+        deadline = started + args.duration
+        learners = [Learner(n, server.port, args.shared_ip, lessons, deadline, args.seed * 100003 + n,
+                            stats, stats_lock) for n in range(args.clients)]
+        for learner in learners:
+            learner.start()
+        for learner in learners:
+            learner.join()
+        elapsed = time.monotonic() - started
+        time.sleep(1.5)  # let every worker dump its metrics once more
+        locks = _lock_metrics(server.get("/metrics").decode())
+    finally:
+        server.stop()
+
+    summary = _summarize(stats, elapsed)
+    checks  = summary["ops"].get("quiz_check", {})
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "keep")},
+        "elapsed_s": round(elapsed, 2),
+        **summary,
+        "lost_updates": _lost_updates(learners, _final_progress(server.env["CODEMASTER_PROGRESS_DB"])),
+        "rate_limit": {
+            "quiz_check_accepted": checks.get("status", {}).get("200", 0),
+            "quiz_check_rejected": checks.get("rate_limited", 0),
+            # what a limit shared by all workers would let through from one address
+            "budget_per_ip": int(QUIZ_RATE_LIMIT * max(1, -(-args.duration // 60))),
+        },
+        "locks": locks,
+    }
+    if args.keep:
+        report["workdir"] = workdir
+
+    data = json.dumps(report, indent=2) + "\n"
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data)
+    lost = report["lost_updates"]
+    print(f"  {summary['requests']} requests, {summary['rps']}/s, error rate {summary['error_rate']:.2%}; "
+          f"lost XP {lost['lost_xp']} of {lost['expected_xp']} "
+          f"({lost['learners_with_lost_updates']}/{lost['checked']} learners affected)", file=sys.stderr)
+    if not args.keep:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if lost["lost_xp"] or lost["lost_quiz_rounds"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,549 @@
+"""
+CodeMaster Pro — Python sandbox used to grade exercise submissions.
+
+A SandboxPool keeps a few warm "zygote" processes (this file run as a script,
+with a minimal environment and the common modules already imported).
+Isolation comes from the OS:
+
+  - a zygote started as root moves into an empty network namespace and then
+    switches for good to a dedicated unprivileged user (`nobody` unless
+    configured); it refuses to start if that user couldn't read the Python
+    installation, rather than run submissions as root,
+  - a zygote started as any other user would share the web worker's uid (and
+    could read its /proc/<pid>/environ), so it only starts under a wrapper
+    that isolates it — bwrap, nsjail or a container of its own — or when the
+    operator explicitly allows it for local development.
+
+For every submission the zygote forks a fresh child, which:
+
+  - starts a new session and applies CPU, address-space, file-size,
+    open-file and process rlimits,
+  - installs an audit hook, as defence in depth, that refuses sockets,
+    subprocesses, signals, filesystem writes, reads outside the Python
+    installation, and the introspection (gc, frames, __main__, ctypes,
+    code objects built from bytes or by code(), marshal included) that
+    could reach or disable the hook itself,
+  - runs the code with stdin/stdout redirected to in-memory buffers.
+
+The zygote enforces the wall-clock limit and reports back one JSON line per
+job, so a runaway submission never ties up the pool. A submission costs a
+few milliseconds this way; starting a fresh interpreter with the same imports
+costs ~60ms.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import select
+import signal
+import subprocess
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows: no fork/rlimits, grading is unavailable
+    resource = None
+
+# Imported once in the zygote so every forked child has them warm
+PREIMPORT = (
+    "math", "random", "string", "re", "json", "itertools", "functools", "collections",
+    "datetime", "statistics", "decimal", "fractions", "dataclasses", "typing", "heapq",
+    "bisect", "io", "traceback", "builtins", "tempfile",
+)
+# Dropped from sys.modules in the child so that a plain `import` of them is
+# refused. That is a convenience, not the boundary: preimported modules still
+# hold references to some (zipimport.marshal, tempfile._shutil, ...), so what
+# they can do is refused by audit event below, or by the rlimits and uid.
+BLOCKED_MODULES = frozenset((
+    "ctypes", "_ctypes", "socket", "_socket", "ssl", "_ssl", "select", "selectors",
+    "subprocess", "_posixsubprocess", "multiprocessing", "_multiprocessing", "signal",
+    "asyncio", "urllib", "http", "ftplib", "smtplib", "imaplib", "poplib", "telnetlib",
+    "resource", "mmap", "fcntl", "pty", "tty", "termios", "shutil", "sqlite3", "_sqlite3",
+    "gc", "__main__", "sandbox", "inspect", "marshal", "_testcapi", "_testinternalcapi",
+    "_xxsubinterpreters",
+))
+BLOCKED_EVENTS = frozenset((
+    "os.system", "os.exec", "os.posix_spawn", "os.spawn", "os.fork", "os.forkpty",
+    "os.kill", "os.killpg", "os.remove", "os.rename", "os.rmdir", "os.mkdir",
+    "os.symlink", "os.link", "os.chmod", "os.chown", "os.truncate", "os.utime",
+    "os.putenv", "os.unsetenv", "os.chdir", "os.chroot", "os.setxattr",
+    "os.removexattr", "os.startfile", "pty.spawn",
+    "sys.setprofile", "sys.settrace", "sys.addaudithook",
+    "sys._current_frames", "sys._current_exceptions", "code.__new__",
+    "marshal.dumps", "marshal.load", "marshal.loads",
+))
+BLOCKED_PREFIXES = ("socket.", "subprocess.", "ctypes.", "_ctypes.", "shutil.", "signal.",
+                    "mmap.", "fcntl.", "resource.", "sqlite3.", "webbrowser.", "winreg.", "_winapi.",
+                    "gc.")
+# Audited attribute reads that hand out frames (and, through them, every local)
+FRAME_ATTRS = frozenset(("tb_frame", "gi_frame", "cr_frame", "ag_frame"))
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+_SOURCE_NAME = "<seu_codigo>"
+_CLONE_NEWNET = 0x40000000
+_MAX_SYMLINKS = 40
+
+
+class SandboxBusy(Exception):
+    """Every zygote stayed busy for longer than the queue timeout."""
+
+
+class SandboxUnavailable(Exception):
+    """This host can't run the sandbox safely (no fork/rlimits, or no way to
+    keep submissions off root and off the web worker's uid)."""
+
+
+# ─── Child side (runs in the forked process) ──────────────────────────────────
+class _OutputLimit(Exception):
+    pass
+
+
+class _BoundedOutput:
+    """Text sink for stdout that stops the program once it printed too much."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size  = 0
+        self.parts = []
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        if self.size > self.limit:
+            raise _OutputLimit()
+        self.parts.append(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+
+def _make_guard(allowed_roots: tuple, cwd: str):
+    """Builds the audit hook. Everything it consults is bound here, as locals of
+    the closure: a submission can rebind module globals, builtins and os.path
+    helpers, but not these — and with gc, frames and __main__ blocked nothing
+    can reach the closure's cells. Paths are resolved with the C functions from
+    `posix` instead of os.path.realpath, whose helpers live in patchable modules."""
+    import posix
+    from _stat import S_ISLNK
+    lstat, readlink = posix.lstat, posix.readlink
+    exact_str, decode, is_instance = str.__str__, bytes.decode, isinstance
+    str_type, bytes_type = str, bytes
+    os_error, permission_error, import_error, value_error = OSError, PermissionError, ImportError, ValueError
+    blocked_events, blocked_prefixes, blocked_modules = BLOCKED_EVENTS, BLOCKED_PREFIXES, BLOCKED_MODULES
+    frame_attrs, write_flags, max_symlinks = FRAME_ATTRS, _WRITE_FLAGS, _MAX_SYMLINKS
+
+    def resolve(path: str) -> str:
+        if not path.startswith("/"):
+            path = cwd + "/" + path
+        pending, done, hops = path.split("/")[::-1], [], 0
+        while pending:
+            name = pending.pop()
+            if name == "" or name == ".":
+                continue
+            if name == "..":
+                if done:
+                    done.pop()
+                continue
+            done.append(name)
+            current = "/" + "/".join(done)
+            try:
+                is_link = S_ISLNK(lstat(current).st_mode)
+            except os_error:
+                continue
+            if is_link:
+                hops += 1
+                if hops > max_symlinks:
+                    raise permission_error("links simbólicos demais")
+                target = readlink(current)
+                done.pop()
+                if target.startswith("/"):
+                    done.clear()
+                pending.extend(target.split("/")[::-1])
+        return "/" + "/".join(done)
+
+    def guard(event, args):
+        if event in blocked_events or event.startswith(blocked_prefixes):
+            raise permission_error(f"operação não permitida no sandbox: {event}")
+        if event == "sys._getframe":
+            # ValueError ("stack not deep enough") is what namedtuple, typing,
+            # enum and warnings already handle when they peek at the caller
+            raise value_error("introspecção de frames não é permitida no sandbox")
+        if event == "object.__getattr__":
+            if args[1] in frame_attrs:
+                raise permission_error("introspecção de frames não é permitida no sandbox")
+        elif event in ("open", "os.listdir", "os.scandir"):
+            path, mode, flags = (args + (None, None))[:3]
+            if (flags or 0) & write_flags or (mode is not None and (
+                    "w" in mode or "a" in mode or "x" in mode or "+" in mode)):
+                raise permission_error("escrita em arquivos não é permitida no sandbox")
+            # Only plain str/bytes: an fd or a PathLike could name a different
+            # file by the time the interpreter actually opens it
+            if path is None:
+                path = cwd
+            elif is_instance(path, str_type):
+                path = exact_str(path)
+            elif is_instance(path, bytes_type):
+                path = decode(path, "utf-8", "surrogateescape")
+            else:
+                raise permission_error("acesso a arquivo não permitido")
+            if not resolve(path).startswith(allowed_roots):
+                raise permission_error(f"acesso a arquivo não permitido: {path}")
+        elif event == "import" and exact_str(args[0]).partition(".")[0] in blocked_modules:
+            raise import_error(f"o módulo {exact_str(args[0])!r} não está disponível no sandbox")
+    return guard
+
+
+def _isolate_network():
+    """Best effort: an empty network namespace (needs CAP_SYS_ADMIN); the audit
+    hook blocks sockets regardless. Done once in the zygote, before it drops
+    root, so children never load ctypes."""
+    try:
+        if hasattr(os, "unshare"):
+            os.unshare(_CLONE_NEWNET)
+        else:
+            import ctypes
+            ctypes.CDLL(None, use_errno=True).unshare(_CLONE_NEWNET)
+    except Exception:
+        pass
+    for name in [m for m in sys.modules if m.partition(".")[0] in ("ctypes", "_ctypes")]:
+        del sys.modules[name]
+
+
+def _apply_limits(limits: dict):
+    cpu, memory = limits["cpu_seconds"], limits["memory_mb"] * 1024 * 1024
+    for res, value in ((resource.RLIMIT_CPU, (cpu, cpu + 1)),
+                       (resource.RLIMIT_AS, (memory, memory)),
+                       (resource.RLIMIT_FSIZE, (0, 0)),
+                       (resource.RLIMIT_CORE, (0, 0)),
+                       (resource.RLIMIT_NOFILE, (32, 32)),
+                       (resource.RLIMIT_NPROC, (0, 0))):
+        try:
+            resource.setrlimit(res, value)
+        except (ValueError, OSError):
+            pass
+
+
+def _describe_error(exc: BaseException) -> str:
+    """One line, pointing at the student's line number when there is one. The
+    traceback is rendered by the interpreter's C printer, since frames are off
+    limits to Python code (the traceback module included) under the audit hook."""
+    import io
+    import re
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        sys.__excepthook__(type(exc), exc, exc.__traceback__)
+        printed = sys.stderr.getvalue().strip().splitlines()
+    finally:
+        sys.stderr = stderr
+    message = printed[-1] if printed else type(exc).__name__
+    lines = re.findall(r'File "%s", line (\d+)' % re.escape(_SOURCE_NAME), "\n".join(printed))
+    if isinstance(exc, SyntaxError) and exc.lineno:
+        lines = [exc.lineno]
+    return f"Linha {lines[-1]}: {message}" if lines else message
+
+
+def _run_child(job: dict, limits: dict, result_fd: int):
+    import io
+    import builtins
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):  # fd 1 is the zygote's protocol channel
+        os.dup2(devnull, fd)
+    os.setsid()
+    _apply_limits(limits)
+    os.environ.clear()
+    for name in [m for m in sys.modules if m.partition(".")[0] in BLOCKED_MODULES]:
+        del sys.modules[name]
+    # Imports from here on compile from source: reading a .pyc needs
+    # marshal.loads, which the hook refuses along with every other way to
+    # turn bytes into a code object
+    sys.dont_write_bytecode = True
+    sys.pycache_prefix = os.devnull
+    roots = tuple({os.path.realpath(p) + os.sep for p in (sys.prefix, sys.base_prefix, sys.exec_prefix)})
+    sys.addaudithook(_make_guard(roots, os.getcwd()))
+
+    out = _BoundedOutput(limits["output_limit"])
+    sys.stdin  = io.StringIO(job.get("stdin", ""))
+    sys.stdout = out
+    sys.stderr = _BoundedOutput(limits["output_limit"])
+    status, error = "ok", None
+    try:
+        code = compile(job["source"], _SOURCE_NAME, "exec")
+        exec(code, {"__name__": "__main__", "__builtins__": builtins})
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = "error", f"SystemExit: {e.code}"
+    except _OutputLimit:
+        status, error = "error", "Saída muito longa"
+    except MemoryError:
+        status, error = "error", "Limite de memória excedido"
+    except BaseException as e:
+        status, error = "error", _describe_error(e)
+    payload = json.dumps({"status": status, "stdout": out.getvalue(), "error": error}).encode("utf-8")
+    while payload:
+        payload = payload[os.write(result_fd, payload):]
+
+
+# ─── Zygote side ──────────────────────────────────────────────────────────────
+def _run_job(job: dict, limits: dict) -> dict:
+    """Forks a child for one submission and collects its result within the wall limit."""
+    started = time.monotonic()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            _run_child(job, limits, w)
+        finally:
+            os._exit(0)
+    os.close(w)
+    chunks, size, timed_out = [], 0, False
+    deadline = started + limits["wall_seconds"]
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([r], [], [], remaining)[0]:
+                timed_out = True
+                break
+            data = os.read(r, 65536)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+            if size > 4 * limits["output_limit"] + 4096:
+                break
+    finally:
+        os.close(r)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        _, status = os.waitpid(pid, 0)
+    ms = round((time.monotonic() - started) * 1000, 1)
+    if timed_out:
+        return {"status": "timeout", "stdout": "", "error": "Tempo limite excedido", "ms": ms}
+    try:
+        result = json.loads(b"".join(chunks))
+    except ValueError:
+        sig = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        if sig == signal.SIGXCPU or sig == signal.SIGKILL:
+            return {"status": "timeout", "stdout": "", "error": "Tempo limite excedido", "ms": ms}
+        return {"status": "crashed", "stdout": "", "error": "O programa foi encerrado", "ms": ms}
+    result["ms"] = ms
+    return result
+
+
+def _reachable_by_others(path: str) -> bool:
+    """True if every directory up to `path` is world-traversable and readable."""
+    path = os.path.realpath(path)
+    while True:
+        if os.stat(path).st_mode & 0o005 != 0o005:
+            return False
+        parent = os.path.dirname(path)
+        if parent == path:
+            return True
+        path = parent
+
+
+def _drop_privileges(user: str, isolated: bool):
+    """Switches the zygote, and so every child, to the sandbox user for good.
+    Submissions never run as root; they only run as the web worker's own uid
+    when the operator vouched for the isolation around the zygote."""
+    if os.getuid() != 0 and os.geteuid() != 0:
+        if not isolated:
+            raise SandboxUnavailable(
+                "o sandbox rodaria com o mesmo usuário do servidor; inicie o servidor como root "
+                "(o sandbox troca para CODEMASTER_SANDBOX_USER) ou configure CODEMASTER_SANDBOX_WRAPPER")
+        return
+    import pwd
+    try:
+        entry = pwd.getpwnam(user)
+    except KeyError:
+        raise SandboxUnavailable(f"usuário do sandbox não existe: {user}") from None
+    if entry.pw_uid == 0:
+        raise SandboxUnavailable(f"o usuário do sandbox não pode ser root: {user}")
+    # The child imports the stdlib after the switch, so it must stay readable
+    if not all(_reachable_by_others(p) for p in (sys.prefix, sys.base_prefix, sys.exec_prefix)):
+        raise SandboxUnavailable(f"a instalação do Python em {sys.prefix} não é legível por {user}")
+    os.setgroups([])
+    os.setgid(entry.pw_gid)
+    os.setuid(entry.pw_uid)
+    try:
+        os.setuid(0)
+    except PermissionError:
+        return
+    raise SandboxUnavailable("não foi possível abandonar os privilégios de root")
+
+
+def _zygote_main(limits: dict, identity: dict):
+    protocol = sys.stdout
+    try:
+        _isolate_network()
+        for name in PREIMPORT:
+            __import__(name)
+        _drop_privileges(identity["user"], identity["isolated"])
+    except SandboxUnavailable as e:
+        protocol.write(json.dumps({"ready": False, "error": str(e)}) + "\n")
+        protocol.flush()
+        return
+    protocol.write(json.dumps({"ready": True, "uid": os.getuid()}) + "\n")
+    protocol.flush()
+    for line in sys.stdin:
+        try:
+            result = _run_job(json.loads(line), limits)
+        except Exception as e:  # keep serving; the pool only sees a failed job
+            result = {"status": "crashed", "stdout": "", "error": f"sandbox: {e}", "ms": 0}
+        protocol.write(json.dumps(result) + "\n")
+        protocol.flush()
+
+
+# ─── Pool (runs in the web worker) ────────────────────────────────────────────
+class SandboxPool:
+    """Fixed set of warm zygotes shared by the worker's request threads.
+
+    Started lazily and rebuilt after fork, like the AI client in app.py.
+    `wrapper` is an argv prefix that isolates the zygote (e.g. bwrap or
+    nsjail); without one, a worker that isn't root can only start the pool
+    with `allow_same_user`. Zygotes get a minimal environment — never the
+    worker's, which holds the API key.
+    """
+
+    def __init__(self, size: int = 2, cpu_seconds: int = 2, memory_mb: int = 256,
+                 wall_seconds: float = 5.0, output_limit: int = 64 * 1024,
+                 queue_timeout: float = 10.0, user: str = "nobody", wrapper: tuple = (),
+                 allow_same_user: bool = False, start_timeout: float = 10.0):
+        if resource is None or not hasattr(os, "fork"):
+            raise SandboxUnavailable("o sandbox precisa de um sistema POSIX")
+        self.size          = size
+        self.queue_timeout = queue_timeout
+        self.start_timeout = start_timeout
+        self.wrapper       = tuple(wrapper)
+        self.limits = {"cpu_seconds": cpu_seconds, "memory_mb": memory_mb,
+                       "wall_seconds": wall_seconds, "output_limit": output_limit}
+        self.identity = {"user": user, "isolated": bool(self.wrapper) or allow_same_user}
+        self.env = {"PATH": os.defpath, "LANG": "C.UTF-8"}
+        if os.environ.get("LD_LIBRARY_PATH"):  # shared-libpython builds need it to start
+            self.env["LD_LIBRARY_PATH"] = os.environ["LD_LIBRARY_PATH"]
+        self._idle  = None
+        self._pid   = None
+        self._error = None
+        self._lock  = threading.Lock()
+        self._missing = 0   # zygotes that died and couldn't be replaced yet
+        self.runs  = 0
+        self.respawns = 0
+
+    def _spawn(self) -> subprocess.Popen:
+        """Starts one zygote and waits for its handshake; raises SandboxUnavailable
+        when it refuses to run (or can't start at all)."""
+        try:
+            zygote = subprocess.Popen(
+                [*self.wrapper, sys.executable, "-I", "-S", os.path.abspath(__file__),
+                 json.dumps(self.limits), json.dumps(self.identity)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                close_fds=True, start_new_session=True, cwd="/", env=self.env,
+            )
+        except OSError as e:
+            raise SandboxUnavailable(f"não foi possível iniciar o sandbox: {e}") from None
+        ready = select.select([zygote.stdout], [], [], self.start_timeout)[0]
+        try:
+            hello = json.loads(zygote.stdout.readline()) if ready else {}
+        except ValueError:
+            hello = {}
+        if not hello.get("ready"):
+            zygote.kill()
+            zygote.wait()
+            raise SandboxUnavailable(hello.get("error") or "o sandbox não respondeu ao iniciar")
+        return zygote
+
+    def start(self):
+        """Spawns the zygotes (idempotent per process). A refusal is remembered,
+        so a misconfigured host doesn't fork a zygote per request."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._error is not None and self._error[0] == os.getpid():
+                    raise SandboxUnavailable(self._error[1])
+                if self._pid != os.getpid():
+                    zygotes = []
+                    try:
+                        for _ in range(self.size):
+                            zygotes.append(self._spawn())
+                    except SandboxUnavailable as e:
+                        for zygote in zygotes:
+                            zygote.kill()
+                            zygote.wait()
+                        self._error = (os.getpid(), str(e))
+                        raise
+                    self._idle = queue.Queue()
+                    for zygote in zygotes:
+                        self._idle.put(zygote)
+                    self._missing = 0
+                    self._pid = os.getpid()
+
+    def _refill(self):
+        """Replaces zygotes lost to a failed respawn. Raises SandboxUnavailable
+        only when none is left to run on."""
+        with self._lock:
+            while self._missing:
+                try:
+                    self._idle.put(self._spawn())
+                except SandboxUnavailable:
+                    if self._missing >= self.size:
+                        raise
+                    return
+                self._missing -= 1
+
+    def run(self, source: str, stdin: str = "") -> dict:
+        """Runs `source`; returns {"status", "stdout", "error", "ms"} where status
+        is "ok", "error", "timeout" or "crashed". Raises SandboxBusy."""
+        self.start()
+        if self._missing:
+            self._refill()
+        try:
+            zygote = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise SandboxBusy() from None
+        try:
+            zygote.stdin.write(json.dumps({"source": source, "stdin": stdin}).encode("utf-8") + b"\n")
+            zygote.stdin.flush()
+            line = zygote.stdout.readline()
+            if not line:
+                raise EOFError("zygote exited")
+            self.runs += 1
+            return json.loads(line)
+        except (OSError, ValueError, EOFError) as e:
+            zygote.kill()
+            zygote.wait()
+            try:
+                zygote = self._spawn()
+                self.respawns += 1
+            except SandboxUnavailable:
+                pass  # the dead one is dropped below; the next run() retries
+            return {"status": "crashed", "stdout": "", "error": f"sandbox: {e}", "ms": 0}
+        finally:
+            if zygote.poll() is None:
+                self._idle.put(zygote)
+            else:
+                with self._lock:
+                    self._missing += 1
+
+    def close(self):
+        if self._idle is None or self._pid != os.getpid():
+            return
+        while True:
+            try:
+                zygote = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            zygote.stdin.close()
+            zygote.wait(timeout=5)
+
+    def stats(self) -> dict:
+        return {"size": self.size, "runs": self.runs, "respawns": self.respawns,
+                "missing": self._missing}
+
+
+if __name__ == "__main__":
+    _zygote_main(json.loads(sys.argv[1]), json.loads(sys.argv[2]))
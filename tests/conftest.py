@@ -0,0 +1,20 @@
+"""Runs the suite against a throwaway directory: importing app.py opens the
+progress and cache databases and builds the content pack, so none of that may
+touch the real ones."""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="codemaster-tests-")
+
+sys.path.insert(0, ROOT)
+os.environ.update({
+    "CODEMASTER_CONTENT_PACK": os.path.join(WORKDIR, "content.pack"),
+    "CODEMASTER_PROGRESS_DB":  os.path.join(WORKDIR, "progress.db"),
+    "CODEMASTER_CACHE_DB":     os.path.join(WORKDIR, "cache.db"),
+    "CODEMASTER_METRICS_DIR":  os.path.join(WORKDIR, "metrics"),
+    "CODEMASTER_VENDOR_LIBS":  "0",
+    "CODEMASTER_PROFILE":      "0",
+})
@@ -0,0 +1,43 @@
+"""/api/bootstrap: one language's static sections, spliced gzip, 304 on repeat."""
+
+import gzip
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_gzip_splice_matches_plain_body():
+    entry = app.CachedBody.from_payload([{"id": i, "text": "x" * i} for i in range(300)])
+    parts = [b'{"a":', (b'"b",', entry), b',"tail":' + b"1" * 5000, (b",", entry), b"}"]
+    assert gzip.decompress(app.gzip_splice(parts)) == app.join_parts(parts)
+
+
+def test_bootstrap_embeds_one_language(client):
+    resp = client.get("/api/bootstrap?lang=python")
+    data = json.loads(resp.get_data())
+    assert "exercises/python" in data["sections"]
+    assert [name for name in data["sections"] if name.startswith("exercises")] == ["exercises/python"]
+    assert all(ex["lang"] == "python" for ex in data["sections"]["exercises/python"])
+
+
+def test_bootstrap_gzip_and_revalidation(client):
+    resp = client.get("/api/bootstrap?lang=python", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200 and resp.headers["Content-Encoding"] == "gzip"
+    plain = client.get("/api/bootstrap?lang=python")
+    data = json.loads(gzip.decompress(resp.get_data()))
+    assert data["sections"]["languages"] == json.loads(plain.get_data())["sections"]["languages"]
+
+    etag = resp.headers["ETag"]
+    again = client.get("/api/bootstrap?lang=python",
+                       headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert again.status_code == 304
+    weak = client.get("/api/bootstrap?lang=python",
+                      headers={"Accept-Encoding": "gzip", "If-None-Match": "W/" + etag})
+    assert weak.status_code == 304
@@ -0,0 +1,20 @@
+"""cached_response: revalidation answers 304 for strong and weak validators alike."""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/api/languages", "/"])
+@pytest.mark.parametrize("weak", [False, True], ids=["strong", "weak"])
+def test_if_none_match(client, path, weak):
+    etag = client.get(path, headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    if weak:  # as rewritten by a compressing proxy such as nginx
+        etag = "W/" + etag
+    again = client.get(path, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert again.status_code == 304
@@ -0,0 +1,50 @@
+"""The migrated single-user progress file goes to its owner, not to whichever
+anonymous visitor happens to arrive first."""
+
+import json
+
+import pytest
+
+import app
+
+REMOTE = {"REMOTE_ADDR": "203.0.113.7"}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps({"xp": 120, "quizzes_taken": 4, "quiz_correct": 3,
+                                  "lessons": ["py-1"], "exercises": []}))
+    store = app.ProgressStore(str(tmp_path / "progress.db"))
+    assert store.migrate_json(str(legacy))
+    monkeypatch.setattr(app, "_progress_store", store)
+    monkeypatch.setattr(app, "_progress", store)
+    monkeypatch.setattr(app, "SINGLE_USER", False)
+    return store
+
+
+def _quizzes_taken(client, **kwargs):
+    return client.get("/api/progress", **kwargs).get_json()["quizzes_taken"]
+
+
+def test_remote_visitor_does_not_inherit(store):
+    assert _quizzes_taken(app.app.test_client(), environ_base=REMOTE) == 0
+    assert _quizzes_taken(app.app.test_client(), headers={"X-Forwarded-For": "203.0.113.7"}) == 0
+
+
+def test_local_visitor_claims(store):
+    assert _quizzes_taken(app.app.test_client()) == 4
+    assert _quizzes_taken(app.app.test_client()) == 0  # claimed once
+
+
+def test_single_user_flag_claims_for_any_visitor(store, monkeypatch):
+    monkeypatch.setattr(app, "SINGLE_USER", True)
+    assert _quizzes_taken(app.app.test_client(), environ_base=REMOTE) == 4
+
+
+def test_explicit_claim_skips_learners_with_progress(store):
+    store.complete_lesson("busy-uid-0123456789", "py-2")
+    assert not store.claim_legacy("busy-uid-0123456789")
+    assert store.claim_legacy("owner-uid-0123456789")
+    assert store.get("owner-uid-0123456789")["quizzes_taken"] == 4
+    assert store.get("busy-uid-0123456789")["quizzes_taken"] == 0
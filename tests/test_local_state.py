@@ -0,0 +1,25 @@
+"""LocalState cache: bounded by total bytes, least recently written goes first."""
+
+import app
+
+
+def test_cache_evicts_least_recently_written_past_budget():
+    state = app.LocalState(max_bytes=100)
+    state.set("a", b"x" * 40, ttl=60)
+    state.set("b", b"x" * 40, ttl=60)
+    state.set("a", b"y" * 40, ttl=60)  # rewritten: now the newest
+    state.set("c", b"x" * 40, ttl=60)
+    assert state.get("b") is None
+    assert state.get("a") == b"y" * 40
+    assert state.get("c") == b"x" * 40
+    assert state._cache_bytes == 80
+
+
+def test_cache_delete_releases_budget():
+    state = app.LocalState(max_bytes=100)
+    state.set("a", b"x" * 60, ttl=60)
+    state.delete("a")
+    state.set("b", b"x" * 60, ttl=60)
+    state.set("c", b"x" * 30, ttl=60)
+    assert state.get("b") is not None and state.get("c") is not None
+    assert state._cache_bytes == 90
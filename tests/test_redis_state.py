@@ -0,0 +1,152 @@
+"""RedisState against a small in-process RESP server: reply parsing, pipelines
+that hit an error, and the lock's compare-and-delete release."""
+
+import io
+import socket
+import socketserver
+import threading
+
+import pytest
+
+import app
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            with self.server.mutex:
+                self.server.commands.append(args)
+                self.wfile.write(self.server.reply(args[0].decode().upper(), args[1:]))
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Just the commands RedisState sends, with EVAL limited to its unlock script."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.data, self.commands, self.mutex = {}, [], threading.Lock()
+        self.after_get = None
+
+    def reply(self, cmd, args):
+        if cmd in ("AUTH", "SELECT"):
+            return b"+OK\r\n"
+        if cmd == "GET":
+            value = self.data.get(args[0])
+            if self.after_get:
+                self.after_get(args[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if cmd == "SET":
+            if b"NX" in args[2:] and args[0] in self.data:
+                return b"$-1\r\n"
+            self.data[args[0]] = args[1]
+            return b"+OK\r\n"
+        if cmd == "DEL":
+            return b":%d\r\n" % (self.data.pop(args[0], None) is not None)
+        if cmd in ("INCR", "DECR"):
+            value = int(self.data.get(args[0], 0)) + (1 if cmd == "INCR" else -1)
+            self.data[args[0]] = str(value).encode()
+            return b":%d\r\n" % value
+        if cmd == "PEXPIRE":
+            return b":1\r\n"
+        if cmd == "EVAL" and args[0].decode() == app._REDIS_UNLOCK:
+            key, token = args[2], args[3]
+            if self.data.get(key) == token:
+                del self.data[key]
+                return b":1\r\n"
+            return b":0\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+@pytest.fixture
+def server():
+    server = FakeRedis()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def state(server):
+    return app.RedisState(f"redis://:secret@127.0.0.1:{server.server_address[1]}/2")
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (b"+OK\r\n", "OK"),
+    (b":42\r\n", 42),
+    (b"$5\r\nhello\r\n", b"hello"),
+    (b"$4\r\na\r\nb\r\n", b"a\r\nb"),           # bulk strings may contain CRLF
+    (b"$0\r\n\r\n", b""),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*3\r\n:1\r\n$1\r\nx\r\n*1\r\n+OK\r\n", [1, b"x", ["OK"]]),
+])
+def test_parses_replies(raw, expected):
+    assert app.RedisState("redis://localhost")._read(io.BytesIO(raw)) == expected
+
+
+def test_error_reply_raises():
+    with pytest.raises(app.StateBackendError, match="WRONGTYPE"):
+        app.RedisState("redis://localhost")._read(io.BytesIO(b"-WRONGTYPE bad\r\n"))
+
+
+def test_truncated_reply_raises():
+    with pytest.raises(ConnectionError):
+        app.RedisState("redis://localhost")._read(io.BytesIO(b""))
+
+
+def test_connects_with_auth_and_select(state, server):
+    assert state.execute(("SET", "k", "v"), ("GET", "k")) == ["OK", b"v"]
+    assert server.commands[:2] == [[b"AUTH", b"secret"], [b"SELECT", b"2"]]
+
+
+def test_pipeline_stays_in_sync_after_an_error(state):
+    with pytest.raises(app.StateBackendError):
+        state.execute(("SET", "k", "v"), ("BOGUS",), ("GET", "k"))
+    assert state.execute(("GET", "k")) == [b"v"]  # the GET reply was drained, not left behind
+
+
+def test_lock_releases_and_excludes(state, server):
+    with state.lock("job", timeout=1):
+        assert b"lock:job" in server.data
+        with pytest.raises(TimeoutError):
+            with state.lock("job", timeout=0.05):
+                pass
+    assert b"lock:job" not in server.data
+
+
+def test_lock_release_spares_a_lock_taken_after_expiry(state, server):
+    with state.lock("job", timeout=1):
+        server.data[b"lock:job"] = b"someone-else"  # ours expired, another holder took it
+    assert server.data[b"lock:job"] == b"someone-else"
+
+
+def test_lock_release_is_atomic(state, server):
+    taken = []
+
+    def expire_and_steal(key):  # ours expires right after being read
+        if key == b"lock:job":
+            server.data[key] = b"someone-else"
+            taken.append(key)
+    with state.lock("job", timeout=1):
+        server.after_get = expire_and_steal
+    assert not taken or server.data.get(b"lock:job") == b"someone-else"
+
+
+def test_unreachable_server_fails_fast_and_clearly():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]  # nothing listens once closed
+    state = app.RedisState(f"redis://127.0.0.1:{port}", timeout=0.5)
+    assert state.hit("k", 1, 60) is True  # rate limiting fails open
+    with pytest.raises(ConnectionError, match="unreachable"):
+        with state.lock("job"):
+            pass
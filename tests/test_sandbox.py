@@ -0,0 +1,170 @@
+"""Sandbox policy (sandbox.py). Submissions only run where the zygote can be
+isolated; elsewhere the run tests are skipped and the refusal tests still run."""
+
+import os
+
+import pytest
+
+from sandbox import SandboxPool, SandboxUnavailable
+
+# Each of these must fail inside the sandbox without printing anything.
+# "rebind tables" is the escape from review: rewrite the policy through the
+# sandbox module's globals, then read a file outside the Python installation.
+ATTACKS = {
+    "import gc": "import gc\nprint(len(gc.get_objects()))",
+    "import __main__": "import __main__\n__main__.BLOCKED_EVENTS = frozenset()\nprint('ok')",
+    "rebind tables": (
+        "import sys\n"
+        "policy = type(sys.stdout).write.__globals__\n"
+        "policy['BLOCKED_EVENTS'] = frozenset()\n"
+        "policy['BLOCKED_PREFIXES'] = ()\n"
+        "policy['BLOCKED_MODULES'] = frozenset()\n"
+        "policy['_WRITE_FLAGS'] = 0\n"
+        "print(open('/etc/hostname').read())\n"
+    ),
+    "patched builtins": (
+        "import builtins, os, posixpath\n"
+        "builtins.isinstance = lambda *a: True\n"
+        "posixpath.realpath = lambda p, **k: '/usr/lib/python3/x'\n"
+        "os.fspath = lambda p: p\n"
+        "print(open('/etc/hostname').read())\n"
+    ),
+    "traceback frame": "try:\n    1/0\nexcept Exception as e:\n    print(e.__traceback__.tb_frame.f_back.f_locals)",
+    "generator frame": "print((i for i in ()).gi_frame.f_back)",
+    "sys._getframe": "import sys\nprint(sys._getframe().f_back.f_locals)",
+    "crafted code": "c = compile('1', 'x', 'eval')\nprint(c.replace(co_consts=(2,)))",
+    # marshal is dropped from sys.modules, but preimported modules keep it
+    "marshal via zipimport": "import zipimport\nprint(zipimport.marshal.loads(b'i\\x07\\x00\\x00\\x00'))",
+    "marshal via importlib": (
+        "import importlib._bootstrap_external as b\n"
+        "exec(b.marshal.loads(b.marshal.dumps(compile('print(1)', 'x', 'exec'))))\n"
+    ),
+    "fork_exec via globals": (
+        "import os\n"
+        "popen = [c for c in object.__subclasses__() if c.__name__ == 'Popen'][0]\n"
+        "fork_exec = popen._execute_child.__globals__['_fork_exec']\n"
+        "r, w = os.pipe()\n"
+        "print(fork_exec([b'/bin/true'], [b'/bin/true'], True, (w,), None, None, -1, -1, -1, -1,\n"
+        "                -1, -1, r, w, False, False, -1, None, None, -1, -1, None, False))\n"
+    ),
+    "read /etc": "print(open('/etc/hostname').read())",
+    "dot-dot": "import sys\nprint(open(sys.prefix + '/lib/../../../../../../etc/hostname').read())",
+    "list /root": "import os\nprint(os.listdir('/root'))",
+    "worker environ": "import os\nprint(open(f'/proc/{os.getppid()}/environ').read())",
+    "socket": "import socket\nprint(socket.create_connection(('1.1.1.1', 53)))",
+    "ctypes": "import ctypes\nprint(ctypes.CDLL(None))",
+    "subprocess": "import sys\nprint(type(sys.stdout).write.__globals__['subprocess'].run(['id']))",
+    "write": "open('/tmp/sandbox-test', 'w').write('x')\nprint('ok')",
+}
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SandboxPool(1, wall_seconds=3)
+    try:
+        pool.start()
+    except SandboxUnavailable as e:
+        pytest.skip(f"sandbox unavailable on this host: {e}")
+    yield pool
+    pool.close()
+
+
+def test_runs_code(pool):
+    result = pool.run("print(int(input()) * 2)", "21\n")
+    assert (result["status"], result["stdout"]) == ("ok", "42\n")
+
+
+def test_reports_student_line(pool):
+    result = pool.run("def f(x):\n    return 1 / x\nf(0)\n")
+    assert result["error"] == "Linha 2: ZeroDivisionError: division by zero"
+
+
+def test_stdlib_that_peeks_at_frames_still_works(pool):
+    source = ("from collections import namedtuple\nfrom typing import TypeVar\nimport warnings\n"
+              "P = namedtuple('P', 'x y')\nT = TypeVar('T')\nwarnings.warn('x')\nprint(P(1, 2))")
+    assert pool.run(source)["stdout"] == "P(x=1, y=2)\n"
+
+
+def test_imports_compile_from_source(pool):
+    # Not preimported, so it is loaded under the hook — without its .pyc
+    assert pool.run("import textwrap\nprint(textwrap.dedent('  a'))")["stdout"] == "a\n"
+
+
+def test_child_has_no_secrets_and_no_root(pool):
+    result = pool.run("import os\nprint(dict(os.environ), os.getuid() != 0)")
+    assert result["stdout"] == "{} True\n"
+
+
+@pytest.mark.parametrize("source", ATTACKS.values(), ids=ATTACKS.keys())
+def test_blocks_escape(pool, source):
+    result = pool.run(source)
+    assert result["status"] in ("error", "crashed")  # crashed: it broke its own builtins
+    assert result["stdout"] == ""
+
+
+def test_zygote_gets_minimal_env(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-ant-secret")
+    assert set(SandboxPool(1).env) <= {"PATH", "LANG", "LD_LIBRARY_PATH"}
+
+
+def test_refuses_to_run_as_root_or_worker_uid():
+    if os.getuid() == 0:
+        pool = SandboxPool(1, user="root")
+    else:
+        pool = SandboxPool(1)  # no wrapper and no same-user opt-in
+    with pytest.raises(SandboxUnavailable):
+        pool.start()
+    with pytest.raises(SandboxUnavailable):  # remembered, not retried per request
+        pool.run("print(1)")
+
+
+class _FakeZygote:
+    """Stands in for a zygote process: answers every job, or dies on the first."""
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.stdin = self
+        self.stdout = self
+
+    def write(self, data):
+        if not self.alive:
+            raise BrokenPipeError()
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return b'{"status": "ok", "stdout": "", "error": null, "ms": 1}\n'
+
+    def kill(self):
+        self.alive = False
+
+    def wait(self, timeout=None):
+        return -9
+
+    def poll(self):
+        return None if self.alive else -9
+
+
+def _fake_pool(monkeypatch, zygotes):
+    pool = SandboxPool(len(zygotes), queue_timeout=0.1)
+    spawned = iter(zygotes)
+    monkeypatch.setattr(pool, "_spawn", lambda: next(spawned))
+    pool.start()
+    return pool
+
+
+def test_dead_zygote_is_dropped_when_respawn_fails(monkeypatch):
+    pool = _fake_pool(monkeypatch, [_FakeZygote(alive=False)])
+
+    def refuse():
+        raise SandboxUnavailable("no")
+    monkeypatch.setattr(pool, "_spawn", refuse)
+    assert pool.run("print(1)")["status"] == "crashed"
+    assert pool._idle.empty() and pool.stats()["missing"] == 1
+    with pytest.raises(SandboxUnavailable):  # nothing left to run on
+        pool.run("print(1)")
+
+    monkeypatch.setattr(pool, "_spawn", _FakeZygote)
+    assert pool.run("print(1)")["status"] == "ok"
+    assert pool.stats()["missing"] == 0
@@ -0,0 +1,80 @@
+"""SearchIndex: lang/kind filters apply to both the hits and the reported total,
+and a total cut short by the postings cap is flagged as inexact."""
+
+import pytest
+
+import app
+
+LANGS = ("python", "javascript")
+
+
+def _lesson(lang, i):
+    return {"id": f"{lang}-l{i}", "title": f"Recursão {i}", "level": "básico",
+            "theory": "Uma função recursiva chama a si mesma.", "code": "f(n - 1)"}
+
+
+def _exercise(lang, i):
+    return {"id": f"{lang}-e{i}", "lang": lang, "level": "básico", "title": f"Recursão {i}",
+            "desc": "Escreva uma função recursiva.", "starter": "", "solution": ""}
+
+
+def _quiz(lang, i):
+    return {"id": f"{lang}-q{i}", "lang": lang, "level": "básico", "q": "O que é recursão?",
+            "opts": ["Uma função que chama a si mesma", "Um laço"], "ans": 0, "exp": ""}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    dest = str(tmp_path_factory.mktemp("search") / "content.pack")
+    app.write_content_pack(
+        [{"id": lang, "name": lang} for lang in LANGS],
+        {"python": [_lesson("python", i) for i in range(6)],
+         "javascript": [_lesson("javascript", i) for i in range(2)]},
+        [_exercise("python", i) for i in range(9)] + [_exercise("javascript", i) for i in range(3)],
+        [_quiz("python", i) for i in range(4)] + [_quiz("javascript", i) for i in range(1)],
+        dest)
+    return app.ContentPack(dest).search_index()
+
+
+def test_unfiltered_total_counts_every_match(index):
+    hits, total, exact = index.search("recursao ", limit=5)
+    assert len(hits) == 5
+    assert total == 6 + 2 + 9 + 3 + 4 + 1 and exact
+
+
+@pytest.mark.parametrize("lang, kind, expected", [
+    ("javascript", "", 2 + 3 + 1),
+    ("", "exercise", 9 + 3),
+    ("javascript", "exercise", 3),
+    ("python", "quiz", 4),
+])
+def test_filters_apply_to_hits_and_total(index, lang, kind, expected):
+    hits, total, exact = index.search("recursao ", limit=2, lang=lang, kind=kind)
+    assert total == expected and exact
+    assert len(hits) == min(2, expected)
+    assert all((not lang or h["lang"] == lang) and (not kind or h["kind"] == kind) for h in hits)
+
+
+def test_filtered_total_when_all_hits_fit(index):
+    hits, total, exact = index.search("recursao ", limit=50, lang="javascript", kind="exercise")
+    assert total == len(hits) == 3
+
+
+def test_filters_on_multi_term_query(index):
+    hits, total, exact = index.search("funcao recursiva", limit=50, kind="lesson", lang="python")
+    assert total == len(hits) == 6
+    assert {h["id"] for h in hits} == {f"python-l{i}" for i in range(6)}
+
+
+def test_capped_multi_term_total_is_flagged(index, monkeypatch):
+    hits, total, exact = index.search("funcao recursiva", limit=50)
+    assert exact and total == len(hits)
+    monkeypatch.setattr(app, "SEARCH_MAX_POSTINGS", 4)
+    hits, total, exact = index.search("funcao recursiva", limit=50)
+    assert not exact and total == len(hits) < 6 + 2 + 9 + 3
+
+
+def test_api_reports_whether_total_is_exact():
+    client = app.app.test_client()
+    data = client.get("/api/search?q=funcao").get_json()
+    assert data["total_exact"] is True and data["total"] >= len(data["results"])
@@ -0,0 +1,71 @@
+"""WriteBehindProgress: a worker always reads its own writes, whether they are
+still buffered, being flushed or already committed, and never counts one twice."""
+
+import os
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def store(tmp_path):
+    return app.ProgressStore(str(tmp_path / "progress.db"))
+
+
+def _progress(store, **kwargs):
+    # A flusher that never wakes on its own: the tests flush explicitly
+    return app.WriteBehindProgress(store, interval=3600, max_pending=10**6, **kwargs)
+
+
+def test_reads_own_writes_across_flushes(store):
+    wb, uid = _progress(store), "u" * 16
+    wb.complete_lesson(uid, "py-1", 50)
+    assert wb.get(uid)["xp"] == 50
+    assert store.get(uid)["xp"] == 0  # still buffered
+    wb.flush()
+    assert wb.get(uid)["xp"] == store.get(uid)["xp"] == 50
+    wb.complete_lesson(uid, "py-1", 50)  # already done: no XP
+    wb.complete_exercise(uid, "ex-1", 100)
+    wb.record_quiz(uid, 3, 20)
+    assert wb.get(uid)["xp"] == 210
+    wb.flush()
+    assert wb.get(uid)["xp"] == store.get(uid)["xp"] == 210
+
+
+def test_never_double_counts_while_flushing(store):
+    wb, uid = _progress(store), "v" * 16
+    stop, seen = threading.Event(), []
+
+    def flusher():
+        while not stop.is_set():
+            wb.flush()
+
+    thread = threading.Thread(target=flusher)
+    thread.start()
+    try:
+        for i in range(300):
+            wb.record_quiz(uid, 1, 1)
+            seen.append((i + 1, wb.get(uid)["xp"]))
+    finally:
+        stop.set()
+        thread.join()
+    wb.flush()
+    assert all(xp == expected for expected, xp in seen)
+    assert store.get(uid)["xp"] == 300
+
+
+def test_forked_child_reseeds_above_a_reused_pid_marker(store, monkeypatch):
+    wb, uid = _progress(store), "w" * 16
+    wb.complete_lesson(uid, "py-1", 50)  # flusher started in the "parent"
+    wb.flush()
+    # An earlier process with the pid the child gets started after the parent
+    # did, so its committed marker is above the parent's sequence numbers
+    monkeypatch.setattr(os, "getpid", lambda: 4_000_000)
+    store.write([], marker=(wb._marker, str(time.time_ns())))
+    wb.complete_exercise(uid, "ex-1", 100)
+    assert wb.get(uid)["xp"] == 150
+    wb.flush()
+    assert wb.get(uid)["xp"] == store.get(uid)["xp"] == 150